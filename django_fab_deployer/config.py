@@ -0,0 +1,379 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import difflib
+import hashlib
+import io
+import json
+import os
+
+import six
+
+from .exceptions import InvalidConfiguration, MissingConfiguration
+from .utils import find_file_in_path, local_state_path
+
+DEPLOYMENT_CONFIG_FILE = "deploy.json"
+CACHE_FILE = "config-cache.json"
+
+DEFAULTS_KEY = "defaults"
+INCLUDE_KEY = "include"
+EXTENDS_KEY = "extends"
+ABSTRACT_KEY = "abstract"
+
+STRING = six.string_types
+BOOL = (bool,)
+INT = six.integer_types
+NUMBER = six.integer_types + (float,)
+LIST = (list,)
+DICT = (dict,)
+NULL = (type(None),)
+
+REQUIRED_OPTIONS = ['user', 'hosts', 'deploy_path', 'project_name', 'venv_path']
+
+SCHEMA = {
+    'user': STRING,
+    'hosts': STRING + LIST + DICT,
+    'primary_host': STRING,
+    'pool_size': INT,
+    'parallel_hosts': BOOL,
+    'deploy_path': STRING,
+    'atomic_releases': BOOL,
+    'repository': STRING + NULL,
+    'keep_releases': INT,
+    'release_venv': BOOL,
+    'project_name': STRING,
+    'supervisor_program': STRING,
+    'db_name': STRING,
+    'venv_path': STRING,
+    'celery_enabled': BOOL,
+    'celery_workers': LIST,
+    'huey_enabled': BOOL,
+    'opbeat_enabled': BOOL,
+    'opbeat_authorization_bearer': STRING,
+    'opbeat_organization_id': STRING + INT,
+    'opbeat_app_id': STRING + INT,
+    'yarn_enabled': BOOL,
+    'celerybeat_enabled': BOOL,
+    'clear_cache': BOOL,
+    'backup_db': BOOL,
+    'db_engine': STRING,
+    'pytest': BOOL,
+    'compress_enabled': BOOL,
+    'static_builds': BOOL,
+    'extra_databases': LIST,
+    'export_env': DICT,
+    'source_branch': STRING,
+    'graceful_restart': BOOL,
+    'deploy_stages': DICT,
+    'parallel_stages': BOOL,
+    'persistent_manage': BOOL,
+    'skip_unchanged_installs': BOOL,
+    'wheelhouse_enabled': BOOL,
+    'wheelhouse_build_host': STRING,
+    'keep_wheelhouses': INT,
+    'dump_compression': STRING,
+    'dump_compression_level': INT + NULL,
+    'dump_compression_threads': INT,
+    'dump_command': STRING + NULL,
+    'dump_format': STRING,
+    'dump_jobs': INT,
+    'dump_tables': LIST,
+    'dump_exclude_tables': LIST,
+    'media_sync_streams': INT,
+    'deploy_timings': BOOL,
+    'ssh_multiplexing': BOOL,
+    'rolling_restart': BOOL,
+    'rolling_max_unavailable': INT + STRING,
+    'health_url': STRING + NULL,
+    'health_timeout': NUMBER,
+    'worker_ready_timeout': NUMBER,
+    'resource_sampling': BOOL,
+    'resource_sampling_interval': NUMBER,
+    'latency_check': BOOL,
+    'latency_requests': INT,
+    'latency_concurrency': INT,
+    'latency_threshold': NUMBER,
+    'latency_on_regression': STRING,
+    'warmup_urls': LIST,
+    'warmup_sitemap': STRING + NULL,
+    'warmup_command': STRING + NULL,
+    'warmup_concurrency': INT,
+    'warmup_max_urls': INT,
+    'django_settings_module': STRING + NULL,
+    'key_filename': STRING,
+    'urls_to_check': LIST,
+    'urls_to_check_verify_ssl_certificate': BOOL,
+    'urls_to_check_concurrency': INT,
+    'urls_to_check_timeout': NUMBER,
+    'urls_to_check_retries': INT,
+    'urls_to_check_backoff': NUMBER,
+    'warn_on_deploy': BOOL,
+}
+
+CHOICES = {
+    'db_engine': ['postgresql', 'mysql'],
+    'dump_compression': ['gzip', 'none', 'zstd'],
+    'dump_format': ['custom', 'directory', 'plain'],
+    'latency_on_regression': ['fail', 'rollback', 'warn'],
+}
+
+_TYPE_NAMES = [(bool, 'boolean'), (float, 'number'), (list, 'list'), (dict, 'object'), (type(None), 'null')]
+
+
+def _type_name(value_or_type):
+    value_type = value_or_type if isinstance(value_or_type, type) else type(value_or_type)
+
+    if issubclass(value_type, six.string_types):
+        return 'string'
+
+    for known_type, name in _TYPE_NAMES:
+        if issubclass(value_type, known_type):
+            return name
+
+    return 'integer' if issubclass(value_type, six.integer_types) else value_type.__name__
+
+
+def find_config():
+    path_list_to_search = [
+        # Current directory
+        os.getcwd(),
+        # Parent directory
+        os.path.abspath(os.path.join(os.getcwd(), os.pardir))
+    ]
+
+    path = find_file_in_path(DEPLOYMENT_CONFIG_FILE, path_list_to_search)
+
+    if not path:
+        raise MissingConfiguration(
+            "Configuration file `{0}` was not found in `{1}`".format(DEPLOYMENT_CONFIG_FILE, path_list_to_search)
+        )
+
+    return os.path.abspath(path)
+
+
+def _read(path, sources):
+    try:
+        with io.open(path, "rb") as config_file:
+            data = config_file.read()
+    except IOError as e:
+        raise MissingConfiguration("Cannot read configuration file `{0}`: {1}".format(path, e))
+
+    stat = os.stat(path)
+    sources.append([path, stat.st_mtime, stat.st_size, hashlib.sha256(data).hexdigest()])
+
+    try:
+        parsed = json.loads(data.decode('utf-8'))
+    except ValueError as e:
+        raise InvalidConfiguration("Cannot load your deployment configuration `{0}`. JSON file is probably broken. Additional message: {1}".format(path, e))
+
+    if not isinstance(parsed, dict):
+        raise InvalidConfiguration("`{0}` must contain an object of targets, not {1}".format(path, _type_name(parsed)))
+
+    return parsed
+
+
+def _deep_merge(base, override):
+    merged = dict(base)
+
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _deep_merge(merged[key], value)
+        else:
+            merged[key] = value
+
+    return merged
+
+
+def _load_tree(path, sources, including=()):
+    """
+    Returns ``(defaults, targets)`` of ``path`` with its includes merged in; every target remembers its file.
+    """
+    if path in including:
+        raise InvalidConfiguration("Configuration files include each other: {0}".format(" -> ".join(including + (path,))))
+
+    data = _read(path, sources)
+    defaults = {}
+    targets = {}
+
+    includes = data.pop(INCLUDE_KEY, [])
+
+    if isinstance(includes, six.string_types):
+        includes = [includes]
+
+    if not isinstance(includes, list) or not all(isinstance(one_include, six.string_types) for one_include in includes):
+        raise InvalidConfiguration("`{0}`: `{1}` must be a file name or a list of file names".format(path, INCLUDE_KEY))
+
+    # Included files come first, the including file overrides them
+    for one_include in includes:
+        include_path = os.path.normpath(os.path.join(os.path.dirname(path), one_include))
+        include_defaults, include_targets = _load_tree(include_path, sources, including + (path,))
+        defaults = _deep_merge(defaults, include_defaults)
+        targets.update(include_targets)
+
+    own_defaults = data.pop(DEFAULTS_KEY, {})
+
+    if not isinstance(own_defaults, dict):
+        raise InvalidConfiguration("`{0}`: `{1}` must be an object, not {2}".format(path, DEFAULTS_KEY, _type_name(own_defaults)))
+
+    _validate(own_defaults, "`{0}`, {1}".format(path, DEFAULTS_KEY), partial=True)
+    defaults = _deep_merge(defaults, own_defaults)
+
+    for target, options in data.items():
+        if not isinstance(options, dict):
+            raise InvalidConfiguration("`{0}`, target `{1}`: must be an object of options, not {2}".format(path, target, _type_name(options)))
+
+        targets[target] = (path, options)
+
+    return defaults, targets
+
+
+def _resolve(target, targets, resolving=()):
+    if target not in targets:
+        raise InvalidConfiguration("Target `{0}` extends unknown target `{1}`{2}".format(resolving[-1], target, _suggestion(target, targets)))
+
+    if target in resolving:
+        raise InvalidConfiguration("Targets extend each other: {0}".format(" -> ".join(resolving + (target,))))
+
+    path, options = targets[target]
+    parents = options.get(EXTENDS_KEY, [])
+
+    if isinstance(parents, six.string_types):
+        parents = [parents]
+
+    if not isinstance(parents, list):
+        raise InvalidConfiguration("`{0}`, target `{1}`: `{2}` must be a target name or a list of them".format(path, target, EXTENDS_KEY))
+
+    resolved = {}
+
+    for parent in parents:
+        resolved = _deep_merge(resolved, _resolve(parent, targets, resolving + (target,)))
+
+    own = dict((key, value) for key, value in options.items() if key not in (EXTENDS_KEY, ABSTRACT_KEY))
+
+    return _deep_merge(resolved, own)
+
+
+def _suggestion(name, candidates):
+    matches = difflib.get_close_matches(name, list(candidates), n=1)
+
+    return " (did you mean `{0}`?)".format(matches[0]) if matches else ""
+
+
+def _validate(options, where, partial=False):
+    for key, value in sorted(options.items()):
+        if key in (EXTENDS_KEY, ABSTRACT_KEY):
+            continue
+
+        if key not in SCHEMA:
+            raise InvalidConfiguration("{0}: unknown option `{1}`{2}".format(where, key, _suggestion(key, SCHEMA)))
+
+        allowed = SCHEMA[key]
+
+        # JSON booleans are ints in Python, they are accepted only where a boolean is expected
+        if not isinstance(value, allowed) or (isinstance(value, bool) and bool not in allowed):
+            raise InvalidConfiguration("{0}: option `{1}` must be {2}, not {3} ({4})".format(
+                where, key, " or ".join(sorted(set(_type_name(one_type) for one_type in allowed))), _type_name(value), json.dumps(value)))
+
+        if key in CHOICES and value not in CHOICES[key]:
+            raise InvalidConfiguration("{0}: option `{1}` must be one of {2}, not {3}".format(
+                where, key, ", ".join("`{0}`".format(choice) for choice in CHOICES[key]), json.dumps(value)))
+
+    if not partial:
+        missing = [key for key in REQUIRED_OPTIONS if key not in options]
+
+        if missing:
+            raise InvalidConfiguration("{0}: missing required option(s) {1}".format(where, ", ".join("`{0}`".format(key) for key in missing)))
+
+
+def compile_config(path):
+    """
+    Read ``path`` with its includes, apply defaults and `extends` and validate every target.
+    Returns ``(targets, sources)``, sources being the files read with their mtime, size and hash.
+    """
+    sources = []
+    defaults, targets = _load_tree(path, sources)
+    compiled = {}
+
+    for target, (target_path, options) in targets.items():
+        where = "`{0}`, target `{1}`".format(target_path, target)
+        _validate(options, where, partial=True)
+
+        if options.get(ABSTRACT_KEY):
+            continue
+
+        resolved = _deep_merge(defaults, _resolve(target, targets))
+        _validate(resolved, where)
+        compiled[target] = resolved
+
+    return compiled, sources
+
+
+def _schema_key():
+    # Any change of an option's types, of the allowed choices or of the required options invalidates the cache
+    schema = dict((option, sorted(kind.__name__ for kind in kinds)) for option, kinds in SCHEMA.items())
+
+    return hashlib.sha256(json.dumps([schema, CHOICES, REQUIRED_OPTIONS], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _source_unchanged(source):
+    path, mtime, size, checksum = source
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+
+    if stat.st_mtime == mtime and stat.st_size == size:
+        return True
+
+    # A checkout or a copy touches the file without changing it
+    with io.open(path, "rb") as config_file:
+        return hashlib.sha256(config_file.read()).hexdigest() == checksum
+
+
+def _cached(path):
+    try:
+        with io.open(local_state_path(CACHE_FILE), encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, ValueError):
+        return None
+
+    if cache.get('path') != path or cache.get('schema') != _schema_key():
+        return None
+
+    if not all(_source_unchanged(source) for source in cache.get('sources', [])):
+        return None
+
+    return cache['targets']
+
+
+def _store(path, targets, sources):
+    cache_path = local_state_path(CACHE_FILE)
+
+    try:
+        if not os.path.isdir(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+
+        with io.open(cache_path + ".tmp", "w", encoding='utf-8') as cache_file:
+            cache_file.write(six.text_type(json.dumps({'path': path, 'schema': _schema_key(), 'sources': sources, 'targets': targets})))
+
+        os.rename(cache_path + ".tmp", cache_path)
+    except (IOError, OSError):
+        # The cache only saves time, a read-only checkout still works
+        pass
+
+
+def load_targets(path=None):
+    """
+    Compiled targets of the deployment configuration, from the cache when none of its files changed.
+    """
+    path = path or find_config()
+    targets = _cached(path)
+
+    if targets is None:
+        targets, sources = compile_config(path)
+        _store(path, targets, sources)
+
+    return targets
@@ -0,0 +1,218 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import json
+import time
+
+from colorama import Fore, Style
+from fabric.api import env, run
+from fabric.context_managers import settings, hide
+from fabric.utils import abort
+
+from .exceptions import InvalidConfiguration
+from .multihost import is_primary_host
+from .remote import REMOTE_STATE_DIR, SCRIPT_HEADER, SYSTEM_PYTHON, python_command
+from .utils import print_table
+
+# Steps of `clean` (and the JSON backup) which may run after the restart: name, management commands, primary host only
+BUILTIN_JOBS = [
+    ('clearsessions', ['clearsessions'], True),
+    ('thumbnail_clear', ['thumbnail clear'], False),
+    ('compile_pyc', ['clean_pyc --optimize --path=src/', 'compile_pyc --path=src/'], False),
+    ('backup', ['dumpdata --format json --all --indent=3 --output data/deployment_backup/$(date -u +%Y-%m-%d_%H.%M.%S)-dump.json'], True),
+]
+
+KEEP_RUNS = 10
+RESULT_MARKER = "@@djdeploy-deferred "
+LOG_TAIL_LINES = 20
+
+# Runs the jobs one after another so that they compete with live traffic as little as possible. The state of
+# every job is kept in `status.json` next to the job logs and replaced atomically after each change.
+RUNNER_SCRIPT = SCRIPT_HEADER + r'''
+import os, shutil, subprocess, time
+
+directory = os.path.join(PAYLOAD["root"], PAYLOAD["run"])
+os.makedirs(directory)
+
+runs = sorted(name for name in os.listdir(PAYLOAD["root"]) if os.path.isdir(os.path.join(PAYLOAD["root"], name)))
+
+for old_run in runs[:-PAYLOAD["keep"]]:
+    shutil.rmtree(os.path.join(PAYLOAD["root"], old_run), ignore_errors=True)
+
+status = {"run": PAYLOAD["run"], "pid": os.getpid(), "jobs": [dict(name=job["name"], state="pending") for job in PAYLOAD["jobs"]]}
+
+def save():
+    with open(os.path.join(directory, "status.json.tmp"), "w") as status_file:
+        json.dump(status, status_file)
+    os.rename(os.path.join(directory, "status.json.tmp"), os.path.join(directory, "status.json"))
+
+save()
+environment = dict(os.environ, **PAYLOAD["env"])
+
+for job, job_status in zip(PAYLOAD["jobs"], status["jobs"]):
+    job_status.update(state="running", start=time.time())
+    save()
+    with open(os.path.join(directory, job["name"] + ".log"), "wb") as log:
+        code = subprocess.call(["/bin/bash", "-c", job["command"]], cwd=PAYLOAD["cwd"], env=environment, stdout=log, stderr=subprocess.STDOUT)
+    job_status.update(state="ok" if code == 0 else "failed", exit_code=code, end=time.time())
+    save()
+'''
+
+STATUS_SCRIPT = SCRIPT_HEADER + r'''
+import errno, os, time
+
+runs = []
+names = sorted(name for name in os.listdir(PAYLOAD["root"]) if os.path.isdir(os.path.join(PAYLOAD["root"], name))) if os.path.isdir(PAYLOAD["root"]) else []
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+for name in names[-PAYLOAD["runs"]:]:
+    try:
+        with open(os.path.join(PAYLOAD["root"], name, "status.json")) as status_file:
+            status = json.load(status_file)
+    except (IOError, ValueError):
+        continue
+    for job in status["jobs"]:
+        # The runner was killed, e.g. by a reboot
+        if job["state"] in ("pending", "running") and not alive(status["pid"]):
+            job["state"] = "lost"
+        try:
+            with open(os.path.join(PAYLOAD["root"], name, job["name"] + ".log"), "rb") as log:
+                job["log"] = log.read().decode("utf-8", "replace").splitlines()[-PAYLOAD["tail"]:]
+        except IOError:
+            job["log"] = []
+    runs.append(status)
+
+print(PAYLOAD["marker"] + json.dumps({"runs": runs, "now": time.time()}))
+'''
+
+
+def deferred_names():
+    return list(env.deploy_stages.get('deferred', []))
+
+
+def validate():
+    known = [name for name, commands, primary in BUILTIN_JOBS] + [options.get('name') for options in env.deploy_stages.get('extra', [])]
+
+    for name in deferred_names():
+        if name not in known:
+            raise InvalidConfiguration("Cannot defer unknown stage `{0}`, deferrable are: {1}".format(name, ", ".join(known)))
+
+
+def is_deferred(name):
+    return name in deferred_names()
+
+
+def jobs():
+    """
+    Deferred jobs of the current host as ``{'name', 'command'}``, commands run in the deploy path.
+    """
+    host_jobs = []
+    venv = "source {0} && ".format(env.venv_path)
+
+    for name, commands, primary in BUILTIN_JOBS:
+        # Sessions are cleared together with the cache
+        if name == 'clearsessions' and not env.clear_cache:
+            continue
+
+        if is_deferred(name) and (is_primary_host() or not primary):
+            prefix = "mkdir -p data/deployment_backup && " if name == 'backup' else ""
+            host_jobs.append({'name': name, 'command': prefix + venv + " && ".join("python src/manage.py " + command for command in commands)})
+
+    for options in env.deploy_stages.get('extra', []):
+        if is_deferred(options['name']):
+            host_jobs.append({'name': options['name'], 'command': (venv if options.get('venv', True) else "") + options['command']})
+
+    return host_jobs
+
+
+def _root():
+    return "{0}/{1}/deferred".format(env.deploy_root.rstrip("/"), REMOTE_STATE_DIR)
+
+
+def start():
+    """
+    Start the deferred jobs of the current host in the background and return right away.
+    """
+    host_jobs = jobs()
+
+    if not host_jobs:
+        return None
+
+    run_id = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+    payload = {'root': _root(), 'run': run_id, 'keep': KEEP_RUNS, 'jobs': host_jobs, 'cwd': env.deploy_path, 'env': env.export_env}
+
+    with settings(hide('running')):
+        run("mkdir -p {root} && (nohup {runner} > {root}/runner.log 2>&1 < /dev/null &)".format(root=_root(),
+                                                                                                runner=python_command(RUNNER_SCRIPT, payload, python=SYSTEM_PYTHON)),
+            pty=False)
+
+    print(Fore.BLUE + "Deferred {0} running in the background: {1}".format("job" if len(host_jobs) == 1 else "jobs",
+                                                                          ", ".join(job['name'] for job in host_jobs)))
+
+    return run_id
+
+
+def fetch_status(runs=1, tail=LOG_TAIL_LINES):
+    payload = {'root': _root(), 'runs': runs, 'tail': tail, 'marker': RESULT_MARKER}
+
+    with settings(hide('running', 'stdout'), warn_only=True):
+        output = run(python_command(STATUS_SCRIPT, payload, python=SYSTEM_PYTHON), pty=False)
+
+    for line in output.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+
+    abort("Cannot read the state of deferred jobs: {0}".format(output.strip()[-500:]))
+
+
+def _duration(job, now):
+    if 'start' not in job:
+        return '-'
+
+    return '{0:.1f}'.format(job.get('end', now) - job['start'])
+
+
+def print_status(status, log=None):
+    from terminaltables import AsciiTable
+
+    if not status['runs']:
+        print(Fore.YELLOW + "No deferred jobs have run on {0}".format(env.host_string))
+        return
+
+    for one_run in status['runs']:
+        rows = [['Job', 'State', 'Exit code', 'Time [s]', 'Last output']]
+
+        for job in one_run['jobs']:
+            rows.append([job['name'],
+                         job['state'].upper(),
+                         '{0}'.format(job['exit_code']) if 'exit_code' in job else '-',
+                         _duration(job, status['now']),
+                         job['log'][-1][:80] if job['log'] else ''])
+
+        table = AsciiTable(rows, " Deferred jobs {0} ".format(one_run['run']))
+        table.justify_columns[2] = 'right'
+        table.justify_columns[3] = 'right'
+        print_table(table)
+
+        for job in one_run['jobs']:
+            if job['name'] == log or (log is None and job['state'] in ('failed', 'lost')):
+                print(Fore.YELLOW + "Output of `{0}`:".format(job['name']))
+                print("\n".join(job['log']))
+
+    failed = [job['name'] for one_run in status['runs'][-1:] for job in one_run['jobs'] if job['state'] in ('failed', 'lost')]
+    running = [job['name'] for one_run in status['runs'][-1:] for job in one_run['jobs'] if job['state'] in ('pending', 'running')]
+
+    if failed:
+        print(Fore.RED + Style.BRIGHT + "Failed: {0}".format(", ".join(failed)))
+    elif running:
+        print(Fore.BLUE + "Still running: {0}".format(", ".join(running)))
+    else:
+        print(Fore.GREEN + Style.BRIGHT + "All deferred jobs done.")
@@ -3,52 +3,38 @@
 
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
-import json
-import logging
 import os
 import sys
-import tempfile
 import time
+from functools import partial
 from time import gmtime, strftime
 
-import environ
-import requests
-
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
 from colorama import init, Fore, Back, Style
 from fabric.api import env
 from fabric.api import get
 from fabric.context_managers import cd, settings, hide, shell_env, lcd
 from fabric.contrib.console import confirm
-from fabric.contrib.project import rsync_project
 from fabric.decorators import task, runs_once
 from fabric.network import needs_host
 from fabric.operations import os, run, local
 from fabric.utils import abort
 
-from .exceptions import InvalidConfiguration, MissingConfiguration, FabricException
-from .utils import fab_arg_to_bool, find_file_in_path
+# Modules needed by single tasks are imported inside of them, `djdeploy --list` only loads these
+from . import config, rolling, tracing
+from .exceptions import InvalidConfiguration, FabricException
+from .multihost import DEFAULT_POOL_SIZE, fan_out, hosts_for_roles, is_primary_host, on_hosts, primary_only
+from .remote import rsync_ssh_opts, venv_run
+from .stages import Stage, run_stages
+from .utils import fab_arg_to_bool, parse_hosts
 
 __all__ = []
 
-DEPLOYMENT_CONFIG_FILE = "deploy.json"
 DEFAULT_SOURCE_BRANCH = "master"
+PYTHON_TOOLS = ['setuptools', 'wheel', 'ipython', 'ipdb']
 
 init(autoreset=True)
 
 
-def _print_table(table):
-    try:
-        print(table.table)
-    except UnicodeEncodeError:
-        import pprint
-        pp = pprint.PrettyPrinter(indent=4)
-        pp.pprint(table.table_data)
-
-
 def _print_deployment_summary(env):
     print(Fore.YELLOW + "- - - - - - - - - - - - - - - - - - - -")
     print(Fore.YELLOW + "Deployment configuration")
@@ -59,54 +45,123 @@ def _print_deployment_summary(env):
     print('{0:<10} {1:<8}'.format("User:", env.user))
     print('{0:<10} {1:<8}'.format("Host(s):", "; ".join(env.hosts)))
 
+    if len(env.hosts) > 1:
+        print('{0:<10} {1:<8}'.format("Primary:", env.primary_host))
+        print('{0:<10} {1:<8}'.format("Parallel:", "{0} (pool of {1})".format(env.parallel_hosts, env.pool_size)))
+
     print(Fore.YELLOW + "- - - - - - - - - - - - - - - - - - - -")
 
 
+def _apply_options(target, options, roles=None):
+    """
+    Set up `env` for ``target`` from its compiled options.
+    """
+    from . import healthcheck, latency, mediasync, releases, sampler, sshmux, warmup, wheelhouse, workers
+
+    env.user = options["user"]
+    env.hosts, env.roledefs = parse_hosts(options["hosts"])
+    env.primary_host = options.get('primary_host', env.hosts[0])
+    env.pool_size = options.get('pool_size', DEFAULT_POOL_SIZE)
+    env.parallel_hosts = options.get('parallel_hosts', True)
+
+    if roles:
+        # djdeploy production:web;worker deploy
+        env.hosts = hosts_for_roles(roles.split(";"))
+
+    env.target_name = target
+    env.deploy_root = options["deploy_path"]
+    env.atomic_releases = options.get('atomic_releases', False)
+    env.deploy_path = releases.current_path() if env.atomic_releases else env.deploy_root
+    env.repository = options.get('repository')
+    env.keep_releases = options.get('keep_releases', releases.DEFAULT_KEEP_RELEASES)
+    env.project_name = options["project_name"]
+    env.supervisor_program = options["supervisor_program"] if "supervisor_program" in options else env.project_name
+    env.db_name = options["db_name"] if "db_name" in options else env.project_name
+    env.release_venv = env.atomic_releases and options.get('release_venv', False)
+    env.venv_path = releases.RELEASE_VENV + "/bin/activate" if env.release_venv else options["venv_path"]
+    env.celery_enabled = options.get('celery_enabled', False)
+    env.celery_workers = options.get('celery_workers', [])
+    env.huey_enabled = options.get('huey_enabled', False)
+    env.opbeat_enabled = options.get('opbeat_enabled', False)
+
+    if env.opbeat_enabled:
+        env.opbeat_authorization_bearer = options.get('opbeat_authorization_bearer')
+        env.opbeat_organization_id = options.get('opbeat_organization_id')
+        env.opbeat_app_id = options.get('opbeat_app_id')
+
+    env.yarn_enabled = options.get('yarn_enabled', False)
+    env.celerybeat_enabled = options.get('celerybeat_enabled', False)
+    env.clear_cache = options.get('clear_cache', True)
+    env.backup_db = options.get('backup_db', True)
+    env.db_engine = options.get('db_engine', 'postgresql')
+    env.pytest = options.get('pytest', False)
+    env.compress_enabled = options.get('compress_enabled', True)
+    env.static_builds = options.get('static_builds', False)
+    env.extra_databases = options["extra_databases"] if "extra_databases" in options else []
+    env_to_export = options["export_env"] if "export_env" in options else {}
+    env.export_env = env_to_export
+    env.use_ssh_config = False
+    env.source_branch = options.get('source_branch', DEFAULT_SOURCE_BRANCH)
+    env.graceful_restart = options.get('graceful_restart', False)
+    env.deploy_stages = options.get('deploy_stages', {})
+    env.parallel_stages = options.get('parallel_stages', True)
+    env.persistent_manage = options.get('persistent_manage', False)
+    env.skip_unchanged_installs = options.get('skip_unchanged_installs', True)
+    env.wheelhouse_enabled = options.get('wheelhouse_enabled', False)
+    env.wheelhouse_build_host = options.get('wheelhouse_build_host', wheelhouse.BUILD_HOST_LOCAL)
+    env.keep_wheelhouses = options.get('keep_wheelhouses', wheelhouse.DEFAULT_KEEP_WHEELHOUSES)
+    env.dump_compression = options.get('dump_compression', 'gzip')
+    env.dump_compression_level = options.get('dump_compression_level')
+    env.dump_compression_threads = options.get('dump_compression_threads', 0)
+    env.dump_command = options.get('dump_command')
+    env.dump_format = options.get('dump_format', 'custom')
+    env.dump_jobs = options.get('dump_jobs', 0)
+    env.dump_tables = options.get('dump_tables', [])
+    env.dump_exclude_tables = options.get('dump_exclude_tables', [])
+    env.media_sync_streams = options.get('media_sync_streams', mediasync.DEFAULT_STREAMS)
+    env.deploy_timings = options.get('deploy_timings', True)
+    env.ssh_multiplexing = options.get('ssh_multiplexing', False)
+    env.rolling_restart = options.get('rolling_restart', False)
+    env.rolling_max_unavailable = options.get('rolling_max_unavailable', rolling.DEFAULT_MAX_UNAVAILABLE)
+    env.health_url = options.get('health_url')
+    env.health_timeout = options.get('health_timeout', rolling.DEFAULT_HEALTH_TIMEOUT)
+    env.worker_ready_timeout = options.get('worker_ready_timeout', workers.DEFAULT_READY_TIMEOUT)
+    env.resource_sampling = options.get('resource_sampling', False)
+    env.resource_sampling_interval = options.get('resource_sampling_interval', sampler.DEFAULT_INTERVAL)
+    env.latency_check = options.get('latency_check', False)
+    env.latency_requests = options.get('latency_requests', latency.DEFAULT_REQUESTS)
+    env.latency_concurrency = options.get('latency_concurrency', latency.DEFAULT_CONCURRENCY)
+    env.latency_threshold = options.get('latency_threshold', latency.DEFAULT_THRESHOLD)
+    env.latency_on_regression = options.get('latency_on_regression', 'warn')
+    env.warmup_urls = options.get('warmup_urls', [])
+    env.warmup_sitemap = options.get('warmup_sitemap')
+    env.warmup_command = options.get('warmup_command')
+    env.warmup_concurrency = options.get('warmup_concurrency', warmup.DEFAULT_CONCURRENCY)
+    env.warmup_max_urls = options.get('warmup_max_urls', warmup.DEFAULT_MAX_URLS)
+    env.django_settings_module = options.get('django_settings_module')
+
+    if "key_filename" in options:
+        path_to_key = os.path.normpath(os.path.expanduser(options["key_filename"]))
+
+        if not os.path.isfile(path_to_key):
+            abort("{0} is not a file".format(path_to_key))
+
+        env.key_filename = path_to_key
+
+    env.urls_to_check = options["urls_to_check"] if "urls_to_check" in options else []
+    env.urls_to_check_verify_ssl_certificate = options.get('urls_to_check_verify_ssl_certificate', True)
+    env.urls_to_check_concurrency = options.get('urls_to_check_concurrency', healthcheck.DEFAULT_CONCURRENCY)
+    env.urls_to_check_timeout = options.get('urls_to_check_timeout', healthcheck.DEFAULT_TIMEOUT)
+    env.urls_to_check_retries = options.get('urls_to_check_retries', healthcheck.DEFAULT_RETRIES)
+    env.urls_to_check_backoff = options.get('urls_to_check_backoff', healthcheck.DEFAULT_BACKOFF)
+
+    if env.ssh_multiplexing:
+        sshmux.enable()
+
+
 def function_builder(target, options):
-    def function(more_args=None):
-
-        env.user = options["user"]
-        env.hosts = [options["hosts"]]
-        env.target_name = target
-        env.deploy_path = options["deploy_path"]
-        env.project_name = options["project_name"]
-        env.supervisor_program = options["supervisor_program"] if "supervisor_program" in options else env.project_name
-        env.db_name = options["db_name"] if "db_name" in options else env.project_name
-        env.venv_path = options["venv_path"]
-        env.celery_enabled = options.get('celery_enabled', False)
-        env.celery_workers = options.get('celery_workers', [])
-        env.huey_enabled = options.get('huey_enabled', False)
-        env.opbeat_enabled = options.get('opbeat_enabled', False)
-
-        if env.opbeat_enabled:
-            env.opbeat_authorization_bearer = options.get('opbeat_authorization_bearer')
-            env.opbeat_organization_id = options.get('opbeat_organization_id')
-            env.opbeat_app_id = options.get('opbeat_app_id')
-
-        env.yarn_enabled = options.get('yarn_enabled', False)
-        env.celerybeat_enabled = options.get('celerybeat_enabled', False)
-        env.clear_cache = options.get('clear_cache', True)
-        env.backup_db = options.get('backup_db', True)
-        env.db_engine = options.get('db_engine', 'postgresql')
-        env.pytest = options.get('pytest', False)
-        env.compress_enabled = options.get('compress_enabled', True)
-        env.extra_databases = options["extra_databases"] if "extra_databases" in options else []
-        env_to_export = options["export_env"] if "export_env" in options else {}
-        env.export_env = env_to_export
-        env.use_ssh_config = False
-        env.source_branch = options.get('source_branch', DEFAULT_SOURCE_BRANCH)
-        env.graceful_restart = options.get('graceful_restart', False)
-
-        if "key_filename" in options:
-            path_to_key = os.path.normpath(os.path.expanduser(options["key_filename"]))
-
-            if not os.path.isfile(path_to_key):
-                abort("{0} is not a file".format(path_to_key))
-
-            env.key_filename = path_to_key
-
-        env.urls_to_check = options["urls_to_check"] if "urls_to_check" in options else []
-        env.urls_to_check_verify_ssl_certificate = options.get('urls_to_check_verify_ssl_certificate', True)
+    def function(roles=None, *args, **kwargs):
+        _apply_options(target, options, roles)
 
         _print_deployment_summary(env)
 
@@ -118,32 +173,8 @@ def function_builder(target, options):
 
 
 def get_tasks():
-    path_list_to_search = [
-        # Current directory
-        os.getcwd(),
-        # Parent directory
-        os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-    ]
-
-    deploy_config_file_path = find_file_in_path(DEPLOYMENT_CONFIG_FILE, path_list_to_search)
-
-    if deploy_config_file_path:
-        with open(deploy_config_file_path, "r") as deploy_config_file:
-            data = deploy_config_file.read()
-    else:
-        raise MissingConfiguration(
-            "Configuration file `{0}` was not found in `{1}`".format(DEPLOYMENT_CONFIG_FILE, path_list_to_search)
-        )
-
-    try:
-        deployment_data = json.loads(data)
-    except ValueError as e:
-        raise InvalidConfiguration("Cannot load your deployment configuration. JSON file is probably broken. Additional message: %s" % e.message)
-
-    for target, options in deployment_data.items():
+    for target, options in sorted(config.load_targets().items()):
         yield target, task(name=target)(function_builder(target, options))
-        __all__.append(target)
-        globals()[target] = task(name=target)(function_builder(target, options))
 
     for fabric_task in [venv_run,
                         deploy,
@@ -156,15 +187,22 @@ def get_tasks():
                         kill,
                         kill_celery,
                         status,
+                        dashboard,
                         check,
                         clean,
                         check_urls,
+                        check_latency,
+                        warm_up,
+                        deferred_status,
                         npm,
+                        yarn,
+                        bower,
                         get_media,
                         rebuild_staticfiles,
                         rebuild_virtualenv,
                         get_dumps,
                         dump_db,
+                        pull_db,
                         drop_schema,
                         shell_plus,
                         migrate,
@@ -172,83 +210,80 @@ def get_tasks():
                         pull,
                         pip_install,
                         register_deployment,
+                        rollback,
+                        list_releases,
+                        timings,
                         gulp]:
         yield fabric_task.__name__, fabric_task
 
 
-get_tasks()
+def django_manage(command, cwd=None):
+    from . import management
+
+    if env.get('manage_runner_active'):
+        return management.run_command(command, cwd=cwd)
 
+    if cwd:
+        return venv_run('cd {cwd} && python manage.py {command}'.format(cwd=cwd, command=command))
 
-def venv_run(command_to_run):
-    run('source %s' % env.venv_path + ' && ' + command_to_run)
+    return venv_run('python src/manage.py {command}'.format(command=command))
 
 
 @task
 @needs_host
-def deploy(upgrade=False, skip_npm=False, skip_check=False, *args, **kwargs):
-    with shell_env(**env.export_env):
-        start_ = time.time()
+@runs_once
+def deploy(upgrade=False, skip_npm=False, skip_check=False, force_install=False, *args, **kwargs):
+    from . import deferred, sampler, staticfiles, warmup
 
-        print(Back.GREEN + 'Deployment started')
+    start_ = time.time()
 
-        upgrade = fab_arg_to_bool(upgrade)
-        skip_npm = fab_arg_to_bool(skip_npm)
-        skip_check = fab_arg_to_bool(skip_check)
+    print(Back.GREEN + 'Deployment started')
 
-        if not skip_check:
-            check()
-        else:
-            print(Fore.YELLOW + "CHECK skipped!")
+    upgrade = fab_arg_to_bool(upgrade)
+    skip_npm = fab_arg_to_bool(skip_npm)
+    skip_check = fab_arg_to_bool(skip_check)
+    force_install = fab_arg_to_bool(force_install)
 
-        with cd(env.deploy_path):
-            if env.backup_db:
-                dump_db()
-            else:
-                print(Fore.YELLOW + "Database was not backed up!")
+    deferred.validate()
 
-            pull()
+    trace_path = tracing.start_trace() if env.deploy_timings else None
+    sample_id, sample_offsets = sampler.start_all() if sampler.enabled() else (None, {})
+    ok = False
 
-            if env.yarn_enabled:
-                yarn()
+    try:
+        with settings(trace_path=trace_path, static_build=staticfiles.new_build_name()):
+            if not skip_check:
+                with tracing.span("check", 'task'), shell_env(**env.export_env):
+                    check()
             else:
-                if not skip_npm:
-                    npm(upgrade=upgrade)
-                else:
-                    print(Fore.YELLOW + "NPM skipped!")
+                print(Fore.YELLOW + "CHECK skipped!")
 
-            # Dependencies
-            print(Fore.BLUE + "Installing bower dependencies")
+            built = on_hosts(_deploy_host, upgrade, skip_npm, force_install, *args, **kwargs)
 
-            with settings(warn_only=True):  # Bower may not be installed
-                run('bower prune --config.interactive=false')  # Uninstalls local extraneous packages.
-                run('bower %s --config.interactive=false' % ('update' if upgrade else 'install'))
+            if rolling.enabled():
+                rolling.roll(_activate_host, built=built)
 
-            gulp()
-            pip_install(upgrade, *args, **kwargs)
+            if warmup.enabled():
+                with tracing.span("warm_up", 'task'):
+                    warm_up()
 
-            # Django tasks
-            print(Fore.BLUE + "Running Django commands")
-            venv_run('python src/manage.py collectstatic --noinput')
+            with tracing.span("check_urls", 'task'):
+                check_urls()
 
-            migrate()
+            if env.latency_check:
+                with tracing.span("check_latency", 'task'):
+                    check_latency(on_regression=env.latency_on_regression, save=True)
 
-            if env.compress_enabled:
-                venv_run('python src/manage.py compress')
+            if env.opbeat_enabled:
+                register_deployment()
 
-            clean()
+        ok = True
+    finally:
+        if sample_id:
+            sampler.stop_all(sample_id, sample_offsets, trace_path)
 
-            # with cd('src/'):
-            venv_run('cd src && python manage.py compilemessages')
-
-            venv_run("python src/manage.py check --deploy")
-
-        graceful_restart() if env.graceful_restart else restart()
-
-    status()
-    check_urls()
-
-    if env.opbeat_enabled:
-        register_deployment()
+        if trace_path:
+            tracing.finish_trace(trace_path, start_, ok)
 
     print(Fore.GREEN + "- - - - - - - - - - - - - - - - - - - -")
     print(Fore.GREEN + Style.BRIGHT + "Deployed :-)")
@@ -257,23 +292,207 @@ def deploy(upgrade=False, skip_npm=False, skip_check=False, *args, **kwargs):
     print(Fore.GREEN + "- - - - - - - - - - - - - - - - - - - -")
 
 
+def _deploy_stages(upgrade, skip_npm, force_install, *args, **kwargs):
+    from . import management
+
+    rebuild_static = force_install or upgrade
+
+    stages = [
+        Stage('dump_db', dump_db, enabled=env.backup_db),
+        Stage('pull', partial(_prepare_release, env.release) if env.atomic_releases else pull),
+        Stage('node', partial(yarn if env.yarn_enabled else npm, upgrade=upgrade, force=force_install), requires=['pull'], enabled=env.yarn_enabled or not skip_npm),
+        Stage('bower', partial(bower, upgrade=upgrade, force=force_install), requires=['pull']),
+        Stage('gulp', partial(_static_stage, rebuild_static, gulp), requires=['node', 'bower']),
+        Stage('pip_install', partial(pip_install, upgrade, force_install, *args, **kwargs), requires=['pull']),
+        Stage('django_runner', management.start_runner, requires=['pip_install'], enabled=env.persistent_manage),
+        Stage('collectstatic', partial(_static_stage, rebuild_static, _collect_static), requires=['gulp', 'django_runner']),
+        Stage('migrate', migrate, requires=['dump_db', 'django_runner']),
+        Stage('compress', partial(_static_stage, rebuild_static, _static_manage, 'compress'), requires=['collectstatic'], enabled=env.compress_enabled),
+        Stage('compilemessages', compile_messages, requires=['django_runner']),
+        Stage('clean', partial(clean, skip_deferred=True), requires=['collectstatic', 'compress', 'migrate']),
+        Stage('check_deploy', partial(django_manage, 'check --deploy'), requires=['clean', 'compilemessages']),
+    ]
+
+    for options in env.deploy_stages.get('extra', []):
+        stages.append(_extra_stage(options))
+
+    return stages
+
+
+def _prepare_release(release):
+    from . import releases
+
+    releases.prepare_release(release)
+
+    if env.release_venv and releases.ensure_venv():
+        update_python_tools()
+
+
+def _extra_stage(options):
+    from . import deferred
+
+    def function():
+        with settings(warn_only=options.get('warn_only', False)):
+            if options.get('venv', True):
+                venv_run(options['command'])
+            else:
+                run(options['command'])
+
+    try:
+        # Deferred stages run after the restart, the stages depending on them inherit their requirements
+        return Stage(options['name'], function, requires=options.get('requires', ['pull']), required_by=options.get('required_by', []),
+                     enabled=not deferred.is_deferred(options['name']))
+    except KeyError as e:
+        raise InvalidConfiguration("Extra deploy stage is missing `{0}`: {1}".format(e.args[0], options))
+
+
+def _deploy_host(upgrade, skip_npm, force_install, *args, **kwargs):
+    from . import management, releases
+
+    with shell_env(**env.export_env):
+        # With atomic releases the new release is built next to the live one and everything
+        # below works in the release directory instead of `current`
+        release = releases.resolve_release() if env.atomic_releases else None
+        build_path = releases.release_path(release) if env.atomic_releases else env.deploy_path
+
+        with cd(build_path), settings(deploy_path=build_path, release=release, manage_runner_active=env.persistent_manage):
+            try:
+                run_stages(_deploy_stages(upgrade, skip_npm, force_install, *args, **kwargs),
+                           disabled=env.deploy_stages.get('disabled', []),
+                           parallel=env.parallel_stages)
+            finally:
+                if env.persistent_manage:
+                    management.stop_runner()
+
+    # With rolling restarts every host is built first, then the new code goes live batch by batch
+    if not rolling.enabled():
+        _activate_host(release)
+
+    return release
+
+
+def _activate_host(release=None, built=None):
+    from . import deferred, releases, staticfiles
+
+    if built:
+        release = built[env.host_string]['value']
+
+    with shell_env(**env.export_env):
+        if env.atomic_releases:
+            with tracing.span("activate"):
+                releases.activate(release)
+
+        if staticfiles.enabled():
+            with tracing.span("static"), cd(env.deploy_path):
+                staticfiles.activate()
+
+        with tracing.span("restart"):
+            graceful_restart() if env.graceful_restart else restart()
+
+        if env.atomic_releases:
+            with tracing.span("prune"):
+                releases.prune()
+
+        with tracing.span("deferred"):
+            deferred.start()
+
+    with tracing.span("status"):
+        status()
+
+
 @task
-def migrate(*args, **kwargs):
+@fan_out
+def rollback(release=None, *args, **kwargs):
+    from . import releases
+
+    releases.require_releases()
+
+    release = release or releases.previous_release()
+
+    if not release:
+        abort("There is no previous release to roll back to")
+
+    print(Fore.RED + "Rolling back to release {0}; database migrations are NOT reverted".format(release))
+
+    releases.activate(release)
+    graceful_restart() if env.graceful_restart else restart()
+
+    print(Fore.GREEN + Style.BRIGHT + "Done.")
+
+
+@task(alias='ds')
+@fan_out
+def deferred_status(runs=1, log=None, *args, **kwargs):
+    from . import deferred
+
+    deferred.print_status(deferred.fetch_status(int(runs)), log)
+
+
+@task(alias='rl')
+@fan_out
+def list_releases(*args, **kwargs):
+    from . import releases
+
+    releases.require_releases()
+
+    live, history, existing = releases.state()
+
+    activated_at = dict((release, position) for position, release in enumerate(history))
+
+    print(Fore.BLUE + "Releases (last activated first)")
+
+    for release in sorted(existing, key=lambda one_release: activated_at.get(one_release, -1), reverse=True):
+        print("{0} {1}".format("*" if release == live else " ", release))
+
+
+@task
+@runs_once
+def timings(runs=tracing.DEFAULT_COMPARE_RUNS, *args, **kwargs):
+    tracing.print_comparison(int(runs))
+
+
+@task
+@primary_only
+def migrate(force=False, *args, **kwargs):
+    from . import migrations
+
+    force = fab_arg_to_bool(force)
+    aliases = migrations.databases()
+
     with shell_env(**env.export_env):
         with cd(env.deploy_path):
             print(Fore.BLUE + "Migrating database")
 
-            venv_run('python src/manage.py migrate --noinput')
+            databases_plan = migrations.plan(aliases)
+            pending = [alias for alias in aliases if force or migrations.needs_migrate(databases_plan[alias])]
+
+            for alias in aliases:
+                if alias not in pending:
+                    print("No pending migrations on `{0}`".format(alias))
 
-            if env.extra_databases:
-                for one_db in env.extra_databases:
-                    venv_run('python src/manage.py migrate --noinput --database {db}'.format(db=one_db))
+            if not pending:
+                print(Fore.GREEN + Style.BRIGHT + "Done.")
+                return "nothing pending"
+
+            results = migrations.apply(migrations.groups(databases_plan, pending))
+            migrations.print_report(results)
+
+    failed = [alias for alias in pending if alias not in results or results[alias]['status']]
+
+    if failed:
+        abort("Migrating {0} failed".format(", ".join("`{0}`".format(alias) for alias in failed)))
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
+    return "{0} migration(s) on {1}".format(sum(len(results[alias]['applied']) for alias in pending), ", ".join(pending))
+
 
 @task
+@fan_out
 def pull(*args, **kwargs):
+    if env.atomic_releases:
+        abort("Target `{0}` uses atomic releases, its code is updated only by `deploy`".format(env.target_name))
+
     with cd(env.deploy_path):
         print(Fore.BLUE + "Pulling from git")
 
@@ -286,18 +505,36 @@ def pull(*args, **kwargs):
 
 
 @task
-def pip_install(upgrade=False, *args, **kwargs):
+@fan_out
+def pip_install(upgrade=False, force=False, *args, **kwargs):
+    from . import fingerprints
+
     upgrade = fab_arg_to_bool(upgrade)
+    force = fab_arg_to_bool(force) or upgrade
 
     with cd(env.deploy_path):
-        print(Fore.BLUE + "Installing pip dependencies")
-
-        venv_run('pip install --no-input --compile --exists-action=i --use-wheel %s -r requirements/production.txt' % ('--upgrade' if upgrade  else ''))
+        note = fingerprints.run_if_changed('pip', partial(_pip_install, upgrade), force=force)
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
+    return note
+
+
+def _pip_install(upgrade):
+    from . import wheelhouse
+
+    print(Fore.BLUE + "Installing pip dependencies")
+
+    if env.wheelhouse_enabled:
+        source = wheelhouse.pip_install_args(wheelhouse.ensure())
+    else:
+        source = '--use-wheel'
+
+    venv_run('pip install --no-input --compile --exists-action=i %s %s -r requirements/production.txt' % (source, '--upgrade' if upgrade else ''))
+
 
 @task
+@primary_only
 def backup(*args, **kwargs):
     with cd(env.deploy_path):
         print(Fore.BLUE + "Creating backup")
@@ -306,12 +543,13 @@ def backup(*args, **kwargs):
 
         now_time = strftime("%Y-%m-%d_%H.%M.%S", gmtime())
 
-        venv_run("python src/manage.py dumpdata --format json --all --indent=3 --output data/deployment_backup/%s-dump.json" % now_time)
+        django_manage("dumpdata --format json --all --indent=3 --output data/deployment_backup/%s-dump.json" % now_time)
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
 
 @task
+@primary_only
 def shell_plus(*args, **kwargs):
     with cd(env.deploy_path):
         print(Fore.BLUE + "Running IPython")
@@ -322,18 +560,38 @@ def shell_plus(*args, **kwargs):
 
 
 @task
+@primary_only
 def manage(command, *args, **kwargs):
+    # djdeploy production manage:"clearsessions;clear_cache" runs both commands in one Django process
+    from . import management
+
+    commands = [one_command.strip() for one_command in command.split(";") if one_command.strip()]
+
     with shell_env(**env.export_env):
         with cd(env.deploy_path):
             print(Fore.BLUE + "Running Django management command")
 
-            venv_run("python src/manage.py {command}".format(command=command.strip()))
+            if len(commands) > 1 or env.persistent_manage:
+                with management.django_runner():
+                    results = [django_manage(one_command) for one_command in commands]
+
+                management.print_results(results)
+            else:
+                django_manage(commands[0])
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
 
 @task(alias='dumpdb')
-def dump_db(out_format='custom', *args, **kwargs):
+@primary_only
+def dump_db(out_format=None, jobs=None, *args, **kwargs):
+    from . import pgdump
+
+    out_format = out_format or env.dump_format
+
+    if out_format not in pgdump.FORMAT_EXTENSIONS:
+        abort("Unsupported dump format `{0}`, use one of: {1}".format(out_format, ", ".join(sorted(pgdump.FORMAT_EXTENSIONS))))
+
     with cd(env.deploy_path):
         print(Fore.BLUE + "Dumping database")
 
@@ -341,7 +599,7 @@ def dump_db(out_format='custom', *args, **kwargs):
 
         with settings(abort_exception=FabricException):
             if env.db_engine == 'postgresql':
-                dump_postgres(env, now_time, out_format)
+                dump_postgres(env, now_time, out_format, jobs)
             elif env.db_engine == 'mysql':
                 dump_mysql(env, now_time)
             else:
@@ -351,7 +609,66 @@ def dump_db(out_format='custom', *args, **kwargs):
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
 
+@task(alias='pulldb')
+@primary_only
+def pull_db(out_format=None, compression=None, level=None, threads=None, *args, **kwargs):
+    from . import streaming
+
+    out_format = out_format or env.dump_format
+    compression = compression or env.dump_compression
+    compress_command, compressed_extension = streaming.compressor_command(compression,
+                                                                          level=level or env.dump_compression_level,
+                                                                          threads=int(threads or env.dump_compression_threads))
+    dump_command, extension = _dump_to_stdout_command(out_format, compressed=bool(compress_command))
+
+    now_time = strftime("%Y-%m-%d_%H.%M.%S", gmtime())
+    filename = "{db_name}_{now_time}.{extension}".format(db_name=env.db_name, now_time=now_time, extension=extension)
+
+    if compressed_extension:
+        filename += "." + compressed_extension
+        dump_command += " | " + compress_command
+
+    local_path = os.path.join("data", "backup", filename)
+
+    print(Fore.BLUE + "Streaming database dump into `{0}` ({1})".format(local_path, compression))
+
+    result = streaming.stream_to_file("cd {0} && {1}".format(env.deploy_path, dump_command), local_path)
+    streaming.write_checksum_file(result)
+    streaming.print_result(result)
+
+    print(Fore.GREEN + Style.BRIGHT + "Done.")
+
+
+def _dump_to_stdout_command(out_format, compressed):
+    from . import pgdump
+
+    if env.dump_command:
+        return env.dump_command, "dump"
+
+    if env.db_engine == 'postgresql':
+        if out_format not in ('plain', 'custom'):
+            abort("Only `plain` and `custom` dumps can be streamed, not `{0}`; pass `out_format`".format(out_format))
+
+        command = ["pg_dump",
+                   "--format={0}".format(out_format),
+                   "--dbname={0}".format(env.db_name),
+                   "--encoding=utf8",
+                   "--schema=public",
+                   pgdump.table_filter_args()]
+
+        if compressed and out_format == 'custom':
+            # The stream is compressed better (and on more cores) later in the pipe
+            command.append("--compress=0")
+
+        return " ".join(part for part in command if part), pgdump.FORMAT_EXTENSIONS[out_format]
+    elif env.db_engine == 'mysql':
+        return "mysqldump --single-transaction --databases {0}".format(env.project_name), 'sql'
+
+    abort("Unsupported DB engine {0}".format(env.db_engine))
+
+
 @task(alias='drop')
+@primary_only
 def drop_schema(*args, **kwargs):
     with settings(user='root'):
         if not confirm('This will DESTROY database schmema on the server!', default=False):
@@ -379,34 +696,25 @@ def dump_mysql(env, now_time):
               "host = 127.0.0.1")
 
 
-def dump_postgres(env, now_time, out_format):
+def dump_postgres(env, now_time, out_format, jobs=None):
+    from . import pgdump
+
     try:
-        extension = 'sql' if out_format == 'plain' else 'backup'
-        dump_filename = "{project_name}_{now_time}.{extension}".format(project_name=env.project_name, now_time=now_time, extension=extension)
+        jobs = pgdump.jobs_for_host(out_format, jobs or env.dump_jobs)
+        dump_filename = "{project_name}_{now_time}.{extension}".format(project_name=env.project_name, now_time=now_time, extension=pgdump.FORMAT_EXTENSIONS[out_format])
+        dump_path = "data/backup/{0}".format(dump_filename)
+        start_ = time.time()
 
         # User `--inserts` to user INSERT INTO rather than COPY
-        run("pg_dump "
-            "--format={out_format} "  # plain || custom
-            "--dbname={db_name} "
-            "--encoding=utf8 "
-            "--verbose "
-            "--schema=public "
-            "--clean "  # Drop all DB objects; only applied when out_format == plain
-            "-f data/backup/{dump_filename}".format(out_format=out_format, db_name=env.db_name, dump_filename=dump_filename))
-
-        if out_format == 'custom':
-            print(Fore.GREEN + Style.BRIGHT + "Restore me with: `pg_restore {dump_filename} "
-                                              "--clean "
-                                              "--exit-on-error "
-                                              "--format={out_format} "
-                                              "--jobs=2 "
-                                              "--verbose "
-                                              "-n public "  # Restore only public schema
-                                              "--dbname={db_name} "
-                                              "[--data-only][--schema-only]`".format(out_format=out_format, dump_filename=dump_filename, db_name=env.db_name))
-        else:
-            print(Fore.GREEN + Style.BRIGHT + "Restore me with: `psql --file={dump_filename} "
-                                              "--dbname={db_name}`".format(out_format=out_format, dump_filename=dump_filename, db_name=env.db_name))
+        with settings(hide('stdout')):
+            output = run(pgdump.dump_command(out_format, dump_path, jobs))
+
+        elapsed = time.time() - start_
+        sizes = pgdump.directory_table_sizes(dump_path) if out_format == 'directory' else {}
+
+        pgdump.print_summary(pgdump.table_timings(output, parallel=out_format == 'directory' and jobs > 1), sizes, pgdump.total_size(dump_path), elapsed)
+
+        print(Fore.GREEN + Style.BRIGHT + "Restore me with: `{0}`".format(pgdump.restore_hint(out_format, dump_filename, jobs)))
 
     except FabricException:
         print("Hint: create configuration file with nano ~/.pgpass")
@@ -416,24 +724,25 @@ def dump_postgres(env, now_time, out_format):
 
 
 @task
-def get_media(delete=False, *args, **kwargs):
+@primary_only
+def get_media(delete=False, full=False, streams=None, *args, **kwargs):
+    from . import mediasync
+
     delete = fab_arg_to_bool(delete)
+    full = fab_arg_to_bool(full)
 
-    with cd(env.deploy_path):
-        print(Fore.BLUE + "Rsyncing local media with remote")
+    print(Fore.BLUE + "Syncing local media with remote")
 
-        rsync_project(local_dir='data/',
-                      remote_dir="{0}/data/media".format(env.deploy_path.rstrip("/")),
-                      exclude=['.git*', 'cache*', 'filer_*'],
-                      delete=delete,
-                      ssh_opts="-o UserKnownHostsFile={known_hosts_path}".format(known_hosts_path=_get_known_hosts_local_path()),
-                      upload=False)
+    mediasync.sync(full=full, delete=delete, streams=int(streams or env.media_sync_streams))
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
 
 @task
+@primary_only
 def get_dumps(delete=False, *args, **kwargs):
+    from fabric.contrib.project import rsync_project
+
     delete = fab_arg_to_bool(delete)
 
     with cd(env.deploy_path):
@@ -443,86 +752,204 @@ def get_dumps(delete=False, *args, **kwargs):
                       remote_dir="{0}/data/backup".format(env.deploy_path.rstrip("/")),
                       exclude=['.git*', 'cache*', 'filer_*'],
                       delete=delete,
-                      ssh_opts="-o UserKnownHostsFile={known_hosts_path}".format(known_hosts_path=_get_known_hosts_local_path()),
+                      ssh_opts=rsync_ssh_opts(),
                       upload=False)
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
 
-def _get_known_hosts_local_path():
-    return os.path.normpath(os.path.expanduser(os.path.join(env.ssh_config_path, "../known_hosts")))
+@task
+@fan_out
+def npm(upgrade=False, force=False, *args, **kwargs):
+    from . import fingerprints
 
+    upgrade = fab_arg_to_bool(upgrade)
+    force = fab_arg_to_bool(force) or upgrade
 
-@task
-def npm(upgrade=False, *args, **kwargs):
     with cd(env.deploy_path):
-        print(Fore.BLUE + "Installing node_modules")
+        note = fingerprints.run_if_changed('node', partial(_npm_install, upgrade), force=force)
+
+    print(Fore.GREEN + Style.BRIGHT + "Done.")
 
-        # run("npm prune")
-        run("npm set progress=false")
-        run("npm install --no-optional")
+    return note
 
-        if upgrade:
-            run("npm update --no-optional")
 
-        run("npm set progress=true")
+def _npm_install(upgrade):
+    print(Fore.BLUE + "Installing node_modules")
+
+    # run("npm prune")
+    run("npm set progress=false")
+    run("npm install --no-optional")
+
+    if upgrade:
+        run("npm update --no-optional")
+
+    run("npm set progress=true")
+
+
+@task
+@fan_out
+def yarn(upgrade=False, force=False, *args, **kwargs):
+    from . import fingerprints
+
+    force = fab_arg_to_bool(force) or fab_arg_to_bool(upgrade)
+
+    with cd(env.deploy_path):
+        note = fingerprints.run_if_changed('node', _yarn_install, force=force)
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
+    return note
+
+
+def _yarn_install():
+    print(Fore.BLUE + "Installing node_modules using yarn")
+    run("yarn install")
+
 
 @task
-def yarn(upgrade=False, *args, **kwargs):
+@fan_out
+def bower(upgrade=False, force=False, *args, **kwargs):
+    from . import fingerprints
+
+    upgrade = fab_arg_to_bool(upgrade)
+    force = fab_arg_to_bool(force) or upgrade
+
     with cd(env.deploy_path):
-        print(Fore.BLUE + "Installing node_modules using yarn")
-        run("yarn install")
+        note = fingerprints.run_if_changed('bower', partial(_bower_install, upgrade), force=force)
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
+    return note
+
+
+def _bower_install(upgrade):
+    print(Fore.BLUE + "Installing bower dependencies")
+
+    with settings(warn_only=True):  # Bower may not be installed
+        run('bower prune --config.interactive=false')  # Uninstalls local extraneous packages.
+        run('bower %s --config.interactive=false' % ('update' if upgrade else 'install'))
+
 
 @task(alias='cl')
-def clean(*args, **kwargs):
+@fan_out
+def clean(skip_deferred=False, *args, **kwargs):
+    # During a deploy the deferred steps run in the background after the restart
+    from . import deferred, incremental
+
+    skipped = deferred.deferred_names() if skip_deferred else []
+
     with shell_env(**env.export_env):
         with cd(env.deploy_path):
             print(Fore.BLUE + "Cleaning Django project")
 
-            if env.clear_cache:
-                venv_run('python src/manage.py clearsessions')
-                venv_run('python src/manage.py clear_cache')
+            if env.clear_cache and is_primary_host():
+                if 'clearsessions' not in skipped:
+                    django_manage('clearsessions')
+
+                django_manage('clear_cache')
 
-            with settings(warn_only=True):
-                venv_run('python src/manage.py thumbnail clear')
+            if 'thumbnail_clear' not in skipped:
+                with settings(warn_only=True):
+                    django_manage('thumbnail clear')
 
-            venv_run('python src/manage.py clean_pyc --optimize --path=src/')
-            venv_run('python src/manage.py compile_pyc --path=src/')
+            if 'compile_pyc' not in skipped:
+                incremental.compile_changed('pyc', _compile_all_pyc)
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
 
+def _compile_all_pyc():
+    django_manage('clean_pyc --optimize --path=src/')
+    django_manage('compile_pyc --path=src/')
+
+
+def compile_messages():
+    from . import incremental
+
+    return incremental.compile_changed('messages', partial(django_manage, 'compilemessages', cwd='src'))
+
+
 @task(alias='rs')
+@runs_once
 def rebuild_staticfiles(*args, **kwargs):
     if not confirm('Are you sure you want to rebuild all staticfiles?', default=False):
         abort('Rebuild cancelled')
 
-    with cd(env.deploy_path):
+    # Asked once, then every host is rebuilt; the steps below are per-host
+    on_hosts(_rebuild_staticfiles)
+
+    print(Fore.GREEN + Style.BRIGHT + "Done.")
+
+
+def _rebuild_staticfiles():
+    from . import staticfiles
+
+    with cd(env.deploy_path), settings(static_build=staticfiles.new_build_name()):
         print(Fore.BLUE + "Rebuilding staticfiles")
 
-        run("rm -rf data/static")
+        if staticfiles.enabled():
+            # Built from scratch next to the live files, which are replaced at the end
+            staticfiles.prepare(seed=False)
+        else:
+            run("rm -rf data/static")
 
-        venv_run('python src/manage.py collectstatic --noinput')
         run('bower install --config.interactive=false')
 
         gulp()
 
-        venv_run('python src/manage.py compress')
+        _static_manage('collectstatic --noinput')
+        _static_manage('compress')
 
-    print(Fore.GREEN + Style.BRIGHT + "Done.")
+        if staticfiles.enabled():
+            staticfiles.activate()
+
+
+def _static_stage(force, func, *args):
+    # gulp, collectstatic and compress share the fingerprint of their inputs
+    from . import staticfiles
+
+    note = staticfiles.unchanged(force)
+
+    if note:
+        print(Fore.YELLOW + "Inputs of the static files are unchanged, skipped.")
+        return note
+
+    func(*args)
+
+
+def _collect_static():
+    from . import staticfiles
+
+    if staticfiles.enabled():
+        staticfiles.prepare()
+
+    _static_manage('collectstatic --noinput')
+
+
+def _static_manage(command):
+    from . import staticfiles
+
+    if staticfiles.enabled():
+        staticfiles.manage(command)
+    else:
+        django_manage(command)
 
 
 @task()
+@runs_once
 def rebuild_virtualenv(*args, **kwargs):
     if not confirm('Are you sure you want to rebuild virtualenv? This will stop and start your app.', default=False):
         abort('Rebuild cancelled')
 
+    on_hosts(_rebuild_virtualenv)
+
+    print(Fore.GREEN + Style.BRIGHT + "Done.")
+
+
+def _rebuild_virtualenv():
+    from . import fingerprints
+
     with cd(env.deploy_path):
         stop()
         print(Fore.BLUE + "Rebuilding virtualenv")
@@ -531,13 +958,13 @@ def rebuild_virtualenv(*args, **kwargs):
         run("rm -rf {}".format(replace))
 
         run('virtualenv {}'.format(replace))
+        fingerprints.forget('pip')
         update_python_tools()
         start()
 
-    print(Fore.GREEN + Style.BRIGHT + "Done.")
-
 
 @task(alias='g')
+@fan_out
 def gulp(*args, **kwargs):
     with cd(env.deploy_path):
         print(Fore.BLUE + "Starting gulp build")
@@ -549,24 +976,114 @@ def gulp(*args, **kwargs):
 
 
 @task(alias='cu')
+@runs_once
 def check_urls(*args, **kwargs):
-    logging.basicConfig(level=logging.DEBUG)
+    from . import healthcheck
+
+    if not env.urls_to_check:
+        return
+
+    print(Fore.BLUE + "Checking {0} URL(s)".format(len(env.urls_to_check)))
+
+    results = healthcheck.check_urls(env.urls_to_check,
+                                     concurrency=env.urls_to_check_concurrency,
+                                     timeout=env.urls_to_check_timeout,
+                                     retries=env.urls_to_check_retries,
+                                     backoff=env.urls_to_check_backoff,
+                                     verify=env.urls_to_check_verify_ssl_certificate)
+    healthcheck.print_results(results)
 
-    for url in env.urls_to_check:
-        print("Checking `{0}`".format(url))
-        r = requests.get(url, verify=env.urls_to_check_verify_ssl_certificate)
-        if r.status_code != 200: abort("HTTP status for `{0}` is `{1}`.".format(url, r.status_code))
+    failed = [result for result in results if not result['ok']]
+
+    if failed:
+        abort("{0} of {1} URL(s) failed the check.".format(len(failed), len(results)))
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
 
+@task(alias='wu')
+@runs_once
+def warm_up(*args, **kwargs):
+    from . import warmup
+
+    if not warmup.enabled():
+        return
+
+    start_ = time.time()
+    command_elapsed = None
+    results = []
+
+    if env.warmup_command:
+        print(Fore.BLUE + "Running `{0}` on {1}".format(env.warmup_command, env.primary_host))
+
+        with settings(host_string=env.primary_host), shell_env(**env.export_env), cd(env.deploy_path):
+            django_manage(env.warmup_command)
+
+        command_elapsed = time.time() - start_
+
+    if env.warmup_urls or env.warmup_sitemap:
+        print(Fore.BLUE + "Warming up the cache, {0} request(s) at a time".format(env.warmup_concurrency))
+
+        results = warmup.fetch_all(env.warmup_urls,
+                                   concurrency=env.warmup_concurrency,
+                                   timeout=env.urls_to_check_timeout,
+                                   verify=env.urls_to_check_verify_ssl_certificate,
+                                   sitemap=env.warmup_sitemap,
+                                   limit=env.warmup_max_urls)
+
+    warmup.print_report(results, time.time() - start_, command_elapsed)
+
+
+@task(alias='lat')
+@runs_once
+def check_latency(requests=None, concurrency=None, on_regression='warn', save=False, *args, **kwargs):
+    from . import latency
+
+    if not env.urls_to_check:
+        return
+
+    requests = int(requests or env.latency_requests)
+    concurrency = int(concurrency or env.latency_concurrency)
+
+    if on_regression not in latency.ACTIONS:
+        abort("`on_regression` must be one of {0}".format(", ".join(latency.ACTIONS)))
+
+    print(Fore.BLUE + "Measuring latency of {0} URL(s), {1} requests each, {2} at a time".format(len(env.urls_to_check), requests, concurrency))
+
+    regressions = latency.run_check(requests, concurrency, on_regression=on_regression, save=fab_arg_to_bool(save))
+
+    if not regressions:
+        print(Fore.GREEN + Style.BRIGHT + "Done.")
+        return
+
+    message = "Latency regressed on {0} URL(s)".format(len(set(url for url, metric, base, latest in regressions)))
+
+    if on_regression == 'warn':
+        print(Fore.YELLOW + Style.BRIGHT + message)
+    elif on_regression == 'rollback' and env.atomic_releases:
+        print(Fore.RED + message)
+        rollback()
+        abort(message + ", rolled back to the previous release")
+    elif on_regression == 'rollback':
+        abort(message + "; rolling back needs `atomic_releases`")
+    else:
+        abort(message)
+
+
 @task(alias='upt')
+@fan_out
 def update_python_tools(*args, **kwargs):
+    from . import wheelhouse
+
     with cd(env.deploy_path):
         print(Fore.BLUE + "Updating Python tools")
 
-        venv_run('easy_install --upgrade pip')
-        venv_run('pip install --no-input --exists-action=i --use-wheel --upgrade setuptools wheel ipython ipdb')
+        if env.wheelhouse_enabled:
+            tools_wheelhouse = wheelhouse.ensure(packages=['pip'] + PYTHON_TOOLS)
+            venv_run('python -m pip install --no-input --exists-action=i --upgrade %s pip %s' % (wheelhouse.pip_install_args(tools_wheelhouse), " ".join(PYTHON_TOOLS)))
+        else:
+            venv_run('easy_install --upgrade pip')
+            venv_run('pip install --no-input --exists-action=i --use-wheel --upgrade %s' % " ".join(PYTHON_TOOLS))
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
@@ -592,12 +1109,15 @@ def check(*args, **kwargs):
 
 
 @task
+@fan_out
 def supervisorctl(command, *args, **kwargs):
     with cd(env.deploy_path):
         run('supervisorctl {command} {program_name}:*'.format(command=command, program_name=env.supervisor_program))
 
 
 @task(alias='r')
+@rolling.rolling
+@fan_out
 def restart(*args, **kwargs):
     print(Fore.BLUE + "Restarting application group")
 
@@ -608,6 +1128,7 @@ def restart(*args, **kwargs):
 
 
 @task()
+@fan_out
 def stop(*args, **kwargs):
     print(Fore.BLUE + "Stopping application group")
 
@@ -618,6 +1139,7 @@ def stop(*args, **kwargs):
 
 
 @task()
+@fan_out
 def start(*args, **kwargs):
     print(Fore.BLUE + "Starting application group")
 
@@ -628,54 +1150,42 @@ def start(*args, **kwargs):
 
 
 @task(alias='gr')
+@rolling.rolling
+@fan_out
 def graceful_restart(*args, **kwargs):
+    from . import workers
+
     with cd(env.deploy_path):
         print(Fore.BLUE + "Restarting Gunicorn with HUP signal")
         run('supervisorctl pid {program_name}:{part}_gunicorn | xargs kill -s HUP'.format(program_name=env.supervisor_program, part=env.project_name))
 
-        if env.celery_enabled:
-            print(Fore.BLUE + "Restarting Celery with HUP signal")
-
-            if env.celery_workers:
-                for worker in env.celery_workers:
-                    print(Fore.YELLOW + "Restarting worker `{}`".format(worker))
-                    run('supervisorctl pid {program_name}:{part}_celeryd_{worker} | xargs kill -s HUP'.format(program_name=env.supervisor_program, part=env.project_name, worker=worker))
-            else:
-                print(Fore.YELLOW + "Restarting default worker")
-                run('supervisorctl pid {program_name}:{part}_celeryd | xargs kill -s HUP'.format(program_name=env.supervisor_program, part=env.project_name))
-
-            if env.celerybeat_enabled:
-                run('supervisorctl pid {program_name}:{part}_celerybeat | xargs kill -s HUP'.format(program_name=env.supervisor_program, part=env.project_name))
-
-        if env.huey_enabled:
-            run('supervisorctl restart {program_name}:{part}_huey'.format(program_name=env.supervisor_program, part=env.project_name))
+    # Celery, celerybeat and huey are signalled in one call which waits until they are back
+    workers.reload_workers('HUP')
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
 
 @task()
+@fan_out
 def kill(*args, **kwargs):
+    from . import workers
+
     with cd(env.deploy_path):
         with settings(warn_only=True):
             print(Fore.BLUE + "Killing Gunicorn")
             run('supervisorctl pid {program_name}:{part}_gunicorn | xargs kill -9'.format(program_name=env.supervisor_program, part=env.project_name))
 
-            if env.celery_enabled:
-                print(Fore.BLUE + "Killing Celery")
-
-                if env.celery_workers:
-                    for worker in env.celery_workers:
-                        print(Fore.YELLOW + "Killing worker `{}`".format(worker))
+            killed = workers.worker_programs(include_beat=False, include_huey=False)
 
-                        run('supervisorctl pid {program_name}:{part}_celeryd_{worker} | xargs kill -9'.format(program_name=env.supervisor_program, part=env.project_name, worker=worker))
-                else:
-                    print(Fore.YELLOW + "Killing default worker")
-                    run('supervisorctl pid {program_name}:{part}_celerybeat | xargs kill -9'.format(program_name=env.supervisor_program, part=env.project_name))
+            if killed:
+                print(Fore.BLUE + "Killing Celery")
+                workers.signal_workers(killed, 'KILL', wait=False)
 
     print(Fore.GREEN + Style.BRIGHT + "Done.")
 
 
 @task()
+@fan_out
 def kill_celery(*args, **kwargs):
     with cd(env.deploy_path):
         print(Fore.BLUE + "Killing Celery")
@@ -685,32 +1195,60 @@ def kill_celery(*args, **kwargs):
 
 
 @task(alias='s')
+@fan_out
 def status(*args, **kwargs):
-    with cd(env.deploy_path):
-        print(Fore.BLUE + "Retrieving status")
+    from . import probe, workers
 
-        run("supervisorctl status | grep \"{program_name}\"".format(program_name=env.supervisor_program))
+    print(Fore.BLUE + "Retrieving status")
 
-        watched_services = [
-            'nginx',
-            'supervisor'
-        ]
+    probe.print_report(probe.probe())
 
-        if env.db_engine == 'postgresql':
-            watched_services.append('postgresql')
-        elif env.db_engine == 'mysql':
-            watched_services.append('mysql')
-        else:
-            print("Unsupported database engine {}".format(env.db_engine))
+    if env.celery_enabled:
+        with cd(env.deploy_path), settings(warn_only=True):
+            venv_run("{0} status".format(workers.CELERY_COMMAND))
 
-        for service in watched_services:
-            run('service {} status'.format(service), pty=False)
+    print(Fore.GREEN + Style.BRIGHT + "Done.")
 
-        if env.celery_enabled:
-            with settings(warn_only=True):
-                venv_run("celery --workdir=src/ --app=main status")
 
-        print(Fore.GREEN + Style.BRIGHT + "Done.")
+@task
+@runs_once
+def dashboard(targets=None, interval=None, *args, **kwargs):
+    """
+    Status of every host of every target (or of the `;` separated ``targets``), refreshed every ``interval`` seconds
+    """
+    from . import probe
+
+    all_targets = config.load_targets()
+    names = targets.split(";") if targets else sorted(all_targets)
+    saved_env = dict(env)
+    jobs = []
+
+    try:
+        for name in names:
+            if name not in all_targets:
+                abort("Unknown target `{0}`".format(name))
+
+            _apply_options(name, all_targets[name])
+            jobs += [probe.host_job(name, host) for host in env.hosts]
+    finally:
+        env.update(saved_env)
+
+    try:
+        while True:
+            results = probe.run_jobs(jobs)
+
+            if interval:
+                # Clear the screen, colorama translates it on Windows
+                print("\033[2J\033[H", end="")
+
+            probe.print_dashboard(results)
+
+            if not interval:
+                break
+
+            time.sleep(float(interval))
+    except KeyboardInterrupt:
+        pass
 
 
 @task
@@ -728,3 +1266,8 @@ def register_deployment(git_path="."):
                                             opbeat_authorization_bearer=env.opbeat_authorization_bearer,
                                             rev=revision,
                                             branch=branch))
+
+
+for _name, _fabric_task in get_tasks():
+    globals()[_name] = _fabric_task
+    __all__.append(_name)
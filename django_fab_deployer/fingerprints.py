@@ -0,0 +1,118 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import base64
+import hashlib
+import json
+import time
+from time import gmtime, strftime
+
+from colorama import Fore
+from fabric.api import env
+from fabric.context_managers import settings, hide
+
+from .remote import REMOTE_STATE_DIR, venv_run
+
+FINGERPRINT_DIR = REMOTE_STATE_DIR + "/fingerprints"
+MANIFEST_MARKER = "@@djdeploy-manifest"
+
+# Inputs of each install step: manifests, tool versions and directories which must exist for a skip
+INSTALL_STEPS = {
+    'pip': {
+        'files': ['requirements/*.txt'],
+        # Each release has its own virtualenv with `release_venv`
+        'versions': ['python --version', 'pip --version', 'echo "$VIRTUAL_ENV"'],
+        'paths': [],
+    },
+    'node': {
+        'files': ['package.json', 'package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock'],
+        'versions': ['node --version', 'npm --version', 'yarn --version'],
+        'paths': ['node_modules'],
+    },
+    'bower': {
+        'files': ['bower.json', '.bowerrc'],
+        'versions': ['bower --version'],
+        'paths': [],
+    },
+    # Sources of gulp, collectstatic and compress: every tracked file except Python code which is not settings.
+    # Manifests of the installs are tracked too, so new package versions rebuild the static files.
+    'static': {
+        'files': [],
+        'versions': ["git ls-files -s | grep -Ev '\\.py$' | sha256sum",
+                     "git ls-files -s -- '*settings*.py' '*/settings/*' | sha256sum",
+                     'node --version'],
+        'paths': ['data/static'],
+    },
+}
+
+
+def _manifest_path(step):
+    return "{0}/{1}.json".format(FINGERPRINT_DIR, step)
+
+
+def remote_state(step):
+    """
+    Returns ``(fingerprint, stored_manifest, missing_paths)`` gathered in a single remote call.
+    """
+    config = INSTALL_STEPS[step]
+
+    with settings(hide('running', 'stdout'), warn_only=True):
+        output = venv_run("for f in {files}; do [ -f \"$f\" ] && sha256sum \"$f\"; done; "
+                          "{versions}; "
+                          "for p in {paths}; do [ -e \"$p\" ] || echo \"missing: $p\"; done; "
+                          "echo {marker}; cat {manifest} 2> /dev/null; true".format(files=" ".join(config['files']),
+                                                                                    versions="; ".join("({0}) 2>&1".format(command) for command in config['versions']),
+                                                                                    paths=" ".join(config['paths']),
+                                                                                    marker=MANIFEST_MARKER,
+                                                                                    manifest=_manifest_path(step)))
+
+    inputs, _, stored = output.partition(MANIFEST_MARKER)
+    lines = [line.strip() for line in inputs.splitlines() if line.strip()]
+    missing = [line[len("missing: "):] for line in lines if line.startswith("missing: ")]
+    fingerprint = hashlib.sha256("\n".join(line for line in lines if not line.startswith("missing: ")).encode('utf-8')).hexdigest()
+
+    try:
+        stored = json.loads(stored.strip()) if stored.strip() else None
+    except ValueError:
+        stored = None
+
+    return fingerprint, stored, missing
+
+
+def store(step, fingerprint, duration):
+    manifest = json.dumps({'fingerprint': fingerprint, 'duration': duration, 'date': strftime("%Y-%m-%d %H:%M:%S", gmtime())})
+
+    with settings(hide('running', 'stdout')):
+        venv_run("mkdir -p {dir} && echo {data} | base64 -d > {manifest}".format(dir=FINGERPRINT_DIR,
+                                                                                 data=base64.b64encode(manifest.encode('utf-8')).decode('ascii'),
+                                                                                 manifest=_manifest_path(step)))
+
+
+def forget(step):
+    with settings(hide('running', 'stdout')):
+        venv_run("rm -f {0}".format(_manifest_path(step)))
+
+
+def run_if_changed(step, func, force=False):
+    """
+    Run the install ``func`` unless the inputs of ``step`` are identical to the last successful install.
+    Returns a note for the deploy summary when the step was skipped.
+    """
+    if not env.get('skip_unchanged_installs', True):
+        func()
+        return None
+
+    fingerprint, stored, missing = remote_state(step)
+
+    if not force and not missing and stored and stored.get('fingerprint') == fingerprint:
+        note = "unchanged since {0}, saved ~{1:.0f} s".format(stored['date'], stored['duration'])
+        print(Fore.YELLOW + "Dependencies of `{0}` are {1}, install skipped.".format(step, note))
+        return note
+
+    start_ = time.time()
+    func()
+    store(step, fingerprint, time.time() - start_)
+
+    return None
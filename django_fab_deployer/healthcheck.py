@@ -0,0 +1,127 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import time
+
+import six
+
+from .utils import print_table
+
+DEFAULT_EXPECTED_STATUS = 200
+DEFAULT_TIMEOUT = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+DEFAULT_CONCURRENCY = 8
+
+
+def url_spec(item):
+    """
+    Entries of `urls_to_check` are either plain URLs or dicts such as
+    ``{"url": "https://example.com/health/", "status": 200, "contains": "OK", "timeout": 5}``.
+    """
+    if isinstance(item, six.string_types):
+        item = {'url': item}
+
+    spec = dict(item)
+    spec.setdefault('status', DEFAULT_EXPECTED_STATUS)
+    spec.setdefault('contains', None)
+
+    return spec
+
+
+def make_session(pool_size, verify=True):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.verify = verify
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def check_url(session, spec, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    import requests
+
+    start_ = time.time()
+    attempts = 0
+
+    while True:
+        attempts += 1
+        request_start = time.time()
+        status_code = None
+
+        try:
+            response = session.get(spec['url'], timeout=spec.get('timeout', timeout))
+            status_code = response.status_code
+
+            if status_code != spec['status']:
+                error = "HTTP status `{0}`, expected `{1}`".format(status_code, spec['status'])
+            elif spec['contains'] and spec['contains'] not in response.text:
+                error = "Response does not contain `{0}`".format(spec['contains'])
+            else:
+                error = None
+        except requests.RequestException as e:
+            error = "{0}: {1}".format(e.__class__.__name__, e)
+
+        latency = time.time() - request_start
+
+        if error is None or attempts > retries:
+            return {
+                'url': spec['url'],
+                'ok': error is None,
+                'status': status_code,
+                'latency': latency,
+                'attempts': attempts,
+                'elapsed': time.time() - start_,
+                'error': error or '',
+            }
+
+        # The app may still be warming up after restart
+        time.sleep(backoff * 2 ** (attempts - 1))
+
+
+def check_urls(items, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, verify=True):
+    from multiprocessing.pool import ThreadPool
+
+    specs = [url_spec(item) for item in items]
+
+    if not specs:
+        return []
+
+    pool_size = max(1, min(concurrency, len(specs)))
+    session = make_session(pool_size, verify=verify)
+    pool = ThreadPool(pool_size)
+
+    try:
+        return pool.map(lambda spec: check_url(session, spec, timeout=timeout, retries=retries, backoff=backoff), specs)
+    finally:
+        pool.close()
+        pool.join()
+        session.close()
+
+
+def print_results(results, title=" URL check "):
+    from terminaltables import AsciiTable
+
+    rows = [['URL', 'Status', 'Latency [ms]', 'Attempts', 'Result']]
+
+    for result in results:
+        rows.append([
+            result['url'],
+            '{0}'.format(result['status'] or '-'),
+            '{0:.0f}'.format(result['latency'] * 1000),
+            '{0}'.format(result['attempts']),
+            'OK' if result['ok'] else result['error'],
+        ])
+
+    table = AsciiTable(rows, title)
+    table.justify_columns[2] = 'right'
+    table.justify_columns[3] = 'right'
+
+    print_table(table)
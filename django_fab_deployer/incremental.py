@@ -0,0 +1,159 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import json
+
+from colorama import Fore
+from fabric.api import env, run
+from fabric.context_managers import settings, hide
+from fabric.utils import abort
+
+from .remote import REMOTE_STATE_DIR, SCRIPT_HEADER, python_command, venv_run
+
+SOURCE_ROOT = "src/"
+RESULT_MARKER = "@@djdeploy-compiled "
+# Below this many files a single process is faster than starting workers
+PARALLEL_THRESHOLD = 20
+MAX_WORKERS = 8
+
+# name: suffix of the compiled sources, description
+KINDS = {
+    'pyc': ('.py', "Python byte-code"),
+    'messages': ('.po', "message catalogs"),
+}
+
+# Compiles the files of one kind changed between the last compiled revision and HEAD, or asks for a full run
+# when that revision is unknown. Runs in the virtualenv, so byte-code matches the interpreter of the app.
+COMPILE_SCRIPT = SCRIPT_HEADER + r'''
+import glob, os, subprocess, time
+
+def result(**values):
+    print(PAYLOAD["marker"] + json.dumps(values))
+    sys.exit(0)
+
+def compile_py(path):
+    import py_compile
+    try:
+        py_compile.compile(path, doraise=True)
+    except py_compile.PyCompileError as e:
+        return "%s: %s" % (path, e.msg.strip())
+
+def compile_po(path):
+    process = subprocess.Popen(["msgfmt", "--check-format", "-o", path[:-3] + ".mo", path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode("utf-8", "replace")
+    if process.returncode:
+        return "%s: %s" % (path, output.strip()[-300:] or "msgfmt exit code %d" % process.returncode)
+
+def remove_compiled(path):
+    base, name = os.path.split(path[:-len(".py")])
+    stale = [path[:-len(".py")] + ".mo"] if path.endswith(".po") else [path + "c", path + "o"] + glob.glob(os.path.join(base, "__pycache__", name + ".*.py[co]"))
+    for compiled in stale:
+        if os.path.exists(compiled):
+            os.remove(compiled)
+
+start = time.time()
+
+try:
+    with open(PAYLOAD["revision_file"]) as revision_file:
+        previous = revision_file.read().strip()
+except IOError:
+    result(full=True, reason="no revision was compiled yet")
+
+process = subprocess.Popen(["git", "diff", "--name-status", "--no-renames", previous, "HEAD", "--", PAYLOAD["root"]], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+output = process.communicate()[0].decode("utf-8", "replace")
+
+if process.returncode:
+    result(full=True, reason="revision %s is not known to git" % previous[:12])
+
+changed, deleted = [], []
+
+for line in output.splitlines():
+    status, _, path = line.partition("\t")
+    # A submodule moved, its files are not listed
+    if os.path.isdir(path):
+        result(full=True, reason="submodule %s changed" % path)
+    if path.endswith(PAYLOAD["suffix"]):
+        (deleted if status == "D" else changed).append(path)
+
+function = compile_py if PAYLOAD["suffix"] == ".py" else compile_po
+workers = min(PAYLOAD["max_workers"], len(changed) // PAYLOAD["threshold"] + 1)
+
+if workers > 1:
+    import multiprocessing
+    # The functions above live in `__main__` of `python -c`, only forked workers know them
+    context = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+    workers = min(workers, multiprocessing.cpu_count())
+    pool = context.Pool(workers)
+    errors = pool.map(function, changed)
+    pool.close()
+    pool.join()
+else:
+    errors = [function(path) for path in changed]
+
+for path in deleted:
+    remove_compiled(path)
+
+errors = [error for error in errors if error]
+
+if not errors:
+    with open(PAYLOAD["revision_file"], "w") as revision_file:
+        revision_file.write(subprocess.check_output(["git", "rev-parse", "HEAD"]).decode("ascii").strip())
+
+result(full=False, compiled=len(changed), removed=len(deleted), workers=workers, errors=errors, elapsed=time.time() - start, previous=previous)
+'''
+
+
+def _revision_file(kind):
+    return "{0}/compiled-{1}-revision".format(REMOTE_STATE_DIR, kind)
+
+
+def _compile_changed(kind):
+    suffix, description = KINDS[kind]
+    payload = {'revision_file': _revision_file(kind), 'root': SOURCE_ROOT, 'suffix': suffix, 'marker': RESULT_MARKER,
+               'threshold': PARALLEL_THRESHOLD, 'max_workers': MAX_WORKERS}
+
+    with settings(hide('running', 'stdout'), warn_only=True):
+        output = venv_run("mkdir -p {0} && {1}".format(REMOTE_STATE_DIR, python_command(COMPILE_SCRIPT, payload)))
+
+    for line in output.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+
+    abort("Compiling changed {0} failed: {1}".format(description, output.strip()[-500:]))
+
+
+def _store_revision(kind):
+    with settings(hide('running', 'stdout')):
+        run("mkdir -p {0} && git rev-parse HEAD > {1}".format(REMOTE_STATE_DIR, _revision_file(kind)))
+
+
+def compile_changed(kind, full_run):
+    """
+    Compile only the sources of ``kind`` changed since the last compiled revision, or call ``full_run``.
+    A fresh release directory has nothing compiled yet, so atomic releases always run in full.
+    Returns a note for the deploy summary.
+    """
+    suffix, description = KINDS[kind]
+
+    if env.atomic_releases:
+        full_run()
+        return None
+
+    result = _compile_changed(kind)
+
+    if result['full']:
+        print(Fore.YELLOW + "Compiling all {0}: {1}".format(description, result['reason']))
+        full_run()
+        _store_revision(kind)
+        return None
+
+    if result['errors']:
+        abort("Compiling {0} failed:\n{1}".format(description, "\n".join(result['errors'])))
+
+    note = "{0} changed `{1}` file(s) since {2}".format(result['compiled'], suffix, result['previous'][:8])
+
+    print(Fore.BLUE + "Compiled {0} in {1:.1f} s with {2} worker(s), removed {3} stale file(s)".format(note, result['elapsed'], result['workers'], result['removed']))
+
+    return note
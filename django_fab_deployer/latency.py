@@ -0,0 +1,220 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import io
+import json
+import os
+import time
+
+import six
+from fabric.api import env
+
+from . import healthcheck
+from .utils import local_state_path, print_table
+
+DEFAULT_REQUESTS = 50
+DEFAULT_CONCURRENCY = 5
+DEFAULT_THRESHOLD = 1.5
+ACTIONS = ['warn', 'fail', 'rollback']
+BASELINE_DIR = "latency"
+PERCENTILES = [50, 95, 99]
+# p99 of a few dozen requests is mostly noise, it is shown but does not gate
+GATED_METRICS = ['p50', 'p95', 'throughput']
+# Sub-50 ms differences are jitter whatever the ratio
+REGRESSION_MIN_SECONDS = 0.05
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of ``values``.
+    """
+    values = sorted(values)
+
+    if not values:
+        return None
+
+    rank = max(1, int(-(-len(values) * percent // 100)))
+
+    return values[min(rank, len(values)) - 1]
+
+
+def _timed_request(session, spec, timeout):
+    import requests
+
+    start_ = time.time()
+
+    try:
+        response = session.get(spec['url'], timeout=spec.get('timeout', timeout))
+        error = None if response.status_code == spec['status'] else "HTTP status `{0}`".format(response.status_code)
+    except requests.RequestException as e:
+        error = "{0}: {1}".format(e.__class__.__name__, e)
+
+    return time.time() - start_, error
+
+
+def measure_url(session, spec, requests_count=DEFAULT_REQUESTS, concurrency=DEFAULT_CONCURRENCY, timeout=healthcheck.DEFAULT_TIMEOUT):
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(max(1, min(concurrency, requests_count)))
+    start_ = time.time()
+
+    try:
+        timings = pool.map(lambda _: _timed_request(session, spec, timeout), range(requests_count))
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start_
+    latencies = [latency for latency, error in timings if error is None]
+    errors = [error for latency, error in timings if error is not None]
+
+    result = {
+        'url': spec['url'],
+        'requests': requests_count,
+        'errors': len(errors),
+        'error': errors[0] if errors else '',
+        'throughput': len(latencies) / elapsed if elapsed else 0,
+    }
+
+    for percent in PERCENTILES:
+        result['p{0}'.format(percent)] = percentile(latencies, percent)
+
+    return result
+
+
+def measure(items, requests_count=DEFAULT_REQUESTS, concurrency=DEFAULT_CONCURRENCY, timeout=healthcheck.DEFAULT_TIMEOUT, verify=True):
+    """
+    Send ``requests_count`` requests to every URL, ``concurrency`` at a time; URLs are measured one after another
+    so that they do not slow each other down.
+    """
+    specs = [healthcheck.url_spec(item) for item in items]
+    session = healthcheck.make_session(concurrency, verify=verify)
+
+    try:
+        return [measure_url(session, spec, requests_count, concurrency, timeout) for spec in specs]
+    finally:
+        session.close()
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns ``(url, metric, baseline value, latest value)`` of every gated metric that got worse by more than
+    ``threshold`` times; failed requests always count.
+    """
+    regressions = []
+
+    for result in results:
+        if result['errors']:
+            regressions.append((result['url'], 'errors', 0, result['errors']))
+
+        previous = baseline.get(result['url'])
+
+        if not previous:
+            continue
+
+        for metric in GATED_METRICS:
+            latest, base = result[metric], previous.get(metric)
+
+            if latest is None or not base:
+                continue
+
+            if metric == 'throughput':
+                regressed = latest * threshold < base
+            else:
+                regressed = latest > base * threshold and latest - base >= REGRESSION_MIN_SECONDS
+
+            if regressed:
+                regressions.append((result['url'], metric, base, latest))
+
+    return regressions
+
+
+def baseline_path():
+    return local_state_path(BASELINE_DIR, "{0}.json".format(env.target_name))
+
+
+def load_baseline(path):
+    try:
+        with io.open(path, encoding='utf-8') as baseline_file:
+            return json.load(baseline_file).get('urls', {})
+    except (IOError, ValueError):
+        return {}
+
+
+def save_baseline(path, results):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    with io.open(path, "w", encoding='utf-8') as baseline_file:
+        baseline_file.write(six.text_type(json.dumps({'time': time.time(), 'urls': dict((result['url'], result) for result in results)}, indent=2)))
+
+
+def _milliseconds(value):
+    return '{0:.0f}'.format(value * 1000) if value is not None else '-'
+
+
+def _change(latest, base):
+    if latest is None or not base:
+        return ''
+
+    return '{0:+.0f}%'.format((latest - base) * 100.0 / base)
+
+
+def print_results(results, baseline, regressions, title=" Latency "):
+    from terminaltables import AsciiTable
+
+    rows = [['URL', 'Requests', 'Errors', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]', 'Req/s', 'p95 vs. baseline', '']]
+    regressed_urls = set(url for url, metric, base, latest in regressions)
+
+    for result in results:
+        previous = baseline.get(result['url']) or {}
+
+        rows.append([result['url'],
+                     '{0}'.format(result['requests']),
+                     '{0}'.format(result['errors']),
+                     _milliseconds(result['p50']),
+                     _milliseconds(result['p95']),
+                     _milliseconds(result['p99']),
+                     '{0:.1f}'.format(result['throughput']),
+                     _change(result['p95'], previous.get('p95')),
+                     'REGRESSED' if result['url'] in regressed_urls else ''])
+
+    table = AsciiTable(rows, title)
+
+    for column in range(1, 8):
+        table.justify_columns[column] = 'right'
+
+    print_table(table)
+
+    for url, metric, base, latest in regressions:
+        if metric == 'errors':
+            print("{0}: {1} failed request(s)".format(url, latest))
+        elif metric == 'throughput':
+            print("{0}: throughput {1:.1f} req/s, was {2:.1f} req/s".format(url, latest, base))
+        else:
+            print("{0}: {1} {2} ms, was {3} ms".format(url, metric, _milliseconds(latest), _milliseconds(base)))
+
+
+def run_check(requests_count, concurrency, on_regression='warn', save=False):
+    """
+    Measure `urls_to_check`, compare with the baseline of the target and print both; returns the regressions.
+    With ``save`` the run becomes the new baseline unless it regressed and ``on_regression`` does more than warn.
+    """
+    path = baseline_path()
+    baseline = load_baseline(path)
+
+    results = measure(env.urls_to_check,
+                      requests_count=requests_count,
+                      concurrency=concurrency,
+                      timeout=env.urls_to_check_timeout,
+                      verify=env.urls_to_check_verify_ssl_certificate)
+
+    regressions = compare(results, baseline, env.latency_threshold)
+    print_results(results, baseline, regressions)
+
+    if save and (not regressions or on_regression == 'warn'):
+        save_baseline(path, results)
+
+    return regressions
@@ -0,0 +1,273 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import json
+import time
+from contextlib import contextmanager
+
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.context_managers import settings, hide
+from fabric.utils import abort
+
+from .remote import REMOTE_STATE_DIR, SCRIPT_HEADER, python_command, venv_run
+from .utils import print_table
+
+RUNNER_SOCKET = REMOTE_STATE_DIR + "/manage.sock"
+RUNNER_PIDFILE = REMOTE_STATE_DIR + "/manage.pid"
+RUNNER_LOG = REMOTE_STATE_DIR + "/manage.log"
+RESULT_MARKER = "@@djdeploy-result "
+DEFAULT_IDLE_TIMEOUT = 3600
+
+# Boots Django of the project in the working directory; the settings module is read from `src/manage.py` unless given
+DJANGO_SETUP = r'''
+import os, re, time
+
+HOME = os.getcwd()
+
+sys.path.insert(0, os.path.join(HOME, "src"))
+
+if PAYLOAD.get("settings"):
+    os.environ["DJANGO_SETTINGS_MODULE"] = PAYLOAD["settings"]
+elif not os.environ.get("DJANGO_SETTINGS_MODULE"):
+    with open(os.path.join(HOME, "src", "manage.py")) as manage_py:
+        match = re.search(r"DJANGO_SETTINGS_MODULE['\"]\s*,\s*['\"]([\w.]+)", manage_py.read())
+
+    if not match:
+        sys.exit("Cannot detect DJANGO_SETTINGS_MODULE, set `django_settings_module` in deploy.json")
+
+    os.environ["DJANGO_SETTINGS_MODULE"] = match.group(1)
+
+boot_start = time.time()
+
+import django
+
+django.setup()
+'''
+
+# Boots Django once and runs management commands sent over a unix socket one after another
+SERVER_SCRIPT = SCRIPT_HEADER + DJANGO_SETUP + r'''
+import shlex, traceback
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+MARKER = PAYLOAD["marker"].encode("utf-8")
+
+from django.core.management import call_command
+from django.db import close_old_connections
+
+
+class Writer(object):
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.at_line_start = True
+
+    def write(self, data):
+        if not data:
+            return
+
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+
+        self.wfile.write(data)
+        self.wfile.flush()
+        self.at_line_start = data.endswith(b"\n")
+
+    def flush(self):
+        self.wfile.flush()
+
+    def isatty(self):
+        return False
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode("utf-8"))
+
+        if request.get("exit"):
+            self.server.stopped = True
+            return
+
+        out = Writer(self.wfile)
+        status = 0
+        start = time.time()
+        stdout, stderr = sys.stdout, sys.stderr
+
+        try:
+            sys.stdout = sys.stderr = out
+            os.chdir(os.path.join(HOME, request.get("cwd") or "."))
+            close_old_connections()
+
+            if request.get("script"):
+                # Python code using the booted Django, with its own payload
+                exec(request["script"], dict(globals(), PAYLOAD=request.get("payload") or {}, boot_start=time.time()))
+            else:
+                argv = shlex.split(request["command"])
+                call_command(argv[0], *argv[1:], stdout=out, stderr=out)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc(file=out)
+            status = 1
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            os.chdir(HOME)
+            close_old_connections()
+
+        result = {"command": request["command"], "status": status, "elapsed": time.time() - start}
+
+        if not out.at_line_start:
+            out.write(b"\n")
+
+        out.write(MARKER + json.dumps(result).encode("utf-8") + b"\n")
+
+
+if os.path.exists(PAYLOAD["socket"]):
+    os.remove(PAYLOAD["socket"])
+
+server = socketserver.UnixStreamServer(PAYLOAD["socket"], Handler)
+server.timeout = PAYLOAD["idle_timeout"]
+server.stopped = False
+
+
+def handle_timeout():
+    server.stopped = True
+
+
+server.handle_timeout = handle_timeout
+
+print("Django booted in %.2f s" % (time.time() - boot_start))
+sys.stdout.flush()
+
+try:
+    while not server.stopped:
+        server.handle_request()
+finally:
+    server.server_close()
+    os.remove(PAYLOAD["socket"])
+'''
+
+CLIENT_SCRIPT = SCRIPT_HEADER + r'''
+import socket
+
+MARKER = PAYLOAD["marker"].encode("utf-8")
+
+client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+client.connect(PAYLOAD["socket"])
+client.sendall((json.dumps(PAYLOAD["request"]) + "\n").encode("utf-8"))
+
+out = getattr(sys.stdout, "buffer", sys.stdout)
+status = 1
+
+for line in client.makefile("rb"):
+    if line.startswith(MARKER):
+        status = json.loads(line[len(MARKER):].decode("utf-8"))["status"]
+
+    out.write(line)
+    out.flush()
+
+sys.exit(status)
+'''
+
+
+def _payload(**kwargs):
+    payload = {'socket': RUNNER_SOCKET, 'marker': RESULT_MARKER}
+    payload.update(kwargs)
+
+    return payload
+
+
+def start_runner():
+    print(Fore.BLUE + "Starting persistent Django management runner")
+
+    start_ = time.time()
+    server = python_command(SERVER_SCRIPT, _payload(settings=env.get('django_settings_module'),
+                                                    idle_timeout=env.get('manage_runner_idle_timeout', DEFAULT_IDLE_TIMEOUT)))
+
+    venv_run("mkdir -p {state_dir} && rm -f {socket} && "
+             "(nohup {server} > {log} 2>&1 < /dev/null & echo $! > {pidfile}) && "
+             "for i in $(seq 1 1200); do "
+             "[ -S {socket} ] && exit 0; "
+             "kill -0 $(cat {pidfile}) 2> /dev/null || break; "
+             "sleep 0.1; "
+             "done; cat {log}; exit 1".format(state_dir=REMOTE_STATE_DIR, socket=RUNNER_SOCKET, pidfile=RUNNER_PIDFILE,
+                                              log=RUNNER_LOG, server=server), pty=False)
+
+    print(Fore.GREEN + Style.BRIGHT + "Django management runner ready in {0:.1f} s".format(time.time() - start_))
+
+
+def stop_runner():
+    with settings(hide('running'), warn_only=True):
+        venv_run("[ -S {socket} ] && {client}; "
+                 "[ -f {pidfile} ] && kill $(cat {pidfile}) 2> /dev/null; "
+                 "rm -f {socket} {pidfile}".format(socket=RUNNER_SOCKET, pidfile=RUNNER_PIDFILE,
+                                                   client=python_command(CLIENT_SCRIPT, _payload(request={'exit': True}))))
+
+
+def parse_results(output):
+    results = []
+
+    for line in output.splitlines():
+        if line.startswith(RESULT_MARKER):
+            results.append(json.loads(line[len(RESULT_MARKER):]))
+
+    return results
+
+
+def _send(request, command):
+    with settings(warn_only=True):
+        output = venv_run(python_command(CLIENT_SCRIPT, _payload(request=request)))
+
+    results = parse_results(output)
+    result = results[-1] if results else {'command': command, 'status': output.return_code or 1, 'elapsed': 0}
+    result['output'] = output
+
+    if result['status'] and not env.warn_only:
+        abort("Management command `{0}` failed with exit status {1}".format(command, result['status']))
+
+    return result
+
+
+def run_command(command, cwd=None):
+    """
+    Dispatch one management command to the running runner. Aborts on a non-zero exit status unless `warn_only` is set.
+    """
+    return _send({'command': command.strip(), 'cwd': cwd}, command)
+
+
+def run_script(script, payload, description):
+    """
+    Run Python ``script`` in the booted Django of the runner, ``PAYLOAD`` being ``payload``; returns the result
+    of `run_command` with the output of the script.
+    """
+    return _send({'command': description, 'script': script, 'payload': payload}, description)
+
+
+@contextmanager
+def django_runner():
+    start_runner()
+
+    try:
+        with settings(manage_runner_active=True):
+            yield
+    finally:
+        stop_runner()
+
+
+def print_results(results):
+    from terminaltables import AsciiTable
+
+    rows = [['Command', 'Status', 'Time [s]']]
+
+    for result in results:
+        rows.append([result['command'], '{0}'.format(result['status']), '{0:.2f}'.format(result['elapsed'])])
+
+    table = AsciiTable(rows, " Management commands ")
+    table.justify_columns[2] = 'right'
+
+    print_table(table)
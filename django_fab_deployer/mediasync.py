@@ -0,0 +1,242 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import fnmatch
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.utils import abort
+from six.moves import shlex_quote
+
+from .remote import remote_abspath, ssh_argv, ssh_base_argv, ssh_destination
+from .streaming import format_size
+from .utils import local_state_path, print_table
+
+REMOTE_MEDIA_DIR = "data/media"
+LOCAL_MEDIA_DIR = os.path.join("data", "media")
+EXCLUDE_PATTERNS = ['.git*', 'cache*', 'filer_*']
+DEFAULT_STREAMS = 4
+DATE_MARKER = "@@djdeploy-date "
+
+
+def _index_path():
+    return local_state_path("media-index", "{0}.json".format(env.target_name))
+
+
+def load_index():
+    try:
+        with open(_index_path()) as index_file:
+            return json.load(index_file)
+    except (IOError, ValueError):
+        return None
+
+
+def save_index(index):
+    directory = os.path.dirname(_index_path())
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(_index_path() + ".tmp", "w") as index_file:
+        json.dump(index, index_file)
+
+    os.rename(_index_path() + ".tmp", _index_path())
+
+
+def _find_command(since=None):
+    excludes = " -o ".join("-name '{0}'".format(pattern) for pattern in EXCLUDE_PATTERNS)
+    newer = "-newerct @{0} ".format(int(since)) if since else ""
+
+    # `ctime` also changes when a file is moved into place with its original mtime
+    return ("echo {marker}$(date +%s) && cd {media} && "
+            "find . \\( {excludes} \\) -prune -o -type f {newer}-printf '%P\\t%s\\t%T@\\n'".format(marker=DATE_MARKER,
+                                                                                                  media=remote_abspath(REMOTE_MEDIA_DIR),
+                                                                                                  excludes=excludes,
+                                                                                                  newer=newer))
+
+
+def remote_listing(since=None):
+    """
+    Returns ``(remote_time, {path: [size, mtime]})`` for files changed since ``since`` (all files without it).
+    """
+    process = subprocess.Popen(ssh_argv(_find_command(since)), stdout=subprocess.PIPE)
+    remote_time = None
+    files = {}
+
+    for line in process.stdout:
+        line = line.decode('utf-8', 'replace').rstrip("\n")
+
+        if line.startswith(DATE_MARKER):
+            remote_time = int(line[len(DATE_MARKER):])
+            continue
+
+        path, size, mtime = line.rsplit("\t", 2)
+        files[path] = [int(size), int(float(mtime))]
+
+    if process.wait() != 0 or remote_time is None:
+        abort("Listing remote media failed")
+
+    return remote_time, files
+
+
+def _local_entry(path):
+    try:
+        stat = os.stat(os.path.join(LOCAL_MEDIA_DIR, path))
+    except OSError:
+        return None
+
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def changed_files(listing, index, full):
+    if full:
+        return sorted(path for path, entry in listing.items() if _local_entry(path) != entry)
+
+    known = index['files'] if index else {}
+
+    return sorted(path for path, entry in listing.items() if known.get(path) != entry)
+
+
+def shard(paths, listing, streams):
+    """
+    Split paths into at most ``streams`` shards; whole top-level directories go to the shard with the fewest bytes.
+    """
+    groups = {}
+
+    for path in paths:
+        top_level = path.split("/", 1)[0] if "/" in path else "."
+        groups.setdefault(top_level, []).append(path)
+
+    shards = [{'dirs': [], 'paths': [], 'bytes': 0} for _ in range(max(1, min(streams, len(groups))))]
+
+    for top_level, group in sorted(groups.items(), key=lambda item: -sum(listing[path][0] for path in item[1])):
+        target = min(shards, key=lambda one_shard: one_shard['bytes'])
+        target['dirs'].append(top_level)
+        target['paths'].extend(group)
+        target['bytes'] += sum(listing[path][0] for path in group)
+
+    return [one_shard for one_shard in shards if one_shard['paths']]
+
+
+def _start_rsync(one_shard):
+    files_from = tempfile.NamedTemporaryFile(mode="w", suffix=".files", delete=False)
+    files_from.write("\n".join(one_shard['paths']) + "\n")
+    files_from.close()
+
+    rsh = " ".join(shlex_quote(arg) for arg in ssh_base_argv())
+    argv = ['rsync', '-a', '--files-from={0}'.format(files_from.name), '-e', rsh,
+            "{0}:{1}/".format(ssh_destination(), remote_abspath(REMOTE_MEDIA_DIR)),
+            LOCAL_MEDIA_DIR + "/"]
+
+    one_shard['files_from'] = files_from.name
+    one_shard['start'] = time.time()
+    one_shard['process'] = subprocess.Popen(argv)
+
+
+def transfer(shards):
+    if not os.path.isdir(LOCAL_MEDIA_DIR):
+        os.makedirs(LOCAL_MEDIA_DIR)
+
+    for one_shard in shards:
+        _start_rsync(one_shard)
+
+    for one_shard in shards:
+        one_shard['exit_code'] = one_shard['process'].wait()
+        one_shard['elapsed'] = time.time() - one_shard['start']
+        os.remove(one_shard['files_from'])
+
+    return all(one_shard['exit_code'] == 0 for one_shard in shards)
+
+
+def is_excluded(path):
+    """
+    Whether any component of ``path`` matches `EXCLUDE_PATTERNS`, like the `find -prune` of the remote listing.
+    """
+    return any(fnmatch.fnmatch(component, pattern) for component in path.split("/") for pattern in EXCLUDE_PATTERNS)
+
+
+def delete_extraneous(listing):
+    removed = 0
+
+    for root, dirs, files in os.walk(LOCAL_MEDIA_DIR):
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), LOCAL_MEDIA_DIR).replace(os.sep, "/")
+
+            # Excluded files are never listed, they are not missing on the server
+            if path not in listing and not is_excluded(path):
+                os.remove(os.path.join(root, name))
+                removed += 1
+
+    return removed
+
+
+def print_report(shards, scanned, elapsed):
+    from terminaltables import AsciiTable
+
+    rows = [['Shard', 'Directories', 'Files', 'Size', 'Time [s]', 'Result']]
+
+    for number, one_shard in enumerate(shards, 1):
+        dirs = one_shard['dirs']
+
+        rows.append(['{0}'.format(number),
+                     ", ".join(dirs[:3]) + (" (+{0})".format(len(dirs) - 3) if len(dirs) > 3 else ""),
+                     '{0}'.format(len(one_shard['paths'])),
+                     format_size(one_shard['bytes']),
+                     '{0:.1f}'.format(one_shard['elapsed']),
+                     'OK' if one_shard['exit_code'] == 0 else "rsync exit code {0}".format(one_shard['exit_code'])])
+
+    table = AsciiTable(rows, " Media sync ")
+
+    for column in (2, 3, 4):
+        table.justify_columns[column] = 'right'
+
+    print_table(table)
+
+    print('{0:<13} {1}'.format("Scanned:", scanned))
+    print('{0:<13} {1}'.format("Transferred:", sum(len(one_shard['paths']) for one_shard in shards)))
+    print('{0:<13} {1}'.format("Size:", format_size(sum(one_shard['bytes'] for one_shard in shards))))
+    print('{0:<13} {1:.1f} s'.format("Time:", elapsed))
+
+
+def sync(full=False, delete=False, streams=DEFAULT_STREAMS):
+    start_ = time.time()
+    index = None if full or delete else load_index()
+
+    if index:
+        print(Fore.BLUE + "Listing remote media changed since the last sync")
+    else:
+        print(Fore.BLUE + "Listing all remote media")
+
+    remote_time, listing = remote_listing(since=index['synced_at'] if index else None)
+    paths = changed_files(listing, index, full=not index)
+    shards = shard(paths, listing, streams)
+
+    print(Fore.BLUE + "{0} of {1} listed file(s) changed, transferring in {2} stream(s)".format(len(paths), len(listing), len(shards)))
+
+    ok = transfer(shards)
+
+    if delete:
+        print(Fore.YELLOW + "Removed {0} local file(s) missing on the server".format(delete_extraneous(listing)))
+
+    print_report(shards, len(listing), time.time() - start_)
+
+    if not ok:
+        abort("Some media were not transferred, the index was not updated")
+
+    files = dict(index['files']) if index else {}
+    files.update(listing)
+
+    if not index:
+        # A full listing is authoritative, forget files removed on the server
+        files = listing
+
+    save_index({'synced_at': remote_time, 'files': files})
+
+    print(Fore.GREEN + Style.BRIGHT + "Media index updated")
@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import json
+import re
+
+from colorama import Fore
+from fabric.api import env
+from fabric.context_managers import settings, hide
+from fabric.utils import abort
+
+from . import management
+from .management import DJANGO_SETUP
+from .remote import SCRIPT_HEADER, python_command, venv_run
+from .utils import print_table
+
+RESULT_MARKER = "@@djdeploy-migrations "
+OUTPUT_TAIL_LINES = 30
+
+# Lists the unapplied migrations of every database, the way `migrate` would plan them; runs in the persistent
+# runner when there is one, otherwise in `PLAN_SCRIPT` which boots Django for it
+PLAN_BODY = r'''
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+
+databases = {}
+
+for alias in PAYLOAD["databases"]:
+    connection = connections[alias]
+    executor = MigrationExecutor(connection)
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    settings_dict = connection.settings_dict
+
+    databases[alias] = {
+        "pending": ["%s.%s" % (migration.app_label, migration.name) for migration, backwards in plan],
+        # `migrate` reports conflicting leaf migrations itself
+        "conflicts": sorted(executor.loader.detect_conflicts()),
+        # Aliases of one physical database must not be migrated at the same time
+        "server": "|".join("%s" % (settings_dict.get(key) or "") for key in ("ENGINE", "HOST", "PORT", "NAME")),
+    }
+    connection.close()
+
+print(PAYLOAD["marker"] + json.dumps({"databases": databases, "boot": time.time() - boot_start}))
+'''
+
+PLAN_SCRIPT = SCRIPT_HEADER + DJANGO_SETUP + PLAN_BODY
+
+# Output line of `migrate -v 2` for one migration
+APPLYING = r"Applying ([\w.]+)\.\.\.(?: (OK|FAKED)(?: \(([\d.]+)s\))?)?"
+
+# Migrates every group of databases in its own thread, the databases of one group one after another
+MIGRATE_SCRIPT = SCRIPT_HEADER + r'''
+import re, subprocess, threading, time
+
+APPLYING = re.compile(PAYLOAD["applying"])
+results = {}
+
+def migrate(aliases):
+    for alias in aliases:
+        start = time.time()
+        process = subprocess.Popen([sys.executable, "src/manage.py", "migrate", "--noinput", "-v", "2", "--database", alias],
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0].decode("utf-8", "replace")
+        applied = [{"name": name, "state": state or "FAILED", "elapsed": float(elapsed) if elapsed else None}
+                   for name, state, elapsed in APPLYING.findall(output)]
+        results[alias] = {"status": process.returncode, "elapsed": time.time() - start, "applied": applied,
+                          "output": output.splitlines()[-PAYLOAD["tail"]:] if process.returncode else []}
+        if process.returncode:
+            break
+
+threads = [threading.Thread(target=migrate, args=(group,)) for group in PAYLOAD["groups"]]
+
+for thread in threads:
+    thread.start()
+
+for thread in threads:
+    thread.join()
+
+print(PAYLOAD["marker"] + json.dumps(results))
+'''
+
+
+def databases():
+    return ['default'] + [alias for alias in env.extra_databases if alias != 'default']
+
+
+def _run_script(script, payload, description, runner_script=None):
+    payload = dict(payload, marker=RESULT_MARKER)
+
+    with settings(hide('running', 'stdout'), warn_only=True):
+        if runner_script and env.get('manage_runner_active'):
+            output = management.run_script(runner_script, payload, description)['output']
+        else:
+            output = venv_run(python_command(script, payload), pty=False)
+
+    for line in output.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+
+    abort("{0} failed: {1}".format(description, output.strip()[-1000:]))
+
+
+def plan(aliases):
+    """
+    ``{alias: {'pending', 'conflicts', 'server'}}`` of ``aliases``, computed in a single Django boot.
+    """
+    return _run_script(PLAN_SCRIPT, {'databases': aliases, 'settings': env.get('django_settings_module')},
+                       "Planning migrations", runner_script=PLAN_BODY)['databases']
+
+
+def needs_migrate(database_plan):
+    return bool(database_plan['pending'] or database_plan['conflicts'])
+
+
+def groups(databases_plan, aliases):
+    """
+    Aliases grouped by the database server and name they point to; groups are independent of each other.
+    """
+    by_server = {}
+
+    for alias in aliases:
+        by_server.setdefault(databases_plan[alias]['server'], []).append(alias)
+
+    return sorted(by_server.values())
+
+
+def _applied(output):
+    return [{'name': name, 'state': state or 'FAILED', 'elapsed': float(elapsed) if elapsed else None}
+            for name, state, elapsed in re.findall(APPLYING, output)]
+
+
+def _apply_in_runner(alias_groups):
+    results = {}
+
+    for group in alias_groups:
+        for alias in group:
+            with settings(hide('running', 'stdout'), warn_only=True):
+                result = management.run_command("migrate --noinput -v 2 --database {0}".format(alias))
+
+            lines = [line for line in result['output'].splitlines() if not line.startswith(management.RESULT_MARKER)]
+            results[alias] = {'status': result['status'], 'elapsed': result['elapsed'], 'applied': _applied(result['output']),
+                              'output': lines[-OUTPUT_TAIL_LINES:] if result['status'] else []}
+
+            if result['status']:
+                break
+
+    return results
+
+
+def apply(alias_groups):
+    """
+    Migrate the groups concurrently, or one after another in the persistent runner when there is one;
+    returns ``{alias: {'status', 'elapsed', 'applied', 'output'}}``.
+    """
+    if env.get('manage_runner_active'):
+        return _apply_in_runner(alias_groups)
+
+    return _run_script(MIGRATE_SCRIPT, {'groups': alias_groups, 'tail': OUTPUT_TAIL_LINES, 'applying': APPLYING}, "Migrating")
+
+
+def print_report(results):
+    from terminaltables import AsciiTable
+
+    rows = [['Database', 'Migration', 'Result', 'Time [s]']]
+
+    for alias in sorted(results):
+        for migration in results[alias]['applied']:
+            rows.append([alias,
+                         migration['name'],
+                         migration['state'],
+                         '{0:.3f}'.format(migration['elapsed']) if migration['elapsed'] is not None else '-'])
+
+        rows.append([alias, '(total)', 'OK' if not results[alias]['status'] else 'FAILED', '{0:.1f}'.format(results[alias]['elapsed'])])
+
+    table = AsciiTable(rows, " Migrations ")
+    table.justify_columns[3] = 'right'
+    print_table(table)
+
+    for alias in sorted(results):
+        if results[alias]['status']:
+            print(Fore.RED + "Output of `migrate --database {0}`:".format(alias))
+            print("\n".join(results[alias]['output']))
@@ -0,0 +1,165 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import sys
+import time
+from functools import wraps
+
+from colorama import Fore, Style
+from fabric.api import env, execute, settings
+from fabric.utils import abort
+
+from . import tracing
+from .utils import print_table
+
+DEFAULT_POOL_SIZE = 5
+
+
+class _HostPrefixedStream(object):
+    def __init__(self, stream, host):
+        self._stream = stream
+        self._prefix = "[{0}] ".format(host)
+        self._at_line_start = True
+
+    def write(self, data):
+        for line in data.splitlines(True):
+            if self._at_line_start and not line.startswith(self._prefix):
+                self._stream.write(self._prefix)
+
+            self._stream.write(line)
+            self._at_line_start = line.endswith("\n")
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _describe_error(e):
+    message = getattr(e, 'message', None) or "{0}".format(e)
+
+    return message if message not in ('', '1') else e.__class__.__name__
+
+
+def hosts_for_roles(roles):
+    hosts = []
+
+    for role in roles:
+        if role not in env.roledefs:
+            abort("Unknown role `{0}`, known roles are: {1}".format(role, ", ".join(sorted(env.roledefs))))
+
+        for host in env.roledefs[role]:
+            if host not in hosts:
+                hosts.append(host)
+
+    return hosts
+
+
+def is_primary_host():
+    return len(env.hosts) <= 1 or env.host_string == env.primary_host or env.host == env.primary_host
+
+
+def primary_only(func):
+    """
+    Steps touching shared state (database, dumps) run only on ``env.primary_host`` when a target has several hosts.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not is_primary_host():
+            print(Fore.YELLOW + "`{0}` runs only on the primary host {1}, skipped.".format(func.__name__, env.primary_host))
+            return None
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _host_runner(func):
+    @wraps(func)
+    def run_on_host(*args, **kwargs):
+        start_ = time.time()
+        stdout, stderr = sys.stdout, sys.stderr
+
+        if env.parallel:
+            sys.stdout = _HostPrefixedStream(stdout, env.host_string)
+            sys.stderr = _HostPrefixedStream(stderr, env.host_string)
+
+        try:
+            with tracing.span(func.__name__.strip("_"), 'host'):
+                value = func(*args, **kwargs)
+        except (Exception, SystemExit) as e:
+            return {'ok': False, 'elapsed': time.time() - start_, 'error': _describe_error(e), 'value': None}
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+        return {'ok': True, 'elapsed': time.time() - start_, 'error': '', 'value': value}
+
+    return run_on_host
+
+
+def print_host_summary(task_name, results, elapsed):
+    from terminaltables import AsciiTable
+
+    rows = [['Host', 'Result', 'Time [s]', 'Error']]
+
+    for host in env.hosts:
+        result = results.get(host) or {'ok': False, 'elapsed': 0, 'error': 'No result'}
+        rows.append([host, 'OK' if result['ok'] else 'FAILED', '{0:.1f}'.format(result['elapsed']), result['error']])
+
+    table = AsciiTable(rows, " {0} ".format(task_name))
+    table.justify_columns[2] = 'right'
+
+    print_table(table)
+
+    failed = len([row for row in rows[1:] if row[1] != 'OK'])
+    color = Fore.RED if failed else Fore.GREEN
+
+    print(color + Style.BRIGHT + "{0} host(s) OK, {1} failed, wall-clock {2:.1f} s".format(len(rows) - 1 - failed, failed, elapsed))
+
+    return failed
+
+
+def run_on(hosts, func, *args, **kwargs):
+    """
+    Run ``func`` on ``hosts`` with the bounded worker pool; returns ``{host: {'ok', 'elapsed', 'error'}}``.
+    """
+    parallel = env.get('parallel_hosts', True) and len(hosts) > 1
+
+    with settings(fan_out_active=True, parallel=parallel, pool_size=min(env.get('pool_size') or DEFAULT_POOL_SIZE, len(hosts))):
+        return execute(_host_runner(func), hosts=hosts, *args, **kwargs)
+
+
+def on_hosts(func, *args, **kwargs):
+    """
+    Run ``func`` on every host of the target using a bounded worker pool and print an aggregated summary.
+    """
+    if len(env.hosts) <= 1 or env.get('fan_out_active'):
+        return func(*args, **kwargs)
+
+    start_ = time.time()
+    results = run_on(env.hosts, func, *args, **kwargs)
+
+    if print_host_summary(func.__name__, results, time.time() - start_):
+        abort("`{0}` failed on some hosts".format(func.__name__))
+
+    return results
+
+
+def fan_out(func):
+    """
+    Fabric calls host tasks once per host; for multi-host targets the first call dispatches
+    the task to all hosts at once and the remaining calls are no-ops.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if len(env.hosts) <= 1 or env.get('fan_out_active'):
+            return func(*args, **kwargs)
+
+        if env.host_string != env.hosts[0]:
+            return None
+
+        return on_hosts(func, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,181 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import re
+
+from fabric.api import env
+from fabric.context_managers import settings, hide
+from fabric.operations import run
+
+from .remote import SCRIPT_HEADER, SYSTEM_PYTHON, python_command
+from .streaming import format_size
+from .utils import print_table
+
+FORMAT_EXTENSIONS = {
+    'plain': 'sql',
+    'custom': 'backup',
+    'directory': 'dir',
+}
+
+SUMMARY_TABLES = 20
+
+# Prefixes every line of pg_dump's verbose output with a timestamp
+TIMESTAMP_SCRIPT = SCRIPT_HEADER + r'''
+import time
+
+for line in iter(sys.stdin.readline, ""):
+    sys.stdout.write("%.3f %s" % (time.time(), line))
+    sys.stdout.flush()
+'''
+
+_DUMPING_RE = re.compile(r'dumping contents of table "?(?:public\.)?"?([^"\s]+)"?')
+_FINISHED_RE = re.compile(r'finished item \d+ TABLE DATA (\S+)')
+_TOC_RE = re.compile(r'^(\d+);\s+\d+\s+\d+\s+TABLE DATA\s+(\S+)\s+(\S+)')
+
+
+def jobs_for_host(out_format, jobs=None):
+    """
+    Parallel jobs of the dump; the cores of the host are only asked for when ``out_format`` can use them.
+    """
+    if jobs:
+        return int(jobs)
+
+    if out_format != 'directory':
+        return None
+
+    with settings(hide('everything')):
+        return max(1, int(run("nproc").strip()))
+
+
+def table_filter_args():
+    args = ["--table={0}".format(table) for table in env.dump_tables]
+    # Only the data is skipped, the table itself is still created on restore
+    args += ["--exclude-table-data={0}".format(table) for table in env.dump_exclude_tables]
+
+    return " ".join(args)
+
+
+def dump_command(out_format, dump_path, jobs):
+    return ("set -o pipefail && pg_dump "
+            "--format={out_format} "  # plain || custom || directory
+            "--dbname={db_name} "
+            "--encoding=utf8 "
+            "--verbose "
+            "--schema=public "
+            "--clean "  # Drop all DB objects; only applied when out_format == plain
+            "{jobs}"
+            "{tables}"
+            "-f {dump_path} 2>&1 | {timestamp}".format(out_format=out_format,
+                                                        db_name=env.db_name,
+                                                        jobs="--jobs={0} ".format(jobs) if out_format == 'directory' else "",
+                                                        tables=table_filter_args() + " " if table_filter_args() else "",
+                                                        dump_path=dump_path,
+                                                        timestamp=python_command(TIMESTAMP_SCRIPT, python=SYSTEM_PYTHON)))
+
+
+def restore_hint(out_format, dump_filename, jobs):
+    if out_format == 'plain':
+        return "psql --file={dump_filename} --dbname={db_name}".format(dump_filename=dump_filename, db_name=env.db_name)
+
+    return ("pg_restore {dump_filename} "
+            "--clean "
+            "--exit-on-error "
+            "--format={out_format} "
+            "--jobs={jobs} "
+            "--verbose "
+            "-n public "  # Restore only public schema
+            "--dbname={db_name} "
+            "[--data-only][--schema-only]".format(out_format=out_format, dump_filename=dump_filename, jobs=jobs or "$(nproc)", db_name=env.db_name))
+
+
+def table_timings(output, parallel):
+    """
+    Time spent per table, from the timestamped verbose output. Parallel dumps report when each table finished,
+    serial dumps are measured up to the start of the next table.
+    """
+    started = {}
+    finished = {}
+    last_started = None
+    last_timestamp = None
+
+    for line in output.splitlines():
+        timestamp, _, message = line.partition(" ")
+
+        try:
+            timestamp = float(timestamp)
+        except ValueError:
+            continue
+
+        last_timestamp = timestamp
+        match = _DUMPING_RE.search(message)
+
+        if match:
+            if last_started and not parallel:
+                finished.setdefault(last_started, timestamp)
+
+            started[match.group(1)] = timestamp
+            last_started = match.group(1)
+            continue
+
+        match = _FINISHED_RE.search(message)
+
+        if match:
+            finished[match.group(1)] = timestamp
+
+    if last_started and not parallel:
+        finished.setdefault(last_started, last_timestamp)
+
+    return dict((table, finished[table] - start) for table, start in started.items() if table in finished)
+
+
+def directory_table_sizes(dump_path):
+    with settings(hide('everything'), warn_only=True):
+        output = run("pg_restore --list {0}; echo @@; cd {0} && stat -c '%n %s' *.dat* 2> /dev/null; true".format(dump_path))
+
+    toc, _, files = output.partition("@@")
+    tables = {}
+
+    for line in toc.splitlines():
+        match = _TOC_RE.match(line.strip())
+
+        if match:
+            tables[match.group(1)] = match.group(3)
+
+    sizes = {}
+
+    for line in files.splitlines():
+        name, _, size = line.strip().rpartition(" ")
+        dump_id = name.split(".")[0]
+
+        if dump_id in tables and size.isdigit():
+            sizes[tables[dump_id]] = int(size)
+
+    return sizes
+
+
+def total_size(dump_path):
+    with settings(hide('everything'), warn_only=True):
+        return int((run("du -sb {0} | cut -f1".format(dump_path)).strip() or "0").split()[0])
+
+
+def print_summary(timings, sizes, size, elapsed):
+    from terminaltables import AsciiTable
+
+    rows = [['Table', 'Size', 'Time [s]']]
+    tables = sorted(set(timings) | set(sizes), key=lambda table: (timings.get(table, 0), sizes.get(table, 0)), reverse=True)
+
+    for table in tables[:SUMMARY_TABLES]:
+        rows.append([table,
+                     format_size(sizes[table]) if table in sizes else '-',
+                     '{0:.1f}'.format(timings[table]) if table in timings else '-'])
+
+    table = AsciiTable(rows, " Slowest tables ({0} of {1}) ".format(min(len(tables), SUMMARY_TABLES), len(tables)))
+    table.justify_columns[1] = 'right'
+    table.justify_columns[2] = 'right'
+
+    print_table(table)
+
+    print('{0:<10} {1}'.format("Size:", format_size(size)))
+    print('{0:<10} {1:.1f} s'.format("Time:", elapsed))
@@ -0,0 +1,285 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import json
+import subprocess
+import time
+
+from colorama import Fore
+from fabric.api import env, run
+from fabric.context_managers import settings, hide
+from fabric.network import normalize
+from fabric.utils import abort
+
+from .remote import SCRIPT_HEADER, SYSTEM_PYTHON, python_command, ssh_argv
+from .utils import print_table
+
+RESULT_MARKER = "@@djdeploy-status "
+DEFAULT_CONCURRENCY = 16
+CONNECT_TIMEOUT = 10
+
+# Gathers everything `status` shows in one call, using the system Python so that a broken virtualenv still reports
+PROBE_SCRIPT = SCRIPT_HEADER + r'''
+import os, socket, subprocess, time
+
+def sh(command):
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode("utf-8", "replace")
+    return process.returncode, output
+
+def read(path):
+    try:
+        with open(path) as opened_file:
+            return opened_file.read()
+    except IOError:
+        return ""
+
+def memory():
+    values = {}
+    for line in read("/proc/meminfo").splitlines():
+        name, _, value = line.partition(":")
+        if value.split():
+            values[name] = int(value.split()[0]) * 1024
+    if "MemTotal" not in values:
+        return None
+    available = values.get("MemAvailable", values.get("MemFree", 0) + values.get("Buffers", 0) + values.get("Cached", 0))
+    return {"total": values["MemTotal"], "available": available}
+
+def disk(path):
+    while path and not os.path.exists(path):
+        path = os.path.dirname(path)
+    stat = os.statvfs(path or "/")
+    return {"path": path or "/", "total": stat.f_blocks * stat.f_frsize, "free": stat.f_bavail * stat.f_frsize}
+
+def supervisor():
+    code, output = sh("supervisorctl status")
+    programs = []
+    for line in output.splitlines():
+        parts = line.split(None, 2)
+        if len(parts) > 1 and PAYLOAD["program"] in parts[0]:
+            programs.append({"name": parts[0], "state": parts[1], "info": parts[2] if len(parts) > 2 else ""})
+    # `supervisorctl status` exits non-zero when a program is down, which the states already show
+    return programs, "" if programs or not code else output.strip()[-200:]
+
+def service(name):
+    code, output = sh("service %s status" % name)
+    return {0: "running", 3: "stopped"}.get(code, "unknown (exit code %d)" % code)
+
+try:
+    load = list(os.getloadavg())
+except OSError:
+    load = None
+
+programs, supervisor_error = supervisor()
+uptime = read("/proc/uptime").split()
+
+print(PAYLOAD["marker"] + json.dumps({
+    "hostname": socket.gethostname(),
+    "time": time.time(),
+    "uptime": float(uptime[0]) if uptime else None,
+    "load": load,
+    "cpus": os.sysconf("SC_NPROCESSORS_ONLN") if hasattr(os, "sysconf") else None,
+    "memory": memory(),
+    "disk": disk(PAYLOAD["path"]),
+    "programs": programs,
+    "supervisor_error": supervisor_error,
+    "services": dict((name, service(name)) for name in PAYLOAD["services"]),
+}))
+'''
+
+
+def watched_services():
+    services = ['nginx', 'supervisor']
+
+    if env.db_engine == 'postgresql':
+        services.append('postgresql')
+    elif env.db_engine == 'mysql':
+        services.append('mysql')
+    else:
+        print("Unsupported database engine {}".format(env.db_engine))
+
+    return services
+
+
+def probe_command():
+    payload = {'program': env.supervisor_program, 'path': env.deploy_root, 'services': watched_services(), 'marker': RESULT_MARKER}
+
+    return python_command(PROBE_SCRIPT, payload, python=SYSTEM_PYTHON)
+
+
+def parse(output):
+    for line in output.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+
+    return None
+
+
+def probe():
+    """
+    Status report of the current host gathered in one remote call.
+    """
+    with settings(hide('running', 'stdout'), warn_only=True):
+        output = run(probe_command(), pty=False)
+
+    report = parse(output)
+
+    if report is None:
+        abort("Status probe failed: {0}".format(output.strip()[-500:]))
+
+    return report
+
+
+def _size(value):
+    for unit in ['B', 'K', 'M', 'G']:
+        if abs(value) < 1024:
+            return "{0:.0f}{1}".format(value, unit) if unit == 'B' else "{0:.1f}{1}".format(value, unit)
+
+        value /= 1024.0
+
+    return "{0:.1f}T".format(value)
+
+
+def _duration(seconds):
+    if seconds is None:
+        return '-'
+
+    days, seconds = divmod(int(seconds), 86400)
+    hours, seconds = divmod(seconds, 3600)
+
+    if days:
+        return "{0}d {1}h".format(days, hours)
+
+    return "{0}h {1}m".format(hours, seconds // 60)
+
+
+def _load(report):
+    return " ".join("{0:.2f}".format(value) for value in report['load']) if report['load'] else '-'
+
+
+def _memory(report):
+    memory = report['memory']
+
+    if not memory:
+        return '-'
+
+    used = memory['total'] - memory['available']
+
+    return "{0:.0f}% of {1}".format(100.0 * used / memory['total'], _size(memory['total']))
+
+
+def _disk(report):
+    disk = report['disk']
+    used = disk['total'] - disk['free']
+
+    return "{0:.0f}% ({1} free)".format(100.0 * used / disk['total'] if disk['total'] else 0, _size(disk['free']))
+
+
+def _down(report):
+    return [program['name'] for program in report['programs'] if program['state'] != 'RUNNING']
+
+
+def _failed_services(report):
+    return ["{0}: {1}".format(name, state) for name, state in sorted(report['services'].items()) if state != 'running']
+
+
+def print_report(report):
+    from terminaltables import AsciiTable
+
+    rows = [['Program', 'State', 'Info']]
+
+    for program in report['programs']:
+        rows.append([program['name'], program['state'], program['info']])
+
+    if report['supervisor_error']:
+        rows.append(['supervisor', 'ERROR', report['supervisor_error']])
+
+    print_table(AsciiTable(rows, " {0} ".format(report['hostname'])))
+
+    rows = [['Service', 'State']] + [[name, state] for name, state in sorted(report['services'].items())]
+    print_table(AsciiTable(rows, " Services "))
+
+    print('{0:<10} {1}'.format("Uptime:", _duration(report['uptime'])))
+    print('{0:<10} {1} ({2} CPUs)'.format("Load:", _load(report), report['cpus'] or '?'))
+    print('{0:<10} {1}'.format("Memory:", _memory(report)))
+    print('{0:<10} {1} on {2}'.format("Disk:", _disk(report), report['disk']['path']))
+
+
+def host_job(target, host):
+    """
+    ``(target, host, argv)`` probing ``host`` of the current target over a plain ssh process.
+    """
+    user, hostname, port = normalize(host)
+
+    with settings(host_string=host, user=user, host=hostname, port=port):
+        # A dashboard must not wait for a password prompt or an unreachable host
+        argv = ssh_argv(probe_command())
+
+    return target, host, argv[:1] + ['-o', 'BatchMode=yes', '-o', 'ConnectTimeout={0}'.format(CONNECT_TIMEOUT)] + argv[1:]
+
+
+def _run_job(job):
+    target, host, argv = job
+    start_ = time.time()
+
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+
+    report = parse(stdout.decode('utf-8', 'replace'))
+    error = '' if report else (stderr.decode('utf-8', 'replace').strip().splitlines() or ["exit code {0}".format(process.returncode)])[-1]
+
+    return {'target': target, 'host': host, 'report': report, 'error': error, 'elapsed': time.time() - start_}
+
+
+def run_jobs(jobs, concurrency=DEFAULT_CONCURRENCY):
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(max(1, min(concurrency, len(jobs))))
+
+    try:
+        return pool.map(_run_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_dashboard(results):
+    from terminaltables import AsciiTable
+
+    rows = [['Target', 'Host', 'Programs', 'Not running', 'Services', 'Uptime', 'Load', 'Memory', 'Disk', 'Probe [ms]']]
+    problems = 0
+
+    for result in results:
+        report = result['report']
+
+        if report is None:
+            problems += 1
+            rows.append([result['target'], result['host'], 'UNREACHABLE', result['error'], '-', '-', '-', '-', '-',
+                         '{0:.0f}'.format(result['elapsed'] * 1000)])
+            continue
+
+        down = _down(report) + (['supervisor'] if report['supervisor_error'] else [])
+        failed = _failed_services(report)
+        problems += bool(down or failed)
+
+        rows.append([result['target'],
+                     result['host'],
+                     '{0}/{1}'.format(len(report['programs']) - len(_down(report)), len(report['programs'])),
+                     ", ".join(down) or '-',
+                     "; ".join(failed) or 'OK',
+                     _duration(report['uptime']),
+                     _load(report),
+                     _memory(report),
+                     _disk(report),
+                     '{0:.0f}'.format(result['elapsed'] * 1000)])
+
+    table = AsciiTable(rows, " Dashboard {0} ".format(time.strftime("%H:%M:%S")))
+    table.justify_columns[2] = 'right'
+    table.justify_columns[9] = 'right'
+
+    print_table(table)
+
+    color = Fore.RED if problems else Fore.GREEN
+    print(color + "{0} of {1} host(s) with problems".format(problems, len(results)))
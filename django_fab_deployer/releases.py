@@ -0,0 +1,176 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.context_managers import cd, settings, hide
+from fabric.operations import run
+from fabric.utils import abort
+
+DEFAULT_KEEP_RELEASES = 5
+CURRENT_LINK = "current"
+RELEASES_DIR = "releases"
+RELEASES_LOG = "releases.log"
+SHARED_DIR = "shared"
+MIRROR_DIR = "repo"
+# Relative to the release, used instead of `venv_path` with `release_venv`
+RELEASE_VENV = ".venv"
+
+# Directories copied from the live release so installs in the new one only apply the difference
+WARM_COPY_DIRS = ['node_modules']
+
+
+def release_path(release):
+    return "{0}/{1}/{2}".format(env.deploy_root.rstrip("/"), RELEASES_DIR, release)
+
+
+def current_path():
+    return "{0}/{1}".format(env.deploy_root.rstrip("/"), CURRENT_LINK)
+
+
+def release_name(commit, live):
+    """
+    The release is named after its commit; a commit which is live already is rebuilt next to it as
+    ``<sha>-2``, ``<sha>-3``, ... so the live directory is never touched.
+    """
+    if live == commit:
+        return "{0}-2".format(commit)
+
+    if live and live.startswith(commit + "-"):
+        return "{0}-{1}".format(commit, int(live.rpartition("-")[2]) + 1)
+
+    return commit
+
+
+def release_commit(release):
+    return release.partition("-")[0]
+
+
+def resolve_release():
+    """
+    Update the git mirror on the host and return the name of the release to build, see `release_name`.
+    """
+    print(Fore.BLUE + "Fetching `{0}` into the release mirror".format(env.source_branch))
+
+    with cd(env.deploy_root):
+        # The first run moves `data/` of an in-place checkout to `shared/data` and leaves a symlink behind,
+        # so the running app keeps working until the first release is activated
+        run("mkdir -p {releases} {shared} && "
+            "([ -d {shared}/data ] || ([ -d data ] && mv data {shared}/data && ln -s {shared}/data data) || mkdir -p {shared}/data)".format(releases=RELEASES_DIR,
+                                                                                                                                         shared=SHARED_DIR))
+        run("[ -d {mirror} ] || git clone --quiet --mirror {url} {mirror}".format(mirror=MIRROR_DIR,
+                                                                                  url=env.repository or "$(git config --get remote.origin.url)"))
+        run("git --git-dir={mirror} fetch --quiet --prune".format(mirror=MIRROR_DIR))
+
+        with settings(hide('stdout')):
+            output = run("git --git-dir={mirror} rev-parse --verify {branch}^{{commit}} && "
+                         "(basename $(readlink {link}) 2> /dev/null || true)".format(mirror=MIRROR_DIR, branch=env.source_branch, link=CURRENT_LINK))
+
+        lines = output.split()
+        release = release_name(lines[0], lines[1] if len(lines) > 1 else None)
+
+    print(Fore.GREEN + Style.BRIGHT + "Release {0}".format(release))
+
+    return release
+
+
+def prepare_release(release):
+    path = release_path(release)
+
+    print(Fore.BLUE + "Preparing release directory")
+
+    with cd(env.deploy_root):
+        run("rm -rf {path} && git clone --quiet {mirror} {path}".format(path=path, mirror=MIRROR_DIR))
+
+        with cd(path):
+            run("git checkout --quiet --detach {0}".format(release_commit(release)))
+            run("git remote set-url origin $(git --git-dir=../../{mirror} config --get remote.origin.url)".format(mirror=MIRROR_DIR))
+            run("git submodule update --quiet --init --recursive")
+            run("rm -rf data && ln -s ../../{shared}/data data".format(shared=SHARED_DIR))
+
+        for directory in WARM_COPY_DIRS:
+            run("[ ! -d {current}/{directory} ] || cp -a {current}/{directory} {path}/".format(current=CURRENT_LINK, directory=directory, path=path))
+
+    print(Fore.GREEN + Style.BRIGHT + "Done.")
+
+
+def ensure_venv():
+    """
+    Create the virtualenv of the release being built unless it exists; returns True when it was created.
+    """
+    with settings(hide('everything'), warn_only=True):
+        exists = run("[ -d {0} ]".format(RELEASE_VENV)).succeeded
+
+    if exists:
+        return False
+
+    print(Fore.BLUE + "Creating the virtualenv of the release")
+    run("virtualenv {0}".format(RELEASE_VENV))
+
+    return True
+
+
+def activate(release):
+    print(Fore.BLUE + "Activating release {0}".format(release))
+
+    with cd(env.deploy_root):
+        # rename(2) over the old link is atomic, `ln -sfn` alone is not
+        run("ln -sfn {releases}/{release} {link}.tmp && mv -Tf {link}.tmp {link} && echo {release} >> {log}".format(releases=RELEASES_DIR,
+                                                                                                                  release=release,
+                                                                                                                  link=CURRENT_LINK,
+                                                                                                                  log=RELEASES_LOG))
+
+    print(Fore.GREEN + Style.BRIGHT + "Done.")
+
+
+def state():
+    """
+    Returns ``(live_release, history, existing_releases)``, history being the activation log, newest last.
+    """
+    with cd(env.deploy_root), settings(hide('everything'), warn_only=True):
+        output = run("basename $(readlink {link}) 2> /dev/null; echo; "
+                     "echo @@; cat {log} 2> /dev/null; "
+                     "echo @@; ls -1 {releases} 2> /dev/null; true".format(link=CURRENT_LINK, log=RELEASES_LOG, releases=RELEASES_DIR))
+
+    live, history, existing = output.split("@@")
+
+    return live.strip() or None, history.split(), existing.split()
+
+
+def previous_release():
+    live, history, existing = state()
+
+    for release in reversed(history):
+        if release != live and release in existing:
+            return release
+
+    return None
+
+
+def prune(keep=None):
+    keep = keep or env.keep_releases
+    live, history, existing = state()
+
+    kept = [live]
+
+    for release in reversed(history):
+        if len(kept) >= keep:
+            break
+
+        if release not in kept:
+            kept.append(release)
+
+    to_remove = [release for release in existing if release not in kept]
+
+    if to_remove:
+        print(Fore.BLUE + "Pruning {0} old release(s)".format(len(to_remove)))
+
+        with cd(env.deploy_root):
+            run("rm -rf {0}".format(" ".join("{0}/{1}".format(RELEASES_DIR, release) for release in to_remove)))
+
+
+def require_releases():
+    if not env.atomic_releases:
+        abort("Target `{0}` does not use atomic releases, set `atomic_releases` in deploy.json".format(env.target_name))
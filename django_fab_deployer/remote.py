@@ -0,0 +1,116 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import base64
+import json
+import os
+
+import six
+
+from fabric.api import env
+from fabric.network import normalize
+from fabric.operations import run
+
+from . import sshmux
+
+# Relative to `deploy_path`, kept out of git by living in `data/`
+REMOTE_STATE_DIR = "data/.djdeploy"
+
+# Interpreter for remote scripts which run outside of the virtualenv
+SYSTEM_PYTHON = "$(command -v python3 || command -v python)"
+
+# Scripts and their arguments travel base64 encoded, so no shell quoting can break them
+_BOOTSTRAP = 'import base64,sys;exec(compile(base64.b64decode(sys.argv.pop(1)),"djdeploy","exec"))'
+
+
+def _b64(data):
+    return base64.b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def python_command(source, payload=None, python='python'):
+    """
+    Command running Python ``source`` on the remote host; the script reads ``payload`` with `load_payload()`.
+    """
+    return "{python} -c '{bootstrap}' {source} {payload}".format(python=python,
+                                                                  bootstrap=_BOOTSTRAP,
+                                                                  source=_b64(source),
+                                                                  payload=_b64(json.dumps(payload or {})))
+
+
+# Prepended to remote scripts
+SCRIPT_HEADER = '''
+import base64, json, sys
+PAYLOAD = json.loads(base64.b64decode(sys.argv[1]).decode("utf-8"))
+'''
+
+
+def venv_run(command_to_run, **kwargs):
+    return run('source %s' % env.venv_path + ' && ' + command_to_run, **kwargs)
+
+
+def known_hosts_local_path():
+    return os.path.normpath(os.path.expanduser(os.path.join(env.ssh_config_path, "../known_hosts")))
+
+
+def rsync_ssh_opts():
+    # rsync_project adds the port and keys itself
+    opts = ["-o", "UserKnownHostsFile={0}".format(known_hosts_local_path())]
+    opts += sshmux.control_options(_ssh_options_argv(), ssh_destination(), _port())
+
+    return " ".join(opts)
+
+
+def remote_abspath(path):
+    # rsync resolves remote paths against the login directory, not against `cd()`
+    return "{0}/{1}".format(env.deploy_path.rstrip("/"), path)
+
+
+def _ssh_options_argv():
+    argv = ['ssh', '-o', 'UserKnownHostsFile={0}'.format(known_hosts_local_path()), '-p', "{0}".format(_port())]
+
+    key_filenames = env.key_filename or []
+
+    if isinstance(key_filenames, six.string_types):
+        key_filenames = [key_filenames]
+
+    for key_filename in key_filenames:
+        argv += ['-i', key_filename]
+
+    return argv
+
+
+def ssh_base_argv():
+    """
+    OpenSSH command line (without the destination) for the current host, used where Fabric's own connection
+    cannot stream (rsync, pipes). Shares the host's master connection when multiplexing is enabled.
+    """
+    argv = _ssh_options_argv()
+
+    return argv + sshmux.control_options(argv, ssh_destination(), _port())
+
+
+def _connection():
+    # The host Fabric (and `rsync_project`) connects to, which `settings(host_string=...)` may point elsewhere
+    # than `env.host`
+    return normalize(env.host_string or env.host)
+
+
+def _port():
+    return _connection()[2] or 22
+
+
+def ssh_destination():
+    user, host, port = _connection()
+
+    return "{0}@{1}".format(user, host)
+
+
+def ssh_argv(remote_command=None):
+    argv = ssh_base_argv() + [ssh_destination()]
+
+    if remote_command:
+        argv.append(remote_command)
+
+    return argv
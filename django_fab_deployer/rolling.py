@@ -0,0 +1,168 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import time
+from functools import wraps
+
+import six
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.network import normalize
+from fabric.utils import abort
+
+from . import healthcheck
+from .exceptions import InvalidConfiguration
+from .multihost import run_on
+from .utils import print_table
+
+DEFAULT_MAX_UNAVAILABLE = 1
+DEFAULT_HEALTH_TIMEOUT = 120
+HEALTH_POLL_INTERVAL = 2.0
+
+
+def batch_size(hosts, max_unavailable=DEFAULT_MAX_UNAVAILABLE):
+    """
+    `rolling_max_unavailable` is a number of hosts or a percentage such as ``"25%"``; at least one host per batch.
+    """
+    if isinstance(max_unavailable, six.string_types) and max_unavailable.endswith("%"):
+        try:
+            size = len(hosts) * float(max_unavailable[:-1]) / 100
+        except ValueError:
+            raise InvalidConfiguration("`rolling_max_unavailable` must be a number or a percentage, not `{0}`".format(max_unavailable))
+    else:
+        size = int(max_unavailable)
+
+    return max(1, min(int(size), len(hosts)))
+
+
+def batches(hosts, size):
+    return [hosts[position:position + size] for position in range(0, len(hosts), size)]
+
+
+def health_urls(batch):
+    """
+    `health_url` may contain ``{host}`` to probe every restarted host directly, otherwise `urls_to_check` gate the batch.
+    """
+    if env.health_url:
+        return [env.health_url.format(host=normalize(host)[1]) for host in batch]
+
+    return env.urls_to_check
+
+
+def wait_until_healthy(urls, timeout):
+    start_ = time.time()
+
+    while True:
+        results = healthcheck.check_urls(urls,
+                                         concurrency=env.urls_to_check_concurrency,
+                                         timeout=env.urls_to_check_timeout,
+                                         retries=env.urls_to_check_retries,
+                                         backoff=env.urls_to_check_backoff,
+                                         verify=env.urls_to_check_verify_ssl_certificate)
+
+        if all(result['ok'] for result in results) or time.time() - start_ >= timeout:
+            return results, time.time() - start_
+
+        time.sleep(HEALTH_POLL_INTERVAL)
+
+
+def roll(func, *args, **kwargs):
+    """
+    Run ``func`` on the hosts batch by batch; the next batch starts only when the previous one passed its health check.
+    """
+    hosts = list(env.hosts)
+    size = batch_size(hosts, env.rolling_max_unavailable)
+    reports = []
+    failure = None
+
+    print(Fore.BLUE + "Rolling `{0}` over {1} host(s), {2} at a time".format(func.__name__, len(hosts), size))
+
+    for number, batch in enumerate(batches(hosts, size), 1):
+        print(Fore.BLUE + "Batch {0}: {1}".format(number, ", ".join(batch)))
+
+        start_ = time.time()
+        results = run_on(batch, func, *args, **kwargs)
+        report = {'hosts': batch, 'run': time.time() - start_, 'healthy': None, 'error': ''}
+        reports.append(report)
+
+        failed = [host for host in batch if not (results.get(host) or {}).get('ok')]
+
+        if failed:
+            report['error'] = "; ".join("{0}: {1}".format(host, (results.get(host) or {}).get('error', 'No result')) for host in failed)
+            failure = "`{0}` failed on {1}".format(func.__name__, ", ".join(failed))
+            break
+
+        urls = health_urls(batch)
+
+        if not urls:
+            continue
+
+        health_results, report['healthy'] = wait_until_healthy(urls, env.health_timeout)
+
+        if not all(result['ok'] for result in health_results):
+            healthcheck.print_results(health_results, " Batch {0} health check ".format(number))
+            report['error'] = "not healthy after {0:.0f} s".format(report['healthy'])
+            failure = "Batch {0} did not become healthy".format(number)
+            break
+
+    print_batches(func.__name__, reports, len(hosts))
+
+    if failure:
+        remaining = hosts[sum(len(report['hosts']) for report in reports):]
+        abort("{0}, roll halted{1}".format(failure, "; not touched: " + ", ".join(remaining) if remaining else ""))
+
+    return reports
+
+
+def print_batches(task_name, reports, total_hosts):
+    from terminaltables import AsciiTable
+
+    rows = [['Batch', 'Hosts', 'Run [s]', 'Healthy after [s]', 'Result']]
+
+    for number, report in enumerate(reports, 1):
+        rows.append(['{0}'.format(number),
+                     ", ".join(report['hosts']),
+                     '{0:.1f}'.format(report['run']),
+                     '{0:.1f}'.format(report['healthy']) if report['healthy'] is not None else '-',
+                     report['error'] or 'OK'])
+
+    table = AsciiTable(rows, " Rolling {0} ".format(task_name))
+    table.justify_columns[2] = 'right'
+    table.justify_columns[3] = 'right'
+
+    print_table(table)
+
+    done = sum(len(report['hosts']) for report in reports if not report['error'])
+    color = Fore.GREEN if done == total_hosts else Fore.RED
+
+    print(color + Style.BRIGHT + "{0} of {1} host(s) done".format(done, total_hosts))
+
+
+def enabled():
+    return bool(env.get('rolling_restart')) and len(env.hosts) > 1
+
+
+def is_rolling():
+    # Inside a fan-out or a roll every host already runs on its own
+    return enabled() and not env.get('fan_out_active')
+
+
+def rolling(func):
+    """
+    With `rolling_restart` the first host's call rolls ``func`` over all hosts in batches, the remaining calls are no-ops.
+    Without it ``func`` is called as usual.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not is_rolling():
+            return func(*args, **kwargs)
+
+        if env.host_string != env.hosts[0]:
+            return None
+
+        return roll(func, *args, **kwargs)
+
+    return wrapper
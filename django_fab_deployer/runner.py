@@ -3,11 +3,13 @@
 
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
+import importlib
 import json
 import os
 import sys
+from functools import partial
 
-from fabric.main import main as fabric_main
+from fabric import main as fabric_main
 
 
 def write_example_config():
@@ -38,6 +40,11 @@ def write_example_config():
         the_file.write(json.dumps(deployment_options, sort_keys=True, indent=2))
 
 
+def _import_fabfile(name):
+    # Fabric imports the fabfile as a top-level module, which breaks its relative imports
+    return importlib.import_module('django_fab_deployer.fabfile')
+
+
 def main():
     if "write_example_config" in sys.argv:
         write_example_config()
@@ -45,8 +52,10 @@ def main():
 
     this_dir = os.path.dirname(os.path.realpath(__file__))
 
+    fabric_main.load_fabfile = partial(fabric_main.load_fabfile, importer=_import_fabfile)
+
     sys.argv = ['fab', '-f', os.path.join(this_dir, "fabfile.py")] + sys.argv[1:]
-    fabric_main()
+    fabric_main.main()
 
 
 if __name__ == '__main__':
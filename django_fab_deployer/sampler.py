@@ -0,0 +1,254 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import json
+import os
+import time
+
+from colorama import Fore
+from fabric.api import env, run
+from fabric.context_managers import cd, settings, hide
+
+from . import tracing
+from .multihost import run_on
+from .remote import REMOTE_STATE_DIR, SCRIPT_HEADER, SYSTEM_PYTHON, python_command
+from .utils import print_table
+
+DEFAULT_INTERVAL = 1.0
+# A sampler whose deploy died without stopping it gives up on its own
+MAX_SECONDS = 4 * 3600
+PROCESSES = ['gunicorn', 'celery']
+NO_STAGE = "(between stages)"
+MB = 1024.0 * 1024.0
+
+# Writes one JSON line per interval until the stop file appears. CPU and disk figures are deltas of /proc
+# counters between two samples; RSS is summed over all processes whose command line names the process group.
+SAMPLER_SCRIPT = SCRIPT_HEADER + r'''
+import os, time
+
+def read(path):
+    try:
+        with open(path) as opened_file:
+            return opened_file.read()
+    except IOError:
+        return ""
+
+def cpu_times():
+    fields = [int(value) for value in read("/proc/stat").split("\n")[0].split()[1:9]]
+    return sum(fields), fields[3] + fields[4], fields[4]
+
+def disk_bytes():
+    devices = set(name for name in os.listdir("/sys/block") if not name.startswith(("loop", "ram"))) if os.path.isdir("/sys/block") else set()
+    read_, written = 0, 0
+    for line in read("/proc/diskstats").splitlines():
+        parts = line.split()
+        if len(parts) > 9 and parts[2] in devices:
+            read_ += int(parts[5])
+            written += int(parts[9])
+    return read_ * 512, written * 512
+
+def mem_available():
+    values = dict((line.split(":")[0], int(line.split()[1]) * 1024) for line in read("/proc/meminfo").splitlines() if len(line.split()) > 1)
+    return values.get("MemAvailable", values.get("MemFree", 0) + values.get("Cached", 0))
+
+def rss():
+    page = os.sysconf("SC_PAGE_SIZE")
+    totals = dict((name, 0) for name in PAYLOAD["processes"])
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        cmdline = read("/proc/%s/cmdline" % pid).replace("\0", " ")
+        for name in PAYLOAD["processes"]:
+            if name in cmdline:
+                statm = read("/proc/%s/statm" % pid).split()
+                totals[name] += int(statm[1]) * page if len(statm) > 1 else 0
+                break
+    return totals
+
+previous_cpu, previous_disk, previous_time = cpu_times(), disk_bytes(), time.time()
+deadline = previous_time + PAYLOAD["max_seconds"]
+
+while not os.path.exists(PAYLOAD["stop"]) and time.time() < deadline:
+    time.sleep(PAYLOAD["interval"])
+    now, cpu, disk = time.time(), cpu_times(), disk_bytes()
+    total = float(cpu[0] - previous_cpu[0]) or 1.0
+    elapsed = now - previous_time
+    sys.stdout.write(json.dumps({
+        "t": now,
+        "cpu": 100 * (total - (cpu[1] - previous_cpu[1])) / total,
+        "iowait": 100 * (cpu[2] - previous_cpu[2]) / total,
+        "load": os.getloadavg()[0],
+        "mem_available": mem_available(),
+        "read": (disk[0] - previous_disk[0]) / elapsed,
+        "write": (disk[1] - previous_disk[1]) / elapsed,
+        "rss": rss(),
+    }) + "\n")
+    sys.stdout.flush()
+    previous_cpu, previous_disk, previous_time = cpu, disk, now
+
+try:
+    os.remove(PAYLOAD["stop"])
+except OSError:
+    pass
+'''
+
+
+def enabled():
+    return bool(env.get('resource_sampling'))
+
+
+def new_sample_id():
+    return "{0}-{1}".format(int(time.time()), os.getpid())
+
+
+def _paths(sample_id):
+    prefix = "{0}/samples-{1}".format(REMOTE_STATE_DIR, sample_id)
+
+    return prefix + ".jsonl", prefix + ".stop"
+
+
+def start(sample_id):
+    """
+    Start the sampler in the background on the current host. Returns the offset of the host's clock
+    against the local one, which maps remote sample times onto the local stage spans.
+    """
+    output_path, stop_path = _paths(sample_id)
+    payload = {'interval': env.resource_sampling_interval, 'stop': stop_path, 'max_seconds': MAX_SECONDS, 'processes': PROCESSES}
+    local_start = time.time()
+
+    with cd(env.deploy_root), settings(hide('running', 'stdout')):
+        output = run("mkdir -p {state_dir} && (nohup {sampler} > {output} 2> /dev/null < /dev/null &) && "
+                     "{python} -c 'import time; print(time.time())'".format(state_dir=REMOTE_STATE_DIR,
+                                                                             sampler=python_command(SAMPLER_SCRIPT, payload, python=SYSTEM_PYTHON),
+                                                                             output=output_path,
+                                                                             python=SYSTEM_PYTHON), pty=False)
+
+    return float(output.strip().splitlines()[-1]) - (local_start + time.time()) / 2
+
+
+def stop(sample_id):
+    """
+    Stop the sampler of the current host and return its samples.
+    """
+    output_path, stop_path = _paths(sample_id)
+
+    with cd(env.deploy_root), settings(hide('running', 'stdout'), warn_only=True):
+        output = run("touch {stop} && cat {output} && rm -f {output}".format(stop=stop_path, output=output_path), pty=False)
+
+    samples = []
+
+    for line in output.splitlines():
+        try:
+            samples.append(json.loads(line))
+        except ValueError:
+            # The sampler may be halfway through its last line
+            continue
+
+    return samples
+
+
+def stage_windows(records, host):
+    return [(one_record['name'], one_record['start'], one_record['end'])
+            for one_record in records if one_record['cat'] == 'stage' and one_record['host'] == host]
+
+
+def attribute(samples, windows, offset):
+    """
+    Group samples by the stages running when they were taken; with parallel stages a sample counts for each of them.
+    """
+    by_stage = {}
+
+    for sample in samples:
+        sample['local_time'] = sample['t'] - offset
+        stages = [name for name, start_, end in windows if start_ <= sample['local_time'] <= end] or [NO_STAGE]
+
+        for name in stages:
+            by_stage.setdefault(name, []).append(sample)
+
+    return by_stage
+
+
+def record_samples(host, samples, offset):
+    for sample in samples:
+        tracing.record_counter("CPU [%]", host, sample['t'] - offset, cpu=sample['cpu'], iowait=sample['iowait'])
+        tracing.record_counter("Free memory [MB]", host, sample['t'] - offset, available=sample['mem_available'] / MB)
+        tracing.record_counter("RSS [MB]", host, sample['t'] - offset, **dict((name, value / MB) for name, value in sample['rss'].items()))
+        tracing.record_counter("Disk I/O [MB/s]", host, sample['t'] - offset, read=sample['read'] / MB, write=sample['write'] / MB)
+
+
+def _summary_row(name, samples):
+    def peak(key):
+        return max(sample[key] for sample in samples)
+
+    return [name,
+            '{0}'.format(len(samples)),
+            '{0:.0f}'.format(sum(sample['cpu'] for sample in samples) / len(samples)),
+            '{0:.0f}'.format(peak('cpu')),
+            '{0:.0f}'.format(peak('iowait')),
+            '{0:.2f}'.format(peak('load')),
+            '{0:.0f}'.format(min(sample['mem_available'] for sample in samples) / MB)] + \
+           ['{0:.0f}'.format(max(sample['rss'].get(process, 0) for sample in samples) / MB) for process in PROCESSES] + \
+           ['{0:.1f}'.format(peak('read') / MB),
+            '{0:.1f}'.format(peak('write') / MB)]
+
+
+def print_report(host, samples, by_stage):
+    from terminaltables import AsciiTable
+
+    rows = [['Stage', 'Samples', 'CPU avg [%]', 'CPU peak [%]', 'I/O wait peak [%]', 'Load peak', 'Free mem min [MB]'] +
+            ['{0} RSS peak [MB]'.format(process) for process in PROCESSES] +
+            ['Read peak [MB/s]', 'Write peak [MB/s]']]
+
+    # Stages in the order they started, the heaviest CPU peak is highlighted
+    ordered = sorted(by_stage.items(), key=lambda item: item[1][0]['local_time'])
+    heaviest = max(ordered, key=lambda item: max(sample['cpu'] for sample in item[1]))[0]
+
+    for name, stage_samples in ordered:
+        rows.append(_summary_row(name, stage_samples))
+
+    rows.append(_summary_row("whole deploy", samples))
+
+    table = AsciiTable(rows, " Resources on {0} ".format(host))
+    table.inner_footing_row_border = True
+
+    for column in range(1, len(rows[0])):
+        table.justify_columns[column] = 'right'
+
+    print_table(table)
+    print(Fore.YELLOW + "Highest CPU peak during `{0}`".format(heaviest))
+
+
+def report(host, samples, offset, trace_path=None):
+    if not samples:
+        print(Fore.YELLOW + "No resource samples from {0}".format(host))
+        return
+
+    records = tracing.load(trace_path) if trace_path else []
+    by_stage = attribute(samples, stage_windows(records, host), offset)
+
+    with settings(trace_path=trace_path):
+        record_samples(host, samples, offset)
+
+    print_report(host, samples, by_stage)
+
+
+def start_all():
+    """
+    Start a sampler on every host of the target; returns ``(sample_id, {host: clock offset})``.
+    """
+    sample_id = new_sample_id()
+    results = run_on(env.hosts, start, sample_id)
+
+    print(Fore.BLUE + "Sampling host resources every {0} s".format(env.resource_sampling_interval))
+
+    return sample_id, dict((host, result['value']) for host, result in results.items() if result['ok'])
+
+
+def stop_all(sample_id, offsets, trace_path=None):
+    results = run_on(list(offsets), stop, sample_id)
+
+    for host in env.hosts:
+        if host in offsets and results.get(host, {}).get('ok'):
+            report(host, results[host]['value'], offsets[host], trace_path)
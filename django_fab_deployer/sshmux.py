@@ -0,0 +1,121 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import atexit
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from colorama import Fore
+
+from .utils import local_lock
+
+# Idle masters exit on their own when the run is killed before the teardown
+CONTROL_PERSIST = 600
+
+_state = {'dir': None, 'owner': None}
+
+
+def enable():
+    """
+    Share one OpenSSH master connection per host between all ssh and rsync processes of this run.
+    Fabric's own commands go through paramiko, which cannot use OpenSSH control sockets.
+    """
+    if _state['dir']:
+        return
+
+    if os.name == 'nt':
+        print(Fore.YELLOW + "SSH connection sharing needs Unix sockets, it is disabled on Windows")
+        return
+
+    # Sockets live in a short temporary path, Unix socket paths are limited to ~100 characters
+    _state['dir'] = tempfile.mkdtemp(prefix="djdeploy-ssh-")
+    _state['owner'] = os.getpid()
+
+    atexit.register(teardown)
+
+
+def enabled():
+    return bool(_state['dir'])
+
+
+def _control_path(destination, port):
+    key = hashlib.sha1("{0}:{1}".format(destination, port).encode('utf-8')).hexdigest()[:12]
+
+    return os.path.join(_state['dir'], key)
+
+
+def _start_master(base_argv, destination, path):
+    start_ = time.time()
+
+    # The backgrounded master keeps stdout open, so it must not be a pipe we would wait on
+    with open(os.devnull, 'w') as devnull:
+        return_code = subprocess.call(base_argv + ['-o', 'ControlMaster=yes',
+                                                   '-o', 'ControlPath={0}'.format(path),
+                                                   '-o', 'ControlPersist={0}'.format(CONTROL_PERSIST),
+                                                   destination, 'true'], stdout=devnull)
+
+    elapsed = time.time() - start_
+
+    if return_code != 0:
+        print(Fore.YELLOW + "Cannot open a shared SSH connection to {0}, using separate connections".format(destination))
+        return
+
+    with io.open(path + ".setup", "w", encoding='utf-8') as setup_file:
+        setup_file.write("{0} {1:.3f}".format(destination, elapsed))
+
+    print(Fore.BLUE + "Shared SSH connection to {0} opened in {1:.2f} s".format(destination, elapsed))
+
+
+def control_options(base_argv, destination, port):
+    """
+    Options making an ssh command line reuse the master connection to ``destination``, started on first use.
+    """
+    if not enabled():
+        return []
+
+    path = _control_path(destination, port)
+
+    with local_lock(path + ".lock"):
+        if not os.path.exists(path):
+            _start_master(base_argv, destination, path)
+
+    # One byte per session, appended from whichever process opened it
+    with io.open(path + ".uses", "ab") as uses_file:
+        uses_file.write(b".")
+
+    # Without a live master ssh falls back to a direct connection
+    return ['-o', 'ControlPath={0}'.format(path), '-o', 'ControlMaster=no']
+
+
+def teardown():
+    directory = _state['dir']
+
+    if not directory or os.getpid() != _state['owner']:
+        return
+
+    _state['dir'] = None
+
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".setup"):
+            continue
+
+        path = os.path.join(directory, name[:-len(".setup")])
+
+        with io.open(path + ".setup", encoding='utf-8') as setup_file:
+            destination, elapsed = setup_file.read().split()
+
+        uses = os.path.getsize(path + ".uses") if os.path.exists(path + ".uses") else 0
+
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(['ssh', '-o', 'ControlPath={0}'.format(path), '-O', 'exit', destination], stdout=devnull, stderr=devnull)
+
+        print(Fore.BLUE + "Closed shared SSH connection to {0} (opened in {1} s, used by {2} session(s))".format(destination, elapsed, uses))
+
+    shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,233 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import os
+import sys
+import time
+
+import six
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.utils import abort
+
+from . import tracing
+from .exceptions import InvalidConfiguration
+from .utils import print_table
+
+
+class Stage(object):
+    def __init__(self, name, func, requires=(), enabled=True, required_by=()):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.required_by = list(required_by)
+        self.enabled = enabled
+
+    def __repr__(self):
+        return "<Stage {0}>".format(self.name)
+
+
+def resolve(stages, disabled=()):
+    """
+    Drop disabled stages and return the remaining ones in dependency order.
+
+    Dependents of a disabled stage inherit its requirements, so the ordering
+    between the remaining stages is preserved.
+    """
+    by_name = {}
+
+    for stage in stages:
+        if stage.name in by_name:
+            raise InvalidConfiguration("Deploy stage `{0}` is defined twice".format(stage.name))
+
+        by_name[stage.name] = stage
+
+    for stage in stages:
+        for name in stage.required_by:
+            if name not in by_name:
+                raise InvalidConfiguration("Stage `{0}` is required by unknown stage `{1}`".format(stage.name, name))
+
+            by_name[name].requires.append(stage.name)
+
+    for stage in stages:
+        for name in stage.requires:
+            if name not in by_name:
+                raise InvalidConfiguration("Stage `{0}` requires unknown stage `{1}`".format(stage.name, name))
+
+    for name in disabled:
+        if name not in by_name:
+            raise InvalidConfiguration("Cannot disable unknown stage `{0}`".format(name))
+
+    skipped = set(name for name, stage in by_name.items() if not stage.enabled or name in disabled)
+
+    def effective_requires(stage, seen=()):
+        result = set()
+
+        for name in stage.requires:
+            if name in seen:
+                raise InvalidConfiguration("Deploy stages contain a cycle: {0}".format(" -> ".join(seen + (name,))))
+
+            if name in skipped:
+                result |= effective_requires(by_name[name], seen + (name,))
+            else:
+                result.add(name)
+
+        return result
+
+    pending = [stage for stage in stages if stage.name not in skipped]
+    requires = dict((stage.name, effective_requires(stage, (stage.name,))) for stage in pending)
+
+    ordered = []
+    done = set()
+
+    while pending:
+        ready = [stage for stage in pending if requires[stage.name] <= done]
+
+        if not ready:
+            raise InvalidConfiguration("Deploy stages contain a cycle between: {0}".format(", ".join(stage.name for stage in pending)))
+
+        for stage in ready:
+            stage.requires = sorted(requires[stage.name])
+            ordered.append(stage)
+            done.add(stage.name)
+            pending.remove(stage)
+
+    return ordered, sorted(skipped)
+
+
+def _run_stage(stage):
+    start_ = time.time()
+
+    try:
+        note = stage.func()
+    except (Exception, SystemExit) as e:
+        message = getattr(e, 'message', None) or "{0}".format(e)
+        end = time.time()
+        tracing.record(stage.name, 'stage', start_, end, ok=False)
+        return {'name': stage.name, 'ok': False, 'start': start_, 'end': end, 'error': message or e.__class__.__name__}
+
+    end = time.time()
+    tracing.record(stage.name, 'stage', start_, end, ok=True)
+
+    # A stage may return a short note for the summary, e.g. why it did nothing
+    note = note if isinstance(note, six.string_types) else ''
+
+    return {'name': stage.name, 'ok': True, 'start': start_, 'end': end, 'error': '', 'note': note}
+
+
+def _stage_process(stage, queue):
+    from fabric.state import connections
+
+    # Each process opens its own SSH connection, exactly like Fabric's parallel mode
+    connections.clear()
+    env.linewise = True
+
+    result = _run_stage(stage)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    queue.put(result)
+
+
+def _next_result(queue, running):
+    from six.moves.queue import Empty
+
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            for name, process in running.items():
+                if not process.is_alive() and process.exitcode:
+                    return {'name': name, 'ok': False, 'start': time.time(), 'end': time.time(), 'error': "Exit code {0}".format(process.exitcode)}
+
+
+def _can_fork():
+    return hasattr(os, 'fork')
+
+
+def run_stages(stages, disabled=(), parallel=True):
+    """
+    Run ``stages`` honouring their dependencies. With ``parallel`` every stage whose requirements are done
+    starts in its own process; a stage is run in the current process when nothing else could run next to it.
+    """
+    import multiprocessing
+
+    ordered, skipped = resolve(stages, disabled)
+
+    for name in skipped:
+        print(Fore.YELLOW + "Stage `{0}` skipped!".format(name))
+
+    parallel = parallel and _can_fork()
+    start_ = time.time()
+    results = {}
+    running = {}
+    queue = multiprocessing.Queue() if parallel else None
+    pending = list(ordered)
+    failed = False
+
+    while pending or running:
+        done = set(name for name, result in results.items() if result['ok'])
+        ready = [stage for stage in pending if set(stage.requires) <= done] if not failed else []
+
+        if not parallel or (len(ready) == 1 and not running):
+            if not ready:
+                break
+
+            stage = ready[0]
+            pending.remove(stage)
+            results[stage.name] = _run_stage(stage)
+            failed = failed or not results[stage.name]['ok']
+            continue
+
+        for stage in ready:
+            pending.remove(stage)
+            process = multiprocessing.Process(target=_stage_process, args=(stage, queue))
+            process.start()
+            running[stage.name] = process
+
+        if not running:
+            break
+
+        result = _next_result(queue, running)
+        running.pop(result['name']).join()
+        results[result['name']] = result
+        failed = failed or not result['ok']
+
+    print_stage_summary(ordered, results, start_)
+
+    if failed:
+        abort("Deploy stage(s) failed: {0}".format(", ".join(name for name, result in sorted(results.items()) if not result['ok'])))
+
+    return results
+
+
+def print_stage_summary(ordered, results, start_):
+    from terminaltables import AsciiTable
+
+    rows = [['Stage', 'Requires', 'Start [s]', 'Time [s]', 'Result']]
+
+    for stage in ordered:
+        result = results.get(stage.name)
+
+        if result is None:
+            rows.append([stage.name, ", ".join(stage.requires), '-', '-', 'NOT RUN'])
+            continue
+
+        rows.append([
+            stage.name,
+            ", ".join(stage.requires),
+            '{0:.1f}'.format(result['start'] - start_),
+            '{0:.1f}'.format(result['end'] - result['start']),
+            ('OK ({0})'.format(result['note']) if result.get('note') else 'OK') if result['ok'] else result['error'],
+        ])
+
+    table = AsciiTable(rows, " Deploy stages ")
+    table.justify_columns[2] = 'right'
+    table.justify_columns[3] = 'right'
+
+    print_table(table)
+
+    serial_time = sum(result['end'] - result['start'] for result in results.values())
+    print(Fore.BLUE + Style.BRIGHT + "Stages took {0:.1f} s ({1:.1f} s if run one by one)".format(time.time() - start_, serial_time))
@@ -0,0 +1,132 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+from time import gmtime, strftime
+
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.context_managers import settings, hide
+from fabric.operations import run
+
+from . import fingerprints
+from .management import DJANGO_SETUP
+from .remote import SCRIPT_HEADER, python_command, venv_run
+
+# Relative to `deploy_path`; `data/static` becomes a link to the live build
+STATIC_ROOT = "data/static"
+BUILDS_DIR = "data/static-builds"
+KEEP_BUILDS = 3
+
+# Runs one management command with `STATIC_ROOT` (and a `COMPRESS_ROOT` following it) pointing to the new build
+MANAGE_SCRIPT = SCRIPT_HEADER + DJANGO_SETUP + r'''
+import shlex
+
+from django.conf import settings
+from django.core.management import call_command
+
+configured = os.path.realpath(settings.STATIC_ROOT or "")
+
+if configured != os.path.realpath(os.path.join(HOME, PAYLOAD["static_root"])):
+    sys.exit("STATIC_ROOT is %s, not %s; set `static_builds` to false in deploy.json" % (settings.STATIC_ROOT, PAYLOAD["static_root"]))
+
+try:
+    # Puts the `COMPRESS_*` defaults on the settings
+    import compressor.conf  # noqa
+except ImportError:
+    pass
+
+settings.STATIC_ROOT = os.path.join(HOME, PAYLOAD["build"])
+
+if os.path.realpath(getattr(settings, "COMPRESS_ROOT", "") or "") == configured:
+    settings.COMPRESS_ROOT = settings.STATIC_ROOT
+
+argv = shlex.split(PAYLOAD["command"])
+call_command(argv[0], *argv[1:])
+'''
+
+
+def enabled():
+    return env.get('static_builds', False)
+
+
+def new_build_name():
+    return strftime("%Y%m%d-%H%M%S", gmtime())
+
+
+def build_path():
+    return "{0}/{1}".format(BUILDS_DIR, env.static_build)
+
+
+def unchanged(force=False):
+    """
+    A note for the deploy summary when the inputs of the static files are those of the live build.
+    """
+    if force or not enabled():
+        return None
+
+    fingerprint, stored, missing = fingerprints.remote_state('static')
+
+    if not missing and stored and stored.get('fingerprint') == fingerprint:
+        return "static files unchanged since {0}".format(stored['date'])
+
+    return None
+
+
+def prepare(seed=True):
+    """
+    Create the directory of the new build; ``seed`` hard-links the live files into it so that `collectstatic`
+    only copies what changed. Storages never write into an existing file, so the live build stays untouched.
+    """
+    print(Fore.BLUE + "Preparing static build {0}".format(env.static_build))
+
+    if seed:
+        run("rm -rf {build} && mkdir -p {builds} && "
+            "if [ -d {root} ]; then cp -al {root}/. {build}/; else mkdir {build}; fi".format(build=build_path(), builds=BUILDS_DIR, root=STATIC_ROOT))
+    else:
+        run("rm -rf {build} && mkdir -p {build}".format(build=build_path()))
+
+
+def manage(command):
+    payload = {'settings': env.get('django_settings_module'), 'static_root': STATIC_ROOT, 'build': build_path(), 'command': command}
+
+    with settings(hide('running')):
+        venv_run(python_command(MANAGE_SCRIPT, payload))
+
+
+def activate():
+    """
+    Make the build of this deploy live by replacing the `data/static` link, then record its fingerprint.
+    Returns False when nothing was built.
+    """
+    if not env.get('static_build'):
+        return False
+
+    with settings(hide('running', 'stdout'), warn_only=True):
+        built = run("[ -d {0} ]".format(build_path())).succeeded
+
+    if not built:
+        return False
+
+    print(Fore.BLUE + "Activating static build {0}".format(env.static_build))
+
+    link = "static-builds/{0}".format(env.static_build)
+
+    with settings(hide('running')):
+        # The first swap moves the static directory of before into the builds, later ones only rename a link
+        run("ln -sfn {link} {root}.tmp && "
+            "if [ -d {root} ] && [ ! -L {root} ]; then mv {root} {builds}/{previous}; fi && "
+            "mv -Tf {root}.tmp {root}".format(link=link, root=STATIC_ROOT, builds=BUILDS_DIR, previous=new_build_name() + "-previous"))
+
+        # Names sort by time, the live build is never removed
+        run("cd {builds} && for build in $(ls -1 | grep -vx {live} | sort | head -n -{keep}); do rm -rf \"$build\"; done".format(builds=BUILDS_DIR,
+                                                                                                                               live=env.static_build,
+                                                                                                                               keep=KEEP_BUILDS - 1))
+
+    fingerprint, stored, missing = fingerprints.remote_state('static')
+    fingerprints.store('static', fingerprint, None)
+
+    print(Fore.GREEN + Style.BRIGHT + "Done.")
+
+    return True
@@ -0,0 +1,116 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import hashlib
+import os
+import subprocess
+import sys
+import time
+
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.utils import abort
+from six.moves import shlex_quote
+
+from .remote import ssh_argv
+
+CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 1.0
+
+COMPRESSORS = {
+    'zstd': {'extension': 'zst', 'command': "zstd -q -c -{level} -T{threads}", 'default_level': 3},
+    # pigz compresses on all cores when installed, the output is plain gzip either way
+    'gzip': {'extension': 'gz', 'command': "$(command -v pigz > /dev/null && echo pigz -p {threads_or_cores} || echo gzip) -c -{level}", 'default_level': 6},
+    'none': {'extension': None, 'command': None, 'default_level': None},
+}
+
+
+def compressor_command(name, level=None, threads=0):
+    try:
+        compressor = COMPRESSORS[name]
+    except KeyError:
+        abort("Unknown compression `{0}`, use one of: {1}".format(name, ", ".join(sorted(COMPRESSORS))))
+
+    if not compressor['command']:
+        return None, None
+
+    command = compressor['command'].format(level=level or compressor['default_level'],
+                                           threads=threads,
+                                           threads_or_cores=threads or "$(nproc)")
+
+    return command, compressor['extension']
+
+
+def format_size(size):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024 or unit == 'GiB':
+            return "{0:.1f} {1}".format(size, unit)
+
+        size /= 1024.0
+
+
+def stream_to_file(remote_command, local_path):
+    """
+    Run ``remote_command`` over SSH and write its stdout into ``local_path`` without touching the server's disk.
+    Returns a dict with the number of bytes, elapsed time and SHA-256 of the file.
+    """
+    directory = os.path.dirname(local_path)
+
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # `pipefail` makes a failing dump fail the whole pipeline, not just the compressor
+    command = "bash -c {0}".format(shlex_quote("set -o pipefail; " + remote_command))
+    partial_path = local_path + ".part"
+    checksum = hashlib.sha256()
+    size = 0
+    start_ = last_progress = time.time()
+
+    process = subprocess.Popen(ssh_argv(command), stdout=subprocess.PIPE)
+
+    try:
+        with open(partial_path, "wb") as output:
+            while True:
+                chunk = process.stdout.read(CHUNK_SIZE)
+
+                if not chunk:
+                    break
+
+                output.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+
+                if time.time() - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = time.time()
+                    sys.stdout.write("\r{0:>12} received, {1}/s   ".format(format_size(size), format_size(size / (last_progress - start_))))
+                    sys.stdout.flush()
+    finally:
+        process.stdout.close()
+        return_code = process.wait()
+
+    sys.stdout.write("\n")
+
+    if return_code != 0:
+        os.remove(partial_path)
+        abort("Remote command failed with exit code {0}: {1}".format(return_code, remote_command))
+
+    os.rename(partial_path, local_path)
+
+    elapsed = max(time.time() - start_, 0.001)
+
+    return {'path': local_path, 'bytes': size, 'elapsed': elapsed, 'throughput': size / elapsed, 'sha256': checksum.hexdigest()}
+
+
+def write_checksum_file(result):
+    with open(result['path'] + ".sha256", "w") as checksum_file:
+        checksum_file.write("{0}  {1}\n".format(result['sha256'], os.path.basename(result['path'])))
+
+
+def print_result(result):
+    print(Fore.GREEN + Style.BRIGHT + "Saved `{0}`".format(result['path']))
+    print('{0:<12} {1}'.format("Size:", format_size(result['bytes'])))
+    print('{0:<12} {1:.1f} s'.format("Time:", result['elapsed']))
+    print('{0:<12} {1}/s'.format("Throughput:", format_size(result['throughput'])))
+    print('{0:<12} {1}'.format("SHA-256:", result['sha256']))
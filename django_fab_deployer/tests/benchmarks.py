@@ -0,0 +1,428 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+"""
+Runs tasks against a fake host which answers every remote command instantly (or after ``--rtt``)
+and reports remote commands, bytes and orchestration time per task.
+
+    python -m django_fab_deployer.tests.benchmarks [--rtt 0.05] [--repeat 3] [--save]
+
+Results are compared with the baseline saved by ``--save``; more remote commands or a clearly slower
+run make the command exit with status 1.
+"""
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import base64
+import binascii
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from six import StringIO
+
+DEFAULT_BASELINE = os.path.join(".djdeploy", "benchmarks.json")
+
+# A run is slower when it takes both 50 % and 50 ms more than the baseline
+SLOWDOWN_RATIO = 1.5
+SLOWDOWN_MIN_SECONDS = 0.05
+
+HOSTS = ['web1.benchmark.invalid', 'web2.benchmark.invalid', 'web3.benchmark.invalid']
+
+OPTIONS = {
+    "deploy_path": "/srv/benchmark",
+    "hosts": HOSTS[0],
+    "user": "deploy",
+    "venv_path": "data/.venv/bin/activate",
+    "project_name": "benchmark",
+    "celery_enabled": True,
+    "celery_workers": ["default", "mail"],
+    "parallel_stages": False,
+    "parallel_hosts": False,
+    "deploy_timings": False,
+    "warn_on_deploy": False,
+}
+
+# name, task, task arguments, options overriding OPTIONS
+SCENARIOS = [
+    ('deploy', 'deploy', {'skip_check': True}, {}),
+    ('deploy (3 hosts)', 'deploy', {'skip_check': True}, {'hosts': HOSTS}),
+    ('deploy (atomic)', 'deploy', {'skip_check': True}, {'atomic_releases': True, 'repository': 'git@example.com:benchmark.git'}),
+    ('status', 'status', {}, {}),
+    ('restart', 'restart', {}, {}),
+    ('graceful_restart', 'graceful_restart', {}, {}),
+    ('pip_install', 'pip_install', {}, {}),
+    ('migrate', 'migrate', {}, {}),
+]
+
+# Canned output of commands whose output is parsed, everything else answers with nothing
+RESPONSES = [
+    (re.compile(r'\bnproc\b'), "4"),
+    (re.compile(r'\bdu -sb\b'), "1048576\tdata/backup"),
+    (re.compile(r'\bgit (--git-dir=\S+ )?rev-parse\b'), "0123456789abcdef0123456789abcdef01234567"),
+    (re.compile(r'\bsupervisorctl pid\b'), "4242"),
+    (re.compile(r'echo @@; cat'), "0123456789abcdef0123456789abcdef01234567\n@@\n@@\n0123456789abcdef0123456789abcdef01234567"),
+]
+
+# Remote Python scripts (shipped base64 encoded) are recognised by the result marker in their payload
+SCRIPT_RESPONSES = [
+    ("@@djdeploy-workers ", '{"ready": {"default": 1.0, "mail": 1.0}, "errors": {}, "elapsed": 1.0}'),
+    ("@@djdeploy-status ", '{"hostname": "web1", "time": 0, "uptime": 86400, "load": [0.1, 0.1, 0.1], "cpus": 4, '
+                           '"memory": {"total": 8589934592, "available": 4294967296}, '
+                           '"disk": {"path": "/srv/benchmark", "total": 107374182400, "free": 53687091200}, '
+                           '"programs": [], "supervisor_error": "", "services": {}}'),
+    ("@@djdeploy-compiled ", '{"full": false, "compiled": 0, "removed": 0, "workers": 1, "errors": [], "elapsed": 0.1, '
+                             '"previous": "0123456789abcdef0123456789abcdef01234567"}'),
+    ("@@djdeploy-migrations ", '{"databases": {"default": {"pending": [], "conflicts": [], "server": ""}}, "boot": 1.0}'),
+]
+
+BASE64_ARGUMENT = re.compile(r'(?<![\w+/=])[A-Za-z0-9+/]{40,}={0,2}(?![\w+/=])')
+
+
+def remote_scripts(command):
+    scripts = []
+
+    for argument in BASE64_ARGUMENT.findall(command):
+        try:
+            scripts.append(base64.b64decode(argument).decode('utf-8'))
+        except (binascii.Error, TypeError, ValueError):
+            continue
+
+    return "\n".join(scripts)
+
+
+class FakeHost(object):
+    """
+    Stand-in for Fabric's remote execution: counts commands and the bytes sent and received.
+    """
+
+    def __init__(self, rtt=0.0):
+        self.rtt = rtt
+        self.reset()
+
+    def reset(self):
+        self.commands = []
+        self.local_commands = []
+        self.transfers = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def respond(self, command):
+        scripts = remote_scripts(command)
+
+        for marker, output in SCRIPT_RESPONSES:
+            if marker in scripts:
+                return marker + output
+
+        for pattern, output in RESPONSES:
+            if pattern.search(command):
+                return output
+
+        return ""
+
+    def _result(self, command, output):
+        from fabric.operations import _AttributeString
+
+        result = _AttributeString(output)
+        result.command = command
+        result.real_command = command
+        result.return_code = 0
+        result.failed = False
+        result.succeeded = True
+        result.stderr = ""
+
+        return result
+
+    def run_command(self, command, shell=True, pty=True, combine_stderr=True, sudo=False, user=None, quiet=False,
+                    warn_only=False, stdout=None, stderr=None, group=None, timeout=None, shell_escape=None, *args, **kwargs):
+        from fabric.api import env
+        from fabric.operations import _prefix_commands, _prefix_env_vars, _shell_wrap
+
+        # What Fabric would send: the command wrapped in the current `cd`, `prefix` and `shell_env`
+        real_command = _shell_wrap(_prefix_commands(_prefix_env_vars(command), 'remote'), shell_escape if shell_escape is not None else True, shell)
+        output = self.respond(command)
+
+        if self.rtt:
+            time.sleep(self.rtt)
+
+        self.commands.append((env.host_string, command))
+        self.bytes_sent += len(real_command.encode('utf-8'))
+        self.bytes_received += len(output.encode('utf-8'))
+
+        return self._result(real_command, output)
+
+    def local(self, command, capture=False, shell=None, *args, **kwargs):
+        self.local_commands.append(command)
+
+        return self._result(command, "")
+
+    def transfer(self, name):
+        def transfer(*args, **kwargs):
+            from fabric.api import env
+
+            if self.rtt:
+                time.sleep(self.rtt)
+
+            self.transfers.append((env.host_string, name))
+
+            return self._result(name, "")
+
+        return transfer
+
+
+@contextmanager
+def patched(fake_host):
+    """
+    Route `run`/`sudo` (through ``_run_command``), `local`, `put`, `get` and `rsync_project` to ``fake_host``,
+    including the names modules of this package imported directly.
+    """
+    import django_fab_deployer
+    from fabric import operations
+    from fabric.contrib import project
+
+    replacements = [(operations, '_run_command', fake_host.run_command),
+                    (project, 'rsync_project', fake_host.transfer('rsync_project'))]
+
+    for module in [module for name, module in sorted(sys.modules.items()) if name.startswith(django_fab_deployer.__name__ + ".") and module]:
+        for name, replacement in [('local', fake_host.local),
+                                  ('put', fake_host.transfer('put')),
+                                  ('get', fake_host.transfer('get')),
+                                  ('rsync_project', fake_host.transfer('rsync_project'))]:
+            if hasattr(module, name):
+                replacements.append((module, name, replacement))
+
+    originals = [(module, name, getattr(module, name)) for module, name, replacement in replacements]
+
+    for module, name, replacement in replacements:
+        setattr(module, name, replacement)
+
+    try:
+        yield
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
+
+
+def _closure_functions(function):
+    cells = getattr(function, '__closure__', None) or getattr(function, 'func_closure', None) or ()
+    functions = []
+
+    for cell in cells:
+        try:
+            contents = cell.cell_contents
+        except ValueError:
+            continue
+
+        if callable(contents):
+            functions.append(contents)
+
+    return functions
+
+
+def _forget_runs_once(fabric_task):
+    # `runs_once` caches the return value on its wrapper, which would turn repeated runs into no-ops. Python 2's
+    # `functools.wraps` sets no `__wrapped__`, so wrappers like `needs_host` are looked through via their closures.
+    pending = [fabric_task]
+    seen = set()
+
+    while pending:
+        wrapped = pending.pop()
+
+        if wrapped is None or id(wrapped) in seen:
+            continue
+
+        seen.add(id(wrapped))
+
+        if 'return_value' in getattr(wrapped, '__dict__', {}):
+            del wrapped.return_value
+
+        pending += [getattr(wrapped, 'wrapped', None), getattr(wrapped, '__wrapped__', None)] + _closure_functions(wrapped)
+
+
+def run_scenario(fake_host, scenario, verbose=False):
+    from fabric.api import env, execute, hide, settings
+    from fabric.state import connections
+
+    from django_fab_deployer import fabfile
+
+    name, task_name, task_kwargs, overrides = scenario
+    options = dict(OPTIONS, **overrides)
+    fabric_task = getattr(fabfile, task_name)
+
+    stdout = sys.stdout
+    fake_host.reset()
+
+    with hide('everything') if not verbose else settings():
+        if not verbose:
+            sys.stdout = StringIO()
+
+        try:
+            fabfile.function_builder("benchmark", options)()
+            _forget_runs_once(fabric_task)
+
+            start_ = time.time()
+            execute(fabric_task, hosts=env.hosts, **task_kwargs)
+            elapsed = time.time() - start_
+        finally:
+            sys.stdout = stdout
+            connections.clear()
+
+    if not fake_host.commands:
+        raise RuntimeError("`{0}` ran no remote commands, there is nothing to measure".format(name))
+
+    return {
+        'commands': len(fake_host.commands),
+        'local_commands': len(fake_host.local_commands),
+        'transfers': len(fake_host.transfers),
+        'bytes_sent': fake_host.bytes_sent,
+        'bytes_received': fake_host.bytes_received,
+        'elapsed': elapsed,
+    }
+
+
+@contextmanager
+def project_dir():
+    """
+    Temporary project directory with a deploy.json, so that the fabfile finds a configuration
+    and local state (.djdeploy) does not end up in the current directory.
+    """
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix="djdeploy-benchmarks-")
+
+    with open(os.path.join(directory, "deploy.json"), "w") as config_file:
+        json.dump({"benchmark": OPTIONS}, config_file)
+
+    os.chdir(directory)
+
+    try:
+        yield directory
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+def run_benchmarks(rtt=0.0, repeat=1, selected=None, verbose=False):
+    fake_host = FakeHost(rtt=rtt)
+    results = {}
+
+    with project_dir():
+        # Imported before patching so its directly imported `local`, `get`... are replaced too
+        from django_fab_deployer import fabfile  # noqa
+
+        with patched(fake_host):
+            for scenario in SCENARIOS:
+                if selected and scenario[0] not in selected:
+                    continue
+
+                runs = [run_scenario(fake_host, scenario, verbose=verbose) for _ in range(repeat)]
+
+                # Counts are deterministic, the fastest run is the least noisy time
+                results[scenario[0]] = dict(runs[0], elapsed=min(run['elapsed'] for run in runs))
+
+    return results
+
+
+def load_baseline(path):
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_baseline(path, results):
+    directory = os.path.dirname(path)
+
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(path, "w") as baseline_file:
+        json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+
+def regressions(result, baseline):
+    found = []
+
+    for key in ('commands', 'transfers', 'local_commands'):
+        if result[key] > baseline.get(key, result[key]):
+            found.append("{0} {1} -> {2}".format(key.replace("_", " "), baseline[key], result[key]))
+
+    if 'elapsed' in baseline and result['elapsed'] > baseline['elapsed'] * SLOWDOWN_RATIO and result['elapsed'] - baseline['elapsed'] >= SLOWDOWN_MIN_SECONDS:
+        found.append("time {0:.3f} s -> {1:.3f} s".format(baseline['elapsed'], result['elapsed']))
+
+    return found
+
+
+def print_results(results, baseline):
+    from colorama import Fore, Style
+    from terminaltables import AsciiTable
+
+    from django_fab_deployer.utils import print_table
+
+    rows = [['Task', 'Remote', 'Local', 'Transfers', 'Sent [B]', 'Received [B]', 'Time [s]', 'Baseline']]
+    failed = False
+
+    for name, result in sorted(results.items(), key=lambda item: [scenario[0] for scenario in SCENARIOS].index(item[0])):
+        found = regressions(result, baseline[name]) if name in baseline else None
+
+        if found is None:
+            verdict = '-'
+        elif found:
+            verdict = Fore.RED + "; ".join(found) + Style.RESET_ALL
+            failed = True
+        else:
+            verdict = Fore.GREEN + "OK" + Style.RESET_ALL
+
+        rows.append([name,
+                     '{0}'.format(result['commands']),
+                     '{0}'.format(result['local_commands']),
+                     '{0}'.format(result['transfers']),
+                     '{0}'.format(result['bytes_sent']),
+                     '{0}'.format(result['bytes_received']),
+                     '{0:.3f}'.format(result['elapsed']),
+                     verdict])
+
+    table = AsciiTable(rows, " Benchmarks ")
+
+    for column in range(1, 7):
+        table.justify_columns[column] = 'right'
+
+    print_table(table)
+
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count remote round trips and orchestration time of django_fab_deployer tasks")
+    parser.add_argument('--rtt', type=float, default=0.0, help="simulated round trip time per remote command in seconds")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per task, the fastest one is reported")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file (default: %(default)s)")
+    parser.add_argument('--save', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--verbose', action='store_true', help="show the output of the tasks")
+    parser.add_argument('scenarios', nargs='*', help="run only these tasks, e.g. `status` `deploy (3 hosts)`")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(rtt=args.rtt, repeat=args.repeat, selected=args.scenarios, verbose=args.verbose)
+    baseline = load_baseline(args.baseline)
+
+    # Baselines measured with another simulated RTT are not comparable
+    if baseline.get('rtt', 0.0) != args.rtt:
+        baseline = {}
+
+    failed = print_results(results, baseline.get('results', {}))
+
+    if args.save:
+        save_baseline(args.baseline, {'rtt': args.rtt, 'results': dict(baseline.get('results', {}), **results)})
+        print("Baseline saved to `{0}`".format(args.baseline))
+
+    return 1 if failed and not args.save else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
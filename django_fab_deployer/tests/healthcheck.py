@@ -0,0 +1,115 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+"""
+Runs the URL check against a local HTTP stand-in: a healthy page, a wrong status, a page missing the expected
+text, a page which recovers after two failures and one which never does; checks results and retry counts.
+
+    python -m django_fab_deployer.tests.healthcheck
+"""
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import sys
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+
+from django_fab_deployer import healthcheck
+
+RETRIES = 2
+BACKOFF = 0.01
+
+# path: status codes of the successive responses, the last one repeats
+PAGES = {
+    '/ok': [200],
+    '/error': [500],
+    '/text': [200],
+    '/recovers': [503, 503, 200],
+    '/down': [503],
+}
+
+# path, expected status, expected text, expected result, expected attempts
+CASES = [
+    ('/ok', 200, 'healthy', True, 1),
+    ('/error', 200, None, False, RETRIES + 1),
+    ('/text', 200, 'missing text', False, RETRIES + 1),
+    ('/recovers', 200, None, True, 3),
+    ('/down', 200, None, False, RETRIES + 1),
+    ('/error', 500, None, True, 1),
+]
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_server(hits):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                hits[self.path] = hits.get(self.path, 0) + 1
+                statuses = PAGES[self.path]
+                status = statuses[min(hits[self.path], len(statuses)) - 1]
+
+            body = b"healthy" if status == 200 else b"unavailable"
+            self.send_response(status)
+            self.send_header("Content-Length", "{0}".format(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = _Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+def main():
+    hits = {}
+    server = start_server(hits)
+    base_url = "http://127.0.0.1:{0}".format(server.server_address[1])
+    failures = []
+
+    try:
+        session = healthcheck.make_session(1)
+
+        for path, status, contains, ok, attempts in CASES:
+            hits.clear()
+            spec = healthcheck.url_spec({'url': base_url + path, 'status': status, 'contains': contains})
+            result = healthcheck.check_url(session, spec, timeout=5, retries=RETRIES, backoff=BACKOFF)
+
+            if result['ok'] != ok:
+                failures.append("{0}: {1}, expected {2} ({3})".format(path, 'OK' if result['ok'] else 'FAILED', 'OK' if ok else 'FAILED', result['error']))
+
+            if result['attempts'] != attempts or hits.get(path) != attempts:
+                failures.append("{0}: {1} attempt(s), {2} request(s), expected {3}".format(path, result['attempts'], hits.get(path), attempts))
+
+            if contains == 'missing text' and 'does not contain' not in result['error']:
+                failures.append("{0}: unexpected error `{1}`".format(path, result['error']))
+
+        session.close()
+
+        results = healthcheck.check_urls([base_url + '/ok', base_url + '/error'], retries=0, backoff=BACKOFF)
+        healthcheck.print_results(results)
+
+        if [result['ok'] for result in results] != [True, False]:
+            failures.append("check_urls: unexpected results")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    for failure in failures:
+        print(failure)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
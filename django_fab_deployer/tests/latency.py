@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+"""
+Runs the latency probe against a local HTTP stand-in: a baseline with a fast server, then a run with the
+server slowed down by ``--slowdown``, which must be reported as a regression.
+
+    python -m django_fab_deployer.tests.latency [--delay 20] [--slowdown 3] [--requests 40] [--concurrency 4]
+"""
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import sys
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+
+from django_fab_deployer import latency
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_server(state):
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(state['delay'])
+
+            body = b"OK"
+            self.send_response(200)
+            self.send_header("Content-Length", "{0}".format(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = _Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that the latency probe detects a slower server")
+    parser.add_argument('--delay', type=float, default=20, help="response time of the fast server in ms (default: %(default)s)")
+    parser.add_argument('--slowdown', type=float, default=3, help="how many times slower the second run is (default: %(default)s)")
+    parser.add_argument('--requests', type=int, default=40, help="requests per run (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=4, help="concurrent requests (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    state = {'delay': args.delay / 1000.0}
+    server = start_server(state)
+    urls = ["http://127.0.0.1:{0}/".format(server.server_address[1])]
+
+    try:
+        baseline = dict((result['url'], result) for result in latency.measure(urls, args.requests, args.concurrency))
+        same = latency.measure(urls, args.requests, args.concurrency)
+
+        state['delay'] *= args.slowdown
+        slower = latency.measure(urls, args.requests, args.concurrency)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    false_alarms = latency.compare(same, baseline)
+    regressions = latency.compare(slower, baseline)
+
+    latency.print_results(same, baseline, false_alarms, " Same server ")
+    latency.print_results(slower, baseline, regressions, " {0:g}x slower server ".format(args.slowdown))
+
+    if false_alarms:
+        print("Unchanged server reported as a regression")
+        return 1
+
+    if not regressions:
+        print("Slower server not detected")
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
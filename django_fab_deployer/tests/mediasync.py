@@ -0,0 +1,79 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+"""
+Checks that ``get_media:delete=true`` keeps local files which the remote listing leaves out on purpose
+(`EXCLUDE_PATTERNS`) and removes only files which are gone on the server.
+
+    python -m django_fab_deployer.tests.mediasync
+"""
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import os
+import shutil
+import sys
+import tempfile
+
+from django_fab_deployer import mediasync
+
+# path relative to the media directory, expected to survive
+LOCAL_FILES = [
+    ('photos/kept.jpg', True),
+    ('photos/removed.jpg', False),
+    ('cache/ab/thumbnail.jpg', True),
+    ('photos/cache-small.jpg', True),
+    ('filer_public/ab/file.pdf', True),
+    ('.gitignore', True),
+    ('docs/.gitkeep', True),
+]
+
+LISTING = {'photos/kept.jpg': [1, 0]}
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    failures = []
+
+    try:
+        os.chdir(directory)
+
+        for path, survives in LOCAL_FILES:
+            full_path = os.path.join(mediasync.LOCAL_MEDIA_DIR, *path.split("/"))
+
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+
+            with open(full_path, "w") as media_file:
+                media_file.write("x")
+
+        removed = mediasync.delete_extraneous(LISTING)
+
+        for path, survives in LOCAL_FILES:
+            exists = os.path.exists(os.path.join(mediasync.LOCAL_MEDIA_DIR, *path.split("/")))
+
+            if exists != survives:
+                failures.append("{0} was {1}".format(path, "kept" if exists else "removed"))
+
+        expected_removed = len([path for path, survives in LOCAL_FILES if not survives])
+
+        if removed != expected_removed:
+            failures.append("{0} file(s) reported removed, expected {1}".format(removed, expected_removed))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+    for failure in failures:
+        print(failure)
+
+    if failures:
+        return 1
+
+    print("Excluded media kept, {0} extraneous file(s) removed".format(removed))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
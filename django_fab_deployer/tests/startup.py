@@ -0,0 +1,144 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+"""
+Measures how long ``djdeploy --list`` takes in a project with many targets and fails when it is over budget.
+The budget is on top of ``import fabric.main``, which (paramiko, cryptography) alone takes most of the time
+and sets the floor.
+
+    python -m django_fab_deployer.tests.startup [--budget 60] [--targets 200] [--repeat 10] [--imports]
+
+With ``--imports`` (Python 3.7+) the slowest imports of one run are listed as well.
+"""
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_BUDGET_MS = 60
+DEFAULT_TARGETS = 200
+DEFAULT_REPEAT = 10
+SLOWEST_IMPORTS = 15
+
+
+def write_project(directory, targets):
+    deploy_config = {
+        "defaults": {"user": "deploy", "venv_path": "data/.venv/bin/activate", "warn_on_deploy": False},
+        "base": {"abstract": True, "celery_enabled": True},
+    }
+
+    for number in range(targets):
+        deploy_config["target{0}".format(number)] = {
+            "extends": "base",
+            "hosts": "10.0.{0}.{1}".format(number // 250, number % 250 + 1),
+            "deploy_path": "/var/www/target{0}".format(number),
+            "project_name": "target{0}".format(number),
+        }
+
+    with open(os.path.join(directory, "deploy.json"), "w") as config_file:
+        json.dump(deploy_config, config_file)
+
+
+def _command_env():
+    package_parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    command_env = dict(os.environ)
+    command_env['PYTHONPATH'] = os.pathsep.join([package_parent] + [path for path in [os.environ.get('PYTHONPATH')] if path])
+
+    return command_env
+
+
+def time_command(argv, directory):
+    start_ = time.time()
+    process = subprocess.Popen(argv, cwd=directory, env=_command_env(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    elapsed = time.time() - start_
+
+    if process.returncode != 0:
+        raise RuntimeError("`{0}` failed:\n{1}".format(" ".join(argv), stderr.decode('utf-8', 'replace')))
+
+    return elapsed, stderr.decode('utf-8', 'replace')
+
+
+def slowest_imports(importtime_output):
+    """
+    Parses ``-X importtime`` output into ``(cumulative_us, module)`` pairs, slowest first.
+    """
+    imports = []
+
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        try:
+            self_us, cumulative_us, module = [part.strip() for part in line[len("import time:"):].split("|")]
+            imports.append((int(cumulative_us), module))
+        except ValueError:
+            continue
+
+    return sorted(imports, reverse=True)[:SLOWEST_IMPORTS]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the startup time of `djdeploy --list`")
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_MS,
+                        help="allowed median in milliseconds over `import fabric.main` (default: %(default)s)")
+    parser.add_argument('--targets', type=int, default=DEFAULT_TARGETS, help="targets in the generated deploy.json (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="measured runs (default: %(default)s)")
+    parser.add_argument('--imports', action='store_true', help="list the slowest imports (Python 3.7+)")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix="djdeploy-startup-")
+    command = [sys.executable, '-m', 'django_fab_deployer.runner', '--list']
+
+    try:
+        write_project(directory, args.targets)
+
+        # The first run compiles and caches deploy.json, like the first call after editing it
+        cold, _ = time_command(command, directory)
+        timings = sorted(time_command(command, directory)[0] for _ in range(args.repeat))
+        floor = sorted(time_command([sys.executable, '-c', 'import fabric.main'], directory)[0] for _ in range(args.repeat))
+
+        imports = []
+
+        if args.imports and sys.version_info >= (3, 7):
+            imports = slowest_imports(time_command([sys.executable, '-X', 'importtime'] + command[1:], directory)[1])
+    except RuntimeError as e:
+        # A failing command is fast, its time says nothing
+        print(e)
+        return 1
+    finally:
+        shutil.rmtree(directory)
+
+    median = timings[len(timings) // 2] * 1000
+    floor_median = floor[len(floor) // 2] * 1000
+
+    print("`djdeploy --list` with {0} targets".format(args.targets))
+    print('{0:<16} {1:>7.1f} ms'.format("First run:", cold * 1000))
+    print('{0:<16} {1:>7.1f} ms'.format("Fastest:", timings[0] * 1000))
+    print('{0:<16} {1:>7.1f} ms'.format("Median:", median))
+    print('{0:<16} {1:>7.1f} ms'.format("fabric.main:", floor_median))
+    print('{0:<16} {1:>7.1f} ms'.format("Own cost:", median - floor_median))
+    print('{0:<16} {1:>7.1f} ms'.format("Budget:", args.budget))
+
+    if imports:
+        print("Slowest imports (cumulative):")
+
+        for cumulative_us, module in imports:
+            print('{0:>10.1f} ms  {1}'.format(cumulative_us / 1000.0, module))
+
+    if median - floor_median > args.budget:
+        print("Over budget by {0:.1f} ms".format(median - floor_median - args.budget))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+"""
+Streams fake dump commands through the compressors the way ``pull_db`` does, with the command running locally
+instead of over SSH, and checks the written files, their SHA-256 and that a failing dump leaves nothing behind.
+
+    python -m django_fab_deployer.tests.streaming
+"""
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import gzip
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+from fabric.context_managers import settings, hide
+
+from django_fab_deployer import streaming
+
+DUMP_SIZE = 3 * streaming.CHUNK_SIZE + 123
+
+# name, dump command, expected dump (None when the command fails), compression
+CASES = [
+    ('plain.dump', "printf 'CREATE TABLE app_thing (id integer);\\n'", b"CREATE TABLE app_thing (id integer);\n", 'none'),
+    ('large.dump.gz', "head -c {0} /dev/zero".format(DUMP_SIZE), b"\0" * DUMP_SIZE, 'gzip'),
+    # Only `pipefail` makes the compressor's pipeline fail with the dump
+    ('failed.dump.gz', "(printf 'partial'; exit 3)", None, 'gzip'),
+    ('failed.dump', "(printf 'partial'; exit 3)", None, 'none'),
+]
+
+
+def _local_argv(command):
+    return ["sh", "-c", command]
+
+
+def _read_dump(path, compression):
+    opener = gzip.open if compression == 'gzip' else open
+
+    with opener(path, "rb") as dump_file:
+        return dump_file.read()
+
+
+def _sha256(path):
+    with open(path, "rb") as dump_file:
+        return hashlib.sha256(dump_file.read()).hexdigest()
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    ssh_argv = streaming.ssh_argv
+    failures = []
+
+    try:
+        streaming.ssh_argv = _local_argv
+
+        for name, dump_command, expected, compression in CASES:
+            compress_command, _ = streaming.compressor_command(compression, threads=1)
+            remote_command = dump_command + (" | " + compress_command if compress_command else "")
+            path = os.path.join(directory, "backup", name)
+
+            try:
+                with settings(hide('aborts')):
+                    result = streaming.stream_to_file("cd {0} && {1}".format(directory, remote_command), path)
+            except SystemExit:
+                result = None
+
+            if expected is None:
+                if result is not None:
+                    failures.append("{0}: failing dump was saved".format(name))
+
+                if os.path.exists(path) or os.path.exists(path + ".part"):
+                    failures.append("{0}: failing dump left a file behind".format(name))
+
+                continue
+
+            if result is None:
+                failures.append("{0}: streaming failed".format(name))
+                continue
+
+            streaming.write_checksum_file(result)
+
+            if os.path.exists(path + ".part"):
+                failures.append("{0}: partial file left behind".format(name))
+
+            if _read_dump(path, compression) != expected:
+                failures.append("{0}: content differs from the dump".format(name))
+
+            if result['bytes'] != os.path.getsize(path) or result['sha256'] != _sha256(path):
+                failures.append("{0}: reported {1} B / {2}, file has {3} B / {4}".format(name, result['bytes'], result['sha256'],
+                                                                                        os.path.getsize(path), _sha256(path)))
+
+            with open(path + ".sha256") as checksum_file:
+                if checksum_file.read() != "{0}  {1}\n".format(_sha256(path), name):
+                    failures.append("{0}: wrong checksum file".format(name))
+    finally:
+        streaming.ssh_argv = ssh_argv
+        shutil.rmtree(directory)
+
+    for failure in failures:
+        print(failure)
+
+    if failures:
+        return 1
+
+    print("{0} dumps streamed, failing dumps discarded".format(len(CASES)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import io
+import json
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+from time import localtime, strftime
+
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.context_managers import settings
+
+from .utils import local_state_path, print_table
+
+TIMINGS_DIR = "timings"
+HISTORY_SIZE = 30
+DEFAULT_COMPARE_RUNS = 10
+COMPARED_CATEGORIES = ['task', 'stage']
+COUNTER_CATEGORY = 'counter'
+SLOWEST_COMMANDS = 10
+COMMAND_LABEL_LENGTH = 100
+
+# A stage regressed when it is both relatively and absolutely slower than the median
+REGRESSION_RATIO = 1.2
+REGRESSION_MIN_SECONDS = 5.0
+
+
+def history_dir():
+    return local_state_path(TIMINGS_DIR, env.target_name)
+
+
+def start_trace():
+    """
+    Create a trace file for a new deploy and return its path. Spans are appended by every process taking part.
+    """
+    directory = history_dir()
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    install_command_hook()
+
+    return os.path.join(directory, "{0}-{1}.jsonl".format(strftime("%Y%m%d-%H%M%S", localtime()), os.getpid()))
+
+
+def record(name, category, start, end, **args):
+    path = env.get('trace_path')
+
+    if not path:
+        return
+
+    _append(path, {'name': name, 'cat': category, 'host': env.host_string, 'pid': os.getpid(), 'start': start, 'end': end, 'args': args})
+
+
+def record_counter(name, host, timestamp, **values):
+    """
+    A sample of ``values`` on ``host``, shown as counter tracks in the Chrome trace.
+    """
+    path = env.get('trace_path')
+
+    if not path:
+        return
+
+    _append(path, {'name': name, 'cat': COUNTER_CATEGORY, 'host': host, 'pid': os.getpid(), 'start': timestamp, 'end': timestamp, 'args': values})
+
+
+def _append(path, one_record):
+    # One small append per record keeps lines from forked stage and host processes intact
+    with io.open(path, "ab") as trace_file:
+        trace_file.write((json.dumps(one_record) + "\n").encode('utf-8'))
+
+
+@contextmanager
+def span(name, category='stage', **args):
+    start_ = time.time()
+    ok = False
+
+    try:
+        yield
+        ok = True
+    finally:
+        record(name, category, start_, time.time(), ok=ok, **args)
+
+
+def install_command_hook():
+    """
+    Record every `run`/`sudo` as a span. Both go through ``fabric.operations._run_command``, which is looked up
+    at call time, so modules that imported `run` directly are covered as well.
+    """
+    from fabric import operations
+
+    if getattr(operations._run_command, 'traced', False):
+        return
+
+    run_command = operations._run_command
+
+    @wraps(run_command)
+    def traced_run_command(command, *args, **kwargs):
+        with span(command[:COMMAND_LABEL_LENGTH], 'command', sudo=kwargs.get('sudo', False)):
+            return run_command(command, *args, **kwargs)
+
+    traced_run_command.traced = True
+    operations._run_command = traced_run_command
+
+
+def load(path):
+    records = []
+
+    with io.open(path, encoding='utf-8') as trace_file:
+        for line in trace_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return records
+
+
+def chrome_trace(records):
+    """
+    Trace-event format for chrome://tracing and Perfetto; each host is shown as a process.
+    """
+    start_ = min(one_record['start'] for one_record in records) if records else 0
+    hosts = []
+    events = []
+
+    for one_record in records:
+        host = one_record['host'] or "local"
+
+        if host not in hosts:
+            hosts.append(host)
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': len(hosts), 'args': {'name': host}})
+
+        if one_record['cat'] == COUNTER_CATEGORY:
+            events.append({'name': one_record['name'],
+                           'ph': 'C',
+                           'pid': hosts.index(host) + 1,
+                           'ts': int((one_record['start'] - start_) * 1000000),
+                           'args': one_record['args']})
+            continue
+
+        events.append({'name': one_record['name'],
+                       'cat': one_record['cat'],
+                       'ph': 'X',
+                       'pid': hosts.index(host) + 1,
+                       'tid': one_record['pid'],
+                       'ts': int((one_record['start'] - start_) * 1000000),
+                       'dur': int((one_record['end'] - one_record['start']) * 1000000),
+                       'args': one_record['args']})
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def _traces():
+    directory = history_dir()
+
+    if not os.path.isdir(directory):
+        return []
+
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".jsonl")]
+
+
+def finish_trace(path, start_, ok, **args):
+    with settings(trace_path=path, host_string=None):
+        record("deploy", 'deploy', start_, time.time(), ok=ok, **args)
+
+    with io.open(path[:-len(".jsonl")] + ".trace.json", "w", encoding='utf-8') as trace_file:
+        trace_file.write(json.dumps(chrome_trace(load(path))))
+
+    for old_path in _traces()[:-HISTORY_SIZE]:
+        os.remove(old_path)
+
+        if os.path.isfile(old_path[:-len(".jsonl")] + ".trace.json"):
+            os.remove(old_path[:-len(".jsonl")] + ".trace.json")
+
+    print(Fore.BLUE + "Timing trace saved to `{0}`".format(os.path.relpath(path)))
+
+
+def stage_durations(records):
+    """
+    Wall-clock time per stage; a stage running on several hosts counts as long as its slowest host.
+    """
+    per_host = {}
+
+    for one_record in records:
+        if one_record['cat'] in COMPARED_CATEGORIES:
+            key = (one_record['name'], one_record['host'])
+            per_host[key] = per_host.get(key, 0) + one_record['end'] - one_record['start']
+
+    durations = {}
+
+    for (name, host), duration in per_host.items():
+        durations[name] = max(durations.get(name, 0), duration)
+
+    return durations
+
+
+def _deploy_record(records):
+    for one_record in records:
+        if one_record['cat'] == 'deploy':
+            return one_record
+
+    return None
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def is_regression(latest, baseline):
+    return latest > baseline * REGRESSION_RATIO and latest - baseline >= REGRESSION_MIN_SECONDS
+
+
+def print_comparison(runs=DEFAULT_COMPARE_RUNS):
+    from terminaltables import AsciiTable
+
+    traces = _traces()
+
+    if not traces:
+        print(Fore.YELLOW + "No deploy timings recorded for `{0}` yet".format(env.target_name))
+        return
+
+    latest = load(traces[-1])
+    previous = []
+
+    for path in reversed(traces[:-1]):
+        records = load(path)
+        deploy_record = _deploy_record(records)
+
+        # Failed deploys stop early and would drag the median down
+        if deploy_record and deploy_record['args'].get('ok'):
+            previous.append(records)
+
+        if len(previous) >= runs:
+            break
+
+    latest_durations = stage_durations(latest)
+    previous_durations = [stage_durations(records) for records in previous]
+
+    latest_deploy = _deploy_record(latest)
+
+    if latest_deploy:
+        latest_durations['TOTAL'] = latest_deploy['end'] - latest_deploy['start']
+
+        for records, durations in zip(previous, previous_durations):
+            durations['TOTAL'] = _deploy_record(records)['end'] - _deploy_record(records)['start']
+
+    rows = [['Stage', 'Latest [s]', 'Median [s]', 'Change', '']]
+    regressed = []
+
+    for name in sorted(latest_durations, key=lambda one_name: (one_name == 'TOTAL', -latest_durations[one_name])):
+        history = [durations[name] for durations in previous_durations if name in durations]
+        duration = latest_durations[name]
+
+        if not history:
+            rows.append([name, '{0:.1f}'.format(duration), '-', '-', 'NEW'])
+            continue
+
+        baseline = median(history)
+        change = '{0:+.0f} %'.format((duration - baseline) / baseline * 100) if baseline else '-'
+
+        if is_regression(duration, baseline):
+            regressed.append(name)
+            rows.append([Fore.RED + cell + Style.RESET_ALL for cell in [name, '{0:.1f}'.format(duration), '{0:.1f}'.format(baseline), change, 'SLOWER']])
+        else:
+            rows.append([name, '{0:.1f}'.format(duration), '{0:.1f}'.format(baseline), change, ''])
+
+    status = "" if not latest_deploy else (" (OK)" if latest_deploy['args'].get('ok') else " (FAILED)")
+    table = AsciiTable(rows, " {0}{1} vs. median of {2} deploy(s) ".format(os.path.basename(traces[-1])[:15], status, len(previous)))
+
+    for column in (1, 2, 3):
+        table.justify_columns[column] = 'right'
+
+    print_table(table)
+
+    commands = sorted((one_record for one_record in latest if one_record['cat'] == 'command'),
+                      key=lambda one_record: one_record['start'] - one_record['end'])[:SLOWEST_COMMANDS]
+
+    if commands:
+        rows = [['Command', 'Host', 'Time [s]']]
+
+        for one_record in commands:
+            rows.append([one_record['name'], one_record['host'] or '', '{0:.1f}'.format(one_record['end'] - one_record['start'])])
+
+        table = AsciiTable(rows, " Slowest commands ")
+        table.justify_columns[2] = 'right'
+
+        print_table(table)
+
+    if regressed:
+        print(Fore.RED + Style.BRIGHT + "Slower than usual: {0}".format(", ".join(regressed)))
+    else:
+        print(Fore.GREEN + Style.BRIGHT + "No regressions.")
+
+    print(Fore.BLUE + "Open `{0}` in chrome://tracing or ui.perfetto.dev for the full trace".format(
+        os.path.relpath(traces[-1][:-len(".jsonl")] + ".trace.json")))
@@ -3,11 +3,21 @@
 
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
-import six
+import errno
 import os
+import time
+from contextlib import contextmanager
+
+import six
+
+LOCAL_STATE_DIR = ".djdeploy"
+DEFAULT_LOCK_TIMEOUT = 1800
 
 
 def fab_arg_to_bool(val):
+    if isinstance(val, bool):
+        return val
+
     if isinstance(val, six.string_types):
         return val.lower() == 'true'
 
@@ -21,3 +31,129 @@ def find_file_in_path(filename_to_find, path_list):
             return candidate
 
     return False
+
+
+def _as_list(value):
+    if isinstance(value, six.string_types):
+        return [value]
+
+    return list(value)
+
+
+def print_table(table):
+    try:
+        print(table.table)
+    except UnicodeEncodeError:
+        import pprint
+        pp = pprint.PrettyPrinter(indent=4)
+        pp.pprint(table.table_data)
+
+
+def parse_hosts(hosts):
+    """
+    `hosts` in deploy.json may be a single host string, a list of hosts or a dict
+    mapping role names (e.g. web, worker) to a host or list of hosts.
+
+    Returns a tuple ``(all_hosts, roledefs)``.
+    """
+    roledefs = {}
+
+    if isinstance(hosts, dict):
+        for role in sorted(hosts):
+            roledefs[role] = _as_list(hosts[role])
+
+        grouped_hosts = [roledefs[role] for role in sorted(roledefs)]
+    else:
+        grouped_hosts = [_as_list(hosts)]
+
+    all_hosts = []
+
+    for role_hosts in grouped_hosts:
+        for host in role_hosts:
+            if host not in all_hosts:
+                all_hosts.append(host)
+
+    return all_hosts, roledefs
+
+
+def local_state_path(*parts):
+    return os.path.join(os.getcwd(), LOCAL_STATE_DIR, *parts)
+
+
+def _lock_is_stale(path, grace=5):
+    """
+    A lock is stale when the process written into it is gone; a lock without a pid (still being written or left
+    by an older version) only after ``grace`` seconds.
+    """
+    try:
+        with open(path) as lock_file:
+            pid = int(lock_file.read().strip() or 0)
+        modified = os.path.getmtime(path)
+    except (IOError, OSError, ValueError):
+        return False
+
+    if not pid:
+        return time.time() - modified > grace
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.ESRCH
+
+    return False
+
+
+@contextmanager
+def local_lock(path, poll_interval=0.5, timeout=DEFAULT_LOCK_TIMEOUT):
+    """
+    Inter-process lock based on an exclusively created file holding the pid of its owner; host processes of
+    a parallel run share the workstation. Locks of killed processes are broken, waiting longer than ``timeout``
+    seconds aborts.
+    """
+    from fabric.utils import abort
+
+    directory = os.path.dirname(path)
+
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    start_ = time.time()
+    waiting = False
+
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, "{0}".format(os.getpid()).encode('ascii'))
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        if _lock_is_stale(path):
+            print("Breaking stale lock {0}".format(path))
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            continue
+
+        if not waiting:
+            print("Waiting for lock {0}".format(path))
+            waiting = True
+
+        if time.time() - start_ > timeout:
+            abort("Timed out after {0:.0f} s waiting for lock {1}; remove it if no other djdeploy is running".format(timeout, path))
+
+        time.sleep(poll_interval)
+
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(path)
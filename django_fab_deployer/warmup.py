@@ -0,0 +1,135 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import time
+
+from colorama import Fore, Style
+from fabric.api import env
+
+from . import healthcheck
+from .utils import print_table
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_URLS = 500
+SLOWEST_URLS = 5
+
+
+def enabled():
+    return bool(env.warmup_urls or env.warmup_sitemap or env.warmup_command)
+
+
+def _locations(session, url, timeout):
+    from xml.etree import ElementTree
+
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+
+    root = ElementTree.fromstring(response.content)
+    # Tags carry the sitemap namespace, e.g. `{http://www.sitemaps.org/schemas/sitemap/0.9}loc`
+    locations = [element.text.strip() for element in root.iter() if element.tag.endswith('loc') and element.text]
+
+    return root.tag.endswith('sitemapindex'), locations
+
+
+def sitemap_urls(session, url, limit=DEFAULT_MAX_URLS, timeout=healthcheck.DEFAULT_TIMEOUT):
+    """
+    Page URLs of a sitemap; the sitemaps of a sitemap index are read one after another until ``limit`` is reached.
+    """
+    is_index, locations = _locations(session, url, timeout)
+
+    if not is_index:
+        return locations[:limit]
+
+    urls = []
+
+    for sitemap in locations:
+        if len(urls) >= limit:
+            break
+
+        urls += _locations(session, sitemap, timeout)[1]
+
+    return urls[:limit]
+
+
+def _sitemap_or_nothing(session, url, limit, timeout):
+    import requests
+    from xml.etree.ElementTree import ParseError
+
+    try:
+        return sitemap_urls(session, url, limit, timeout)
+    except (requests.RequestException, ParseError) as e:
+        # A broken sitemap must not fail a deploy which already went live
+        print(Fore.YELLOW + "Cannot read sitemap `{0}`: {1}".format(url, e))
+        return []
+
+
+def _fetch(session, url, timeout):
+    import requests
+
+    start_ = time.time()
+
+    try:
+        response = session.get(url, timeout=timeout)
+        error = '' if response.status_code < 400 else "HTTP status `{0}`".format(response.status_code)
+    except requests.RequestException as e:
+        error = "{0}: {1}".format(e.__class__.__name__, e)
+
+    return {'url': url, 'ok': not error, 'error': error, 'latency': time.time() - start_}
+
+
+def fetch_all(urls, concurrency=DEFAULT_CONCURRENCY, timeout=healthcheck.DEFAULT_TIMEOUT, verify=True, sitemap=None, limit=DEFAULT_MAX_URLS):
+    """
+    Fetch ``urls`` and the pages of ``sitemap`` once each, ``concurrency`` at a time.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    pool_size = max(1, concurrency)
+    session = healthcheck.make_session(pool_size, verify=verify)
+
+    try:
+        urls = [healthcheck.url_spec(item)['url'] for item in urls]
+
+        if sitemap:
+            urls += _sitemap_or_nothing(session, sitemap, max(0, limit - len(urls)), timeout)
+
+        # Duplicates would only be served from the cache they just filled
+        seen = set()
+        urls = [url for url in urls if not (url in seen or seen.add(url))][:limit]
+
+        pool = ThreadPool(min(pool_size, len(urls)) or 1)
+
+        try:
+            return pool.map(lambda url: _fetch(session, url, timeout), urls)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        session.close()
+
+
+def print_report(results, elapsed, command_elapsed=None):
+    from terminaltables import AsciiTable
+
+    primed = [result for result in results if result['ok']]
+    failed = [result for result in results if not result['ok']]
+
+    if command_elapsed is not None:
+        print('{0:<20} {1:.1f} s'.format("Warm-up command:", command_elapsed))
+
+    if results:
+        rows = [['Slowest URLs', 'Time [ms]', 'Result']]
+
+        for result in sorted(results, key=lambda one_result: one_result['latency'], reverse=True)[:SLOWEST_URLS]:
+            rows.append([result['url'], '{0:.0f}'.format(result['latency'] * 1000), 'OK' if result['ok'] else result['error']])
+
+        table = AsciiTable(rows, " Warm-up ")
+        table.justify_columns[1] = 'right'
+        print_table(table)
+
+        for result in failed[:SLOWEST_URLS]:
+            print(Fore.YELLOW + "{0}: {1}".format(result['url'], result['error']))
+
+    color = Fore.YELLOW if failed else Fore.GREEN
+    print(color + Style.BRIGHT + "Primed {0} of {1} URL(s) in {2:.1f} s".format(len(primed), len(results), elapsed))
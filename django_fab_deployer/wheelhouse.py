@@ -0,0 +1,234 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import hashlib
+import os
+import shutil
+from contextlib import contextmanager
+
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.context_managers import cd, settings, hide
+from fabric.operations import get, local, put, run
+
+from .releases import CURRENT_LINK, RELEASE_VENV
+from .remote import remote_abspath, rsync_ssh_opts, venv_run
+from .utils import local_lock, local_state_path
+
+REMOTE_WHEELHOUSE_DIR = "data/wheelhouse"
+COMPLETE_MARKER = ".complete"
+BUILD_HOST_LOCAL = "local"
+PYTHON_TAG_ARGS = "-c 'import platform, sys; print(sys.version_info[:2], platform.machine(), sys.maxunicode)'"
+PYTHON_TAG_COMMAND = "python " + PYTHON_TAG_ARGS
+DEFAULT_KEEP_WHEELHOUSES = 4
+
+# Python build of each wheel builder, asked once per run
+_builder_tags = {}
+
+
+def _remote_dir(key):
+    return "{0}/{1}".format(REMOTE_WHEELHOUSE_DIR, key)
+
+
+def _local_dir(key):
+    return local_state_path("wheelhouse", key)
+
+
+def _is_complete_remotely(key):
+    # A used wheelhouse is touched so that pruning keeps the recently used ones
+    with settings(hide('everything'), warn_only=True):
+        return run("test -f {0}/{1} && touch {0}".format(_remote_dir(key), COMPLETE_MARKER)).succeeded
+
+
+def _is_complete_locally(key):
+    return os.path.isfile(os.path.join(_local_dir(key), COMPLETE_MARKER))
+
+
+@contextmanager
+def _on_builder(build_host):
+    """
+    Work in `deploy_root` of ``build_host``; unlike the release being built there it exists from the start.
+    """
+    with settings(host_string=build_host, deploy_path=env.deploy_root), cd(env.deploy_root):
+        yield
+
+
+def _builder_python():
+    # The virtualenv of the live code when there is one, the system Python otherwise
+    venv = "{0}/{1}".format(CURRENT_LINK, RELEASE_VENV) if env.get('release_venv') else env.venv_path.replace("/bin/activate", "")
+
+    return "$(command -v {0}/bin/python || command -v python3 || command -v python)".format(venv)
+
+
+def _builder_tag(build_host):
+    if build_host not in _builder_tags:
+        if build_host == BUILD_HOST_LOCAL:
+            _builder_tags[build_host] = local(PYTHON_TAG_COMMAND, capture=True).strip()
+        else:
+            with _on_builder(build_host), settings(hide('everything')):
+                _builder_tags[build_host] = run("{0} {1}".format(_builder_python(), PYTHON_TAG_ARGS)).strip()
+
+    return _builder_tags[build_host]
+
+
+def requirements_key(packages=None, build_host=BUILD_HOST_LOCAL):
+    """
+    Wheels are specific to the interpreter, so the key covers the requirements, the host's Python build and the
+    Python build of ``build_host`` which makes the wheels.
+    """
+    with settings(hide('everything')):
+        if packages:
+            inputs = " ".join(packages) + venv_run(PYTHON_TAG_COMMAND)
+        else:
+            inputs = venv_run("cat requirements/*.txt; " + PYTHON_TAG_COMMAND)
+
+    host_tag = inputs.strip().splitlines()[-1].strip()
+    builder_tag = _builder_tag(build_host)
+
+    if builder_tag != host_tag:
+        print(Fore.YELLOW + "Wheels are built by Python {0} for Python {1}, only pure-Python wheels will install".format(builder_tag, host_tag))
+
+    return hashlib.sha256((inputs + builder_tag).encode('utf-8')).hexdigest()[:16]
+
+
+def _pip_wheel_args(key, packages):
+    if packages:
+        return " ".join(packages)
+
+    return "-r {0}/requirements/production.txt".format(_remote_dir(key) + ".build")
+
+
+def _build_locally(key, packages):
+    local_dir = _local_dir(key)
+
+    print(Fore.BLUE + "Building wheelhouse {0} locally".format(key))
+
+    if os.path.isdir(local_dir):
+        shutil.rmtree(local_dir)
+
+    os.makedirs(local_dir)
+
+    if packages:
+        local("python -m pip wheel --wheel-dir {0} {1}".format(local_dir, " ".join(packages)))
+    else:
+        get("requirements", local_dir)
+        local("python -m pip wheel --wheel-dir {0} -r {1}".format(local_dir, os.path.join(local_dir, "requirements", "production.txt")))
+        shutil.rmtree(os.path.join(local_dir, "requirements"))
+
+    open(os.path.join(local_dir, COMPLETE_MARKER), "w").close()
+
+
+def _build_on_host(key, packages, build_host):
+    print(Fore.BLUE + "Building wheelhouse {0} on {1}".format(key, build_host))
+
+    requirements_dir = None
+
+    if not packages:
+        # The build host gets the requirements of the host being deployed, not its own
+        requirements_dir = local_state_path("wheelhouse", key + ".requirements")
+
+        if os.path.isdir(requirements_dir):
+            shutil.rmtree(requirements_dir)
+
+        os.makedirs(requirements_dir)
+        get("requirements", requirements_dir)
+
+    with _on_builder(build_host):
+        if not _is_complete_remotely(key):
+            run("rm -rf {0} {0}.build && mkdir -p {0} {0}.build".format(_remote_dir(key)))
+
+            if requirements_dir:
+                put(os.path.join(requirements_dir, "requirements"), _remote_dir(key) + ".build")
+
+            run("{0} -m pip wheel --wheel-dir {1} {2}".format(_builder_python(), _remote_dir(key), _pip_wheel_args(key, packages)))
+            run("rm -rf {0}.build && touch {0}/{1}".format(_remote_dir(key), COMPLETE_MARKER))
+
+        _rsync(key, upload=False)
+
+    if requirements_dir:
+        shutil.rmtree(requirements_dir)
+
+
+def _rsync(key, upload):
+    from fabric.contrib.project import rsync_project
+
+    extra_opts = ""
+
+    if upload:
+        with settings(hide('everything'), warn_only=True):
+            previous = venv_run("ls -1t {0} 2> /dev/null | grep -v -x -e {1} -e '.*\\.build' | head -n 1".format(REMOTE_WHEELHOUSE_DIR, key)).strip()
+
+        # Wheels already present in the previous wheelhouse are hard-linked instead of transferred
+        if previous:
+            extra_opts = "--link-dest=../{0}".format(previous)
+    else:
+        if not os.path.isdir(_local_dir(key)):
+            os.makedirs(_local_dir(key))
+
+    rsync_project(local_dir=_local_dir(key) + "/",
+                  remote_dir=remote_abspath(_remote_dir(key)) + "/",
+                  extra_opts=extra_opts,
+                  ssh_opts=rsync_ssh_opts(),
+                  upload=upload)
+
+
+def ensure(packages=None, force=False):
+    """
+    Make the wheelhouse for ``packages`` (or the project requirements) available on the current host
+    and return its path relative to `deploy_path`.
+    """
+    build_host = env.wheelhouse_build_host
+    key = requirements_key(packages, build_host)
+
+    if not force and _is_complete_remotely(key):
+        print(Fore.GREEN + "Wheelhouse {0} is cached on the host".format(key))
+        return _remote_dir(key)
+
+    with local_lock(local_state_path("wheelhouse", key + ".lock")):
+        if force or not _is_complete_locally(key):
+            if build_host == BUILD_HOST_LOCAL:
+                _build_locally(key, packages)
+            else:
+                _build_on_host(key, packages, build_host)
+
+    if force or not _is_complete_remotely(key):
+        print(Fore.BLUE + "Shipping wheelhouse {0}".format(key))
+
+        venv_run("mkdir -p {0}".format(_remote_dir(key)))
+        _rsync(key, upload=True)
+
+    prune(key)
+
+    print(Fore.GREEN + Style.BRIGHT + "Wheelhouse {0} ready".format(key))
+
+    return _remote_dir(key)
+
+
+def prune(key):
+    """
+    Keep the `keep_wheelhouses` most recently used wheelhouses on the host and locally, ``key`` included.
+    """
+    keep = env.get('keep_wheelhouses') or DEFAULT_KEEP_WHEELHOUSES
+
+    with settings(hide('running', 'stdout')):
+        venv_run("cd {0} && ls -1t | grep -v -x -e {1} -e '.*\\.build' | tail -n +{2} | xargs -r rm -rf".format(REMOTE_WHEELHOUSE_DIR, key, keep))
+
+    local_root = local_state_path("wheelhouse")
+
+    if os.path.isdir(_local_dir(key)):
+        os.utime(_local_dir(key), None)
+
+    # Locks and requirements copied for a build host live next to the wheelhouses
+    wheelhouses = [name for name in os.listdir(local_root)
+                   if os.path.isdir(os.path.join(local_root, name)) and not name.endswith(".requirements")] if os.path.isdir(local_root) else []
+
+    others = sorted((name for name in wheelhouses if name != key), key=lambda name: os.path.getmtime(os.path.join(local_root, name)), reverse=True)
+
+    for name in others[keep - 1:]:
+        shutil.rmtree(os.path.join(local_root, name), ignore_errors=True)
+
+
+def pip_install_args(wheelhouse_dir):
+    return "--no-index --find-links={0}".format(wheelhouse_dir)
@@ -0,0 +1,187 @@
+# -*- encoding: utf-8 -*-
+# ! python2
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import json
+
+from colorama import Fore, Style
+from fabric.api import env
+from fabric.context_managers import cd, settings, hide
+from fabric.utils import abort
+
+from .remote import SCRIPT_HEADER, python_command, venv_run
+from .utils import print_table
+
+CELERY_COMMAND = "celery --workdir=src/ --app=main"
+DEFAULT_READY_TIMEOUT = 60
+RESULT_MARKER = "@@djdeploy-workers "
+
+# Signals every worker, then polls supervisor (and Celery for Celery workers) until all of them are back.
+# One `inspect stats` call answers for all Celery nodes; a node counts as restarted once its uptime is
+# shorter than the time since the signal.
+RELOAD_SCRIPT = SCRIPT_HEADER + r'''
+import subprocess, time
+
+def sh(command):
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode("utf-8", "replace")
+    return process.returncode, output
+
+def celery_nodes():
+    code, output = sh(PAYLOAD["celery"] + " inspect stats --json --timeout=1 2> /dev/null")
+    try:
+        stats = json.loads(output[output.index("{"):])
+        return dict((node, values.get("uptime")) for node, values in stats.items())
+    except ValueError:
+        pass
+    # Celery without `--json`: only liveness is known
+    code, output = sh(PAYLOAD["celery"] + " inspect ping --timeout=1 2> /dev/null")
+    return dict((line.split()[1].rstrip(":"), None) for line in output.splitlines() if line.startswith("->") and "OK" in line)
+
+def celery_node(worker, nodes):
+    names = dict((node.split("@")[0], node) for node in nodes)
+    if worker["node"] in names:
+        return names[worker["node"]]
+    known = [one["node"] for one in PAYLOAD["workers"] if one["node"]]
+    # Node names do not follow the worker names, any restarted node will do
+    if nodes and not any(name in known for name in names):
+        return sorted(nodes)[0]
+    return None
+
+workers = PAYLOAD["workers"]
+errors = {}
+ready = {}
+start = time.time()
+
+for worker in workers:
+    signal = worker["signal"] or PAYLOAD["signal"]
+    if signal == "restart":
+        code, output = sh("supervisorctl restart %s" % worker["program"])
+    else:
+        code, output = sh("supervisorctl pid %s | xargs -r kill -s %s" % (worker["program"], signal))
+    if code:
+        errors[worker["name"]] = output.strip()[-200:] or "exit code %d" % code
+
+if PAYLOAD["wait"]:
+    time.sleep(PAYLOAD["grace"])
+
+while PAYLOAD["wait"] and len(ready) + len(errors) < len(workers) and time.time() - start < PAYLOAD["timeout"]:
+    elapsed = time.time() - start
+    code, output = sh("supervisorctl status %s" % " ".join(worker["program"] for worker in workers))
+    running = set(line.split()[0] for line in output.splitlines() if len(line.split()) > 1 and line.split()[1] == "RUNNING")
+    pending = [worker for worker in workers if worker["name"] not in ready and worker["name"] not in errors]
+    nodes = celery_nodes() if any(worker["kind"] == "celery" for worker in pending) else {}
+
+    for worker in pending:
+        if worker["program"] not in running:
+            continue
+        if worker["kind"] == "celery":
+            node = celery_node(worker, nodes)
+            if node is None or (nodes[node] is not None and nodes[node] > elapsed + 1):
+                continue
+        ready[worker["name"]] = time.time() - start
+
+    time.sleep(PAYLOAD["interval"])
+
+print(PAYLOAD["marker"] + json.dumps({"ready": ready, "errors": errors, "elapsed": time.time() - start}))
+'''
+
+
+def _program(name):
+    return "{program_name}:{part}_{name}".format(program_name=env.supervisor_program, part=env.project_name, name=name)
+
+
+def worker_programs(include_beat=True, include_huey=True):
+    """
+    Supervisor programs of the background workers: one per `celery_workers` entry (or the default worker),
+    celerybeat and huey.
+    """
+    workers = []
+
+    if env.celery_enabled:
+        if env.celery_workers:
+            for worker in env.celery_workers:
+                workers.append({'name': worker, 'program': _program("celeryd_{0}".format(worker)), 'kind': 'celery', 'node': worker, 'signal': None})
+        else:
+            workers.append({'name': 'celeryd', 'program': _program("celeryd"), 'kind': 'celery', 'node': None, 'signal': None})
+
+        if include_beat and env.celerybeat_enabled:
+            workers.append({'name': 'celerybeat', 'program': _program("celerybeat"), 'kind': 'supervisor', 'node': None, 'signal': None})
+
+    if include_huey and env.huey_enabled:
+        # Huey does not reload on HUP, supervisor restarts it
+        workers.append({'name': 'huey', 'program': _program("huey"), 'kind': 'supervisor', 'node': None, 'signal': 'restart'})
+
+    return workers
+
+
+def signal_workers(workers, signal, wait=True, timeout=None):
+    """
+    Send ``signal`` (or ``"restart"`` through supervisor) to all ``workers`` in one remote call and,
+    with ``wait``, poll until each of them is running again. Returns ``{'ready', 'errors', 'elapsed'}``.
+    """
+    payload = {
+        'workers': workers,
+        'signal': signal,
+        'wait': wait,
+        'timeout': timeout or env.get('worker_ready_timeout') or DEFAULT_READY_TIMEOUT,
+        'grace': 1.0,
+        'interval': 1.0,
+        'celery': CELERY_COMMAND,
+        'marker': RESULT_MARKER,
+    }
+
+    with cd(env.deploy_path), settings(hide('running', 'stdout'), warn_only=True):
+        output = venv_run(python_command(RELOAD_SCRIPT, payload))
+
+    for line in output.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+
+    abort("Signalling workers failed: {0}".format(output.strip()[-500:]))
+
+
+def print_summary(workers, result, title=" Workers "):
+    from terminaltables import AsciiTable
+
+    rows = [['Worker', 'Program', 'Ready after [s]', 'Result']]
+
+    for worker in workers:
+        name = worker['name']
+
+        if name in result['errors']:
+            status = result['errors'][name]
+        elif name in result['ready']:
+            status = 'OK'
+        else:
+            status = 'NOT READY'
+
+        rows.append([name,
+                     worker['program'],
+                     '{0:.1f}'.format(result['ready'][name]) if name in result['ready'] else '-',
+                     status])
+
+    table = AsciiTable(rows, title)
+    table.justify_columns[2] = 'right'
+
+    print_table(table)
+
+
+def reload_workers(signal='HUP', timeout=None):
+    workers = worker_programs()
+
+    if not workers:
+        return
+
+    print(Fore.BLUE + "Reloading {0} worker(s) with {1}".format(len(workers), signal))
+
+    result = signal_workers(workers, signal, wait=True, timeout=timeout)
+    print_summary(workers, result)
+
+    not_ready = [worker['name'] for worker in workers if worker['name'] not in result['ready']]
+
+    if not_ready and not env.warn_only:
+        abort("Worker(s) not ready after {0:.0f} s: {1}".format(result['elapsed'], ", ".join(not_ready)))
+
+    print(Fore.GREEN + Style.BRIGHT + "All workers ready in {0:.1f} s".format(result['elapsed']))